@@ -1,3 +1,5 @@
 from django.contrib import admin
+from .models import HistoryEntry, HistorySnapshot
 
-# Register your models here.
+admin.site.register(HistoryEntry)
+admin.site.register(HistorySnapshot)
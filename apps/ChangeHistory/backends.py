@@ -0,0 +1,240 @@
+"""Storage backends used by the ChangeHistoryMixin to persist history entries.
+
+A history entry is a dict of the form
+    {
+        "who"  : "<value returned by history__get_user_hook>",  # optional
+        "when" : "<isoformat timestamp>",
+        "what" : [ { "field": <name>, "prev": <value>, "cur": <value> }, ... ],
+    }
+
+The mixin builds the entry and hands it over to a backend which decides where it is
+stored. Two backends are provided:
+
+FieldHistoryBackend -- The original behavior. Entries are prepended to the JSON list
+                       stored in the 'history' column of the model's own row.
+TableHistoryBackend -- Entries are appended as individual rows in the HistoryEntry
+                       table. A save only costs one small INSERT and reads of the model
+                       never pay for the history.
+
+The backend is chosen per model by setting 'history__backend' on the model or globally
+by setting CHANGE_HISTORY_BACKEND to the dotted path of the backend class. A backend only
+reads the entries it stored itself: after switching, run 'python manage.py move_history'
+to move the history recorded before into the new backend.
+"""
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Backend used when neither the model nor the settings specify one.
+DEFAULT_HISTORY_BACKEND = 'apps.ChangeHistory.backends.FieldHistoryBackend'
+
+# Backend instances are stateless. Cache them against their dotted path so that we do
+# not import and instantiate the class on every save.
+_backend_cache = {}
+
+# Number of rows written per query by the bulk operations.
+BULK_BATCH_SIZE = 500
+
+
+def get_history_backend(path=None):
+    """Returns the backend instance corresponding to the dotted path passed.
+
+    Keyword Arguments:
+        path {str} -- Dotted path of the backend class. When None the value of the
+                      setting CHANGE_HISTORY_BACKEND is used. (default: {None})
+
+    Returns:
+        BaseHistoryBackend -- Instance of the configured backend.
+    """
+    if path is None:
+        path = getattr(settings, 'CHANGE_HISTORY_BACKEND', DEFAULT_HISTORY_BACKEND)
+
+    backend = _backend_cache.get(path)
+    if backend is None:
+        backend = import_string(path)()
+        _backend_cache[path] = backend
+    return backend
+
+
+class BaseHistoryBackend:
+    """Interface which all the history backends implement.
+
+    The mixin calls 'before_save' before the model row is written and 'after_save' once
+    it has been written (and hence has a pk). A backend only needs to implement one of
+    them depending on whether it stores the entry along with the row or separately.
+    """
+
+    def before_save(self, instance, entry):
+        pass
+
+    def after_save(self, instance, entry):
+        pass
+
+    def bulk_after_save(self, model, entries_by_pk, scope_by_pk=None):
+        """Counterpart of after_save() for objects created in bulk (Eg: by bulk_create).
+        before_save() is expected to have been called for each object before it was
+        written. Arguments are the same as bulk_record().
+        """
+        pass
+
+    def bulk_record(self, model, entries_by_pk, scope_by_pk=None):
+        """Stores one history entry for each of many objects of the model at once
+        without saving the objects. Used by ChangeHistoryQuerySet.tracked_update().
+
+        Arguments:
+            model {Model} -- Model class of the objects.
+            entries_by_pk {dict} -- pk of the object -> history entry to be stored.
+
+        Keyword Arguments:
+            scope_by_pk {dict} -- pk of the object -> value of its history__scope_field
+                                  when already known to the caller. Fetched when None.
+        """
+        raise NotImplementedError('subclasses of BaseHistoryBackend must provide a '
+                                  'bulk_record() method')
+
+    def get_history(self, instance, limit=None):
+        """Returns the list of history entries of the instance, newest first.
+
+        Arguments:
+            instance {ChangeHistoryMixin} -- Object whose history is required.
+
+        Keyword Arguments:
+            limit {int} -- Max number of entries to return. None returns all of them.
+        """
+        raise NotImplementedError('subclasses of BaseHistoryBackend must provide a '
+                                  'get_history() method')
+
+
+class FieldHistoryBackend(BaseHistoryBackend):
+    """Stores the history as a JSON list in the 'history' field of the object itself."""
+
+    def before_save(self, instance, entry):
+        # prepend this entry into the list
+        if isinstance(instance.history, list):
+            instance.history.insert(0, entry)
+            max_count = instance.history__max_entry_count
+            if isinstance(max_count, int) and max_count >= 0:
+                # Value has been specified. Trim the list. Value of 0 deletes the whole list.
+                del instance.history[max_count:]
+            logger.debug('Added the following record to history:\n %s' % (str(entry),))
+        else:
+            logger.error("History field not saved initially as list!!")
+
+    def bulk_record(self, model, entries_by_pk, scope_by_pk=None):
+        # Every row has its own list which has to be read, prepended and written back.
+        objs = list(model._base_manager.filter(pk__in=list(entries_by_pk))
+                    .only('pk', 'history'))
+        for obj in objs:
+            self.before_save(obj, entries_by_pk[obj.pk])
+        model._base_manager.bulk_update(objs, ['history'], batch_size=BULK_BATCH_SIZE)
+
+    def get_history(self, instance, limit=None):
+        history = instance.history
+        if not isinstance(history, list):
+            return []
+        if limit is not None:
+            return history[:limit]
+        return history
+
+
+class TableHistoryBackend(BaseHistoryBackend):
+    """Stores every history entry as a separate row in the HistoryEntry table.
+
+    The table is append-only. history__max_entry_count is only applied while reading
+    so that no rows are ever deleted as part of a save.
+
+    Every changed field is also written as a row in the FieldChange table which is
+    indexed for the audit log queries.
+    """
+
+    def after_save(self, instance, entry):
+        # Imported here as the models module imports this module.
+        from .models import HistoryEntry, FieldChange
+
+        fields = self.entry_to_fields(instance._meta.label_lower, instance.pk, entry)
+        HistoryEntry.objects.create(**fields)
+        FieldChange.objects.bulk_create(
+            self.entry_to_changes(fields, self.get_scope(instance)))
+        logger.debug('Added the following record to history table:\n %s' % (str(entry),))
+
+    def bulk_after_save(self, model, entries_by_pk, scope_by_pk=None):
+        self.bulk_record(model, entries_by_pk, scope_by_pk=scope_by_pk)
+
+    def bulk_record(self, model, entries_by_pk, scope_by_pk=None):
+        from .models import HistoryEntry, FieldChange
+
+        model_label = model._meta.label_lower
+        if scope_by_pk is None:
+            scope_by_pk = {}
+            if model.history__scope_field is not None:
+                scope_attname = model._meta.get_field(model.history__scope_field).attname
+                scope_by_pk = dict(model._base_manager.filter(pk__in=list(entries_by_pk))
+                                   .values_list('pk', scope_attname))
+
+        rows = []
+        changes = []
+        for pk, entry in entries_by_pk.items():
+            fields = self.entry_to_fields(model_label, pk, entry)
+            rows.append(HistoryEntry(**fields))
+            changes.extend(self.entry_to_changes(fields, scope_by_pk.get(pk)))
+        HistoryEntry.objects.bulk_create(rows, batch_size=BULK_BATCH_SIZE)
+        FieldChange.objects.bulk_create(changes, batch_size=BULK_BATCH_SIZE)
+
+    @staticmethod
+    def get_scope(instance):
+        """Returns the raw value of the history__scope_field of the instance."""
+        if instance.history__scope_field is None:
+            return None
+        return getattr(instance, instance._meta.get_field(
+            instance.history__scope_field).attname)
+
+    @staticmethod
+    def entry_to_changes(fields, scope):
+        """Returns the unsaved FieldChange rows of the entry whose HistoryEntry field
+        values (see entry_to_fields) are passed.
+        """
+        from .models import FieldChange
+
+        return [FieldChange(model=fields['model'], object_id=fields['object_id'],
+                            who=fields['who'], when=fields['when'], scope=scope,
+                            field=change.get('field', ''),
+                            value=FieldChange.value_to_str(change.get('cur')),
+                            change=change)
+                for change in fields['what']]
+
+    def get_history(self, instance, limit=None):
+        from .models import HistoryEntry
+
+        if instance.pk is None:
+            return []
+
+        queryset = HistoryEntry.objects.for_instance(instance)
+        if limit is not None:
+            queryset = queryset[:limit]
+        return [row.as_entry() for row in queryset]
+
+    @staticmethod
+    def entry_to_fields(model_label, object_id, entry):
+        """Converts a history entry dict into the field values of a HistoryEntry row.
+        Used by the backend as well as the data migration exploding existing blobs.
+
+        Arguments:
+            model_label {str} -- '<app_label>.<model_name>' of the changed object.
+            object_id {int} -- pk of the changed object.
+            entry {dict} -- History entry built by the ChangeHistoryMixin.
+        """
+        when = entry.get('when')
+        if isinstance(when, str):
+            when = parse_datetime(when)
+
+        return {
+            'model': model_label,
+            'object_id': object_id,
+            'who': entry.get('who') or '',
+            'when': when,
+            'what': entry.get('what', []),
+        }
@@ -0,0 +1,231 @@
+"""Serialization of the values stored in a HistoryField.
+
+The history is stored in a text column. A value can be encoded with one of the codecs
+below and optionally compressed. Anything other than plain uncompressed JSON is stored
+with a self describing header followed by the base64 encoded payload:
+
+    HF1:<codec>:<compression>:<base64 payload>
+
+Plain JSON never starts with 'H' and is stored as is, so rows written before codecs
+were introduced (and rows written with the default settings) keep loading unchanged.
+
+Codecs      -- 'json' (stdlib), 'orjson' (if installed), 'msgpack' (if installed)
+Compression -- 'none', 'zlib', 'zstd' (if zstandard is installed)
+"""
+
+import base64
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HEADER_PREFIX = 'HF1:'
+
+CODEC_JSON = 'json'
+CODEC_ORJSON = 'orjson'
+CODEC_MSGPACK = 'msgpack'
+
+COMPRESSION_NONE = 'none'
+COMPRESSION_ZLIB = 'zlib'
+COMPRESSION_ZSTD = 'zstd'
+
+# Payloads smaller than this are never compressed. The diffs stored per change are
+# generally tiny and compressing them only adds the header and CPU time.
+DEFAULT_COMPRESS_MIN_BYTES = 256
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _json_dumps(value):
+    return json.dumps(value).encode('utf-8')
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+
+def _orjson_dumps(value):
+    return orjson.dumps(value)
+
+
+def _msgpack_dumps(value):
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_loads(data):
+    return msgpack.unpackb(data, raw=False)
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def available_codecs():
+    """Returns a dict of codec name -> (dumps, loads) for the codecs installed."""
+    codecs = {CODEC_JSON: (_json_dumps, _json_loads)}
+    if orjson is not None:
+        codecs[CODEC_ORJSON] = (_orjson_dumps, orjson.loads)
+    if msgpack is not None:
+        codecs[CODEC_MSGPACK] = (_msgpack_dumps, _msgpack_loads)
+    return codecs
+
+
+def available_compressions():
+    """Returns a dict of compression name -> (compress, decompress) installed."""
+    compressions = {
+        COMPRESSION_NONE: (bytes, bytes),
+        COMPRESSION_ZLIB: (zlib.compress, zlib.decompress),
+    }
+    if zstandard is not None:
+        compressions[COMPRESSION_ZSTD] = (_zstd_compress, _zstd_decompress)
+    return compressions
+
+
+_CODECS = available_codecs()
+_COMPRESSIONS = available_compressions()
+
+# Plain JSON is decoded with the fastest JSON library installed.
+_plain_json_loads = orjson.loads if orjson is not None else json.loads
+
+
+def is_json_codec(codec):
+    return codec in (CODEC_JSON, CODEC_ORJSON)
+
+
+def encode(value, codec=CODEC_JSON, compression=COMPRESSION_NONE,
+           compress_min_bytes=DEFAULT_COMPRESS_MIN_BYTES):
+    """Encodes the value into the string to be stored in the DB.
+
+    Arguments:
+        value {list|dict} -- JSON serializable value.
+
+    Keyword Arguments:
+        codec {str} -- Name of the codec used to serialize the value.
+        compression {str} -- Name of the compression applied on the serialized value.
+        compress_min_bytes {int} -- Serialized values smaller than this are not compressed.
+
+    Raises:
+        CodecError: When the codec or compression is unknown or not installed.
+
+    Returns:
+        str -- Value to be stored in the text column.
+    """
+    if codec not in _CODECS:
+        raise CodecError("History codec '%s' is not available." % (codec,))
+    if compression not in _COMPRESSIONS:
+        raise CodecError("History compression '%s' is not available." % (compression,))
+
+    dumps = _CODECS[codec][0]
+    data = dumps(value)
+
+    if compression != COMPRESSION_NONE and len(data) < compress_min_bytes:
+        compression = COMPRESSION_NONE
+
+    if compression == COMPRESSION_NONE and is_json_codec(codec):
+        # Store plain JSON without any header. Readable and backward compatible.
+        return data.decode('utf-8')
+
+    compress = _COMPRESSIONS[compression][0]
+    payload = base64.b64encode(compress(data)).decode('ascii')
+    return '%s%s:%s:%s' % (HEADER_PREFIX, codec, compression, payload)
+
+
+def parse_header(raw):
+    """Returns the (codec, compression) used to encode the stored string."""
+    if not raw.startswith(HEADER_PREFIX):
+        return CODEC_JSON, COMPRESSION_NONE
+    codec, compression = raw[len(HEADER_PREFIX):].split(':', 2)[:2]
+    return codec, compression
+
+
+def decode(raw):
+    """Decodes the string stored in the DB back into the value.
+
+    Arguments:
+        raw {str} -- String read from the text column.
+
+    Raises:
+        CodecError: When the string was encoded with a codec or compression which is
+                    not installed.
+    """
+    if not raw.startswith(HEADER_PREFIX):
+        return _plain_json_loads(raw)
+
+    try:
+        codec, compression, payload = raw[len(HEADER_PREFIX):].split(':', 2)
+    except ValueError:
+        raise CodecError("Malformed history header.")
+
+    if codec not in _CODECS:
+        raise CodecError("History codec '%s' is not available." % (codec,))
+    if compression not in _COMPRESSIONS:
+        raise CodecError("History compression '%s' is not available." % (compression,))
+
+    decompress = _COMPRESSIONS[compression][1]
+    loads = _CODECS[codec][1]
+    return loads(decompress(base64.b64decode(payload)))
+
+
+class LazyDecodedList(list):
+    """A list which holds the string read from the DB and decodes it only when the list
+    is first accessed. Objects which are loaded but whose history is never looked at
+    never pay for decoding it.
+
+    NOTE: Serializers implemented in C (json, orjson) read the items of a list directly.
+    Call materialize() before passing an instance to them. HistoryField handles this
+    when saving by writing back the raw string of a list which was never decoded.
+    """
+
+    def __init__(self, raw):
+        super(LazyDecodedList, self).__init__()
+        self.raw = raw
+
+    @property
+    def is_decoded(self):
+        return self.raw is None
+
+    def materialize(self):
+        if self.raw is not None:
+            raw = self.raw
+            self.raw = None
+            list.extend(self, decode(raw))
+        return self
+
+
+def _decode_before(method_name):
+    method = getattr(list, method_name)
+
+    def wrapper(self, *args, **kwargs):
+        if self.raw is not None:
+            self.materialize()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = method_name
+    return wrapper
+
+
+for _method_name in ('__len__', '__iter__', '__reversed__', '__getitem__', '__setitem__',
+                     '__delitem__', '__contains__', '__eq__', '__ne__', '__lt__', '__le__',
+                     '__gt__', '__ge__', '__add__', '__iadd__', '__mul__', '__imul__',
+                     '__rmul__', '__repr__', 'append', 'extend', 'insert', 'pop', 'remove',
+                     'index', 'count', 'sort', 'reverse', 'clear', 'copy'):
+    setattr(LazyDecodedList, _method_name, _decode_before(_method_name))
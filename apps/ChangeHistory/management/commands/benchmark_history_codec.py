@@ -0,0 +1,72 @@
+"""Management command comparing the codecs and compressions available for HistoryField.
+
+For a synthetic history of the given number of entries (shaped like the entries stored
+for a Resource) it reports the average encode time, decode time and the number of
+bytes stored in the DB for every codec/compression combination installed.
+
+Usage:
+    python manage.py benchmark_history_codec
+    python manage.py benchmark_history_codec --entries 100 --iterations 500
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.ChangeHistory import codec as history_codec
+
+
+def build_sample_history(entry_count):
+    """Returns a list of history entries similar to the ones recorded for a Resource."""
+    statuses = ['Assigned', 'Acknowledged', 'Disputed']
+    history = []
+    for i in range(entry_count):
+        history.append({
+            "who": "user%d@trackzilla.in" % (i % 7,),
+            "when": timezone.now().isoformat(),
+            "what": [
+                {"field": "current_user", "prev": 1000 + i, "cur": 1001 + i},
+                {"field": "previous_user", "prev": 999 + i, "cur": 1000 + i},
+                {"field": "status", "prev": statuses[i % 3], "cur": statuses[(i + 1) % 3]},
+            ],
+        })
+    return history
+
+
+class Command(BaseCommand):
+    help = "Benchmarks encode/decode time and stored size of the HistoryField codecs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=100,
+                            help="Number of entries in the benchmarked history.")
+        parser.add_argument('--iterations', type=int, default=200,
+                            help="Number of encode/decode operations timed per format.")
+
+    def handle(self, *args, **options):
+        history = build_sample_history(options['entries'])
+        iterations = options['iterations']
+
+        self.stdout.write("History with %d entries, %d iterations per format" %
+                          (options['entries'], iterations))
+        self.stdout.write("%-10s %-6s %12s %12s %10s" %
+                          ('codec', 'comp', 'encode(us)', 'decode(us)', 'bytes'))
+
+        for codec_name in history_codec.available_codecs():
+            for compression in history_codec.available_compressions():
+                encoded = history_codec.encode(history, codec=codec_name,
+                                               compression=compression)
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    history_codec.encode(history, codec=codec_name, compression=compression)
+                encode_us = (time.perf_counter() - start) * 1e6 / iterations
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    history_codec.decode(encoded)
+                decode_us = (time.perf_counter() - start) * 1e6 / iterations
+
+                self.stdout.write("%-10s %-6s %12.1f %12.1f %10d" % (
+                    codec_name, compression, encode_us, decode_us,
+                    len(encoded.encode('utf-8'))))
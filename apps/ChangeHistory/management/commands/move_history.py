@@ -0,0 +1,173 @@
+"""Management command which moves the history of the objects tracked by the
+ChangeHistoryMixin into the backend configured for their model (the model's
+history__backend or CHANGE_HISTORY_BACKEND). Each backend only reads the entries it
+stored itself, hence run it after switching the backend:
+
+    TableHistoryBackend -- The entries in the 'history' column of the rows are appended
+                           to the HistoryEntry table (along with their FieldChange rows)
+                           and the column is emptied. Same as the migration
+                           ChangeHistory.0002 did for the Resources.
+    FieldHistoryBackend -- The HistoryEntry rows of every object are written back into
+                           its 'history' column, merged with the entries already there,
+                           newest first. Its HistoryEntry and FieldChange rows are
+                           deleted. Run it after the migrations when using this backend,
+                           as ChangeHistory.0002 moves the history into the table.
+
+The snapshots of the objects moved are deleted, 'snapshot_history' takes them again.
+Rows are processed in batches ordered by pk, one transaction per batch. Safe to
+interrupt and rerun: the entries moved are not in the source any more.
+
+Usage:
+    python manage.py move_history
+    python manage.py move_history --model Resource.Resource --dry-run
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from apps.ChangeHistory.backends import (
+    get_history_backend, FieldHistoryBackend, TableHistoryBackend,
+)
+from apps.ChangeHistory.models import (
+    ChangeHistoryMixin, FieldChange, HistoryEntry, HistorySnapshot,
+)
+
+
+def _entry_time(entry):
+    when = entry.get('when')
+    return parse_datetime(when) if isinstance(when, str) else when
+
+
+class Command(BaseCommand):
+    help = "Moves the history of the tracked objects into the configured history backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models',
+                            help="'<app_label>.<Model>' to move. Can be repeated. "
+                                 "Defaults to all models tracked by the "
+                                 "ChangeHistoryMixin.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of objects moved per transaction.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report the number of entries to move.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size should be a positive number.")
+
+        if options['models']:
+            try:
+                model_list = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+            for model in model_list:
+                if not issubclass(model, ChangeHistoryMixin):
+                    raise CommandError("%s is not tracked by the ChangeHistoryMixin." %
+                                       (model._meta.label,))
+        else:
+            model_list = [model for model in apps.get_models()
+                          if issubclass(model, ChangeHistoryMixin)]
+
+        for model in model_list:
+            backend = get_history_backend(model.history__backend)
+            if isinstance(backend, TableHistoryBackend):
+                moved_count = self.move_to_table(model, options['batch_size'],
+                                                 options['dry_run'])
+                target = 'the HistoryEntry table'
+            elif isinstance(backend, FieldHistoryBackend):
+                moved_count = self.move_to_field(model, options['batch_size'],
+                                                 options['dry_run'])
+                target = "the 'history' column"
+            else:
+                raise CommandError("%s: cannot move the history into %s." %
+                                   (model._meta.label, type(backend).__name__))
+            self.stdout.write("%s: %s %d entries to %s" % (
+                model._meta.label, 'would move' if options['dry_run'] else 'moved',
+                moved_count, target))
+
+    def move_to_table(self, model, batch_size, dry_run):
+        model_label = model._meta.label_lower
+        columns = ['pk', 'history']
+        if model.history__scope_field is not None:
+            columns.append(model._meta.get_field(model.history__scope_field).attname)
+        queryset = model._base_manager.order_by('pk')
+
+        moved_count = 0
+        last_pk = None
+        while True:
+            batch_qset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_qset.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+
+            with transaction.atomic():
+                # Locked: an entry saved meanwhile would be lost when emptying the column.
+                locked_rows = model._base_manager.filter(pk__in=batch) \
+                    .select_for_update().values_list(*columns)
+                rows, changes, pks = [], [], []
+                for pk, history, *scope in locked_rows:
+                    if not history:
+                        continue
+                    # Entries are stored newest first. Inserted oldest first so that the
+                    # ids are in the same order as the timestamps.
+                    for entry in reversed(history):
+                        fields = TableHistoryBackend.entry_to_fields(model_label, pk,
+                                                                     entry)
+                        rows.append(HistoryEntry(**fields))
+                        changes.extend(TableHistoryBackend.entry_to_changes(
+                            fields, scope[0] if scope else None))
+                    pks.append(pk)
+                moved_count += len(rows)
+                if not pks or dry_run:
+                    continue
+
+                HistoryEntry.objects.bulk_create(rows, batch_size=batch_size)
+                FieldChange.objects.bulk_create(changes, batch_size=batch_size)
+                HistorySnapshot.objects.filter(model=model_label,
+                                               object_id__in=pks).delete()
+                model._base_manager.filter(pk__in=pks).update(history=[])
+        return moved_count
+
+    def move_to_field(self, model, batch_size, dry_run):
+        model_label = model._meta.label_lower
+        queryset = model._base_manager.order_by('pk')
+
+        moved_count = 0
+        last_pk = None
+        while True:
+            batch_qset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_qset.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+
+            with transaction.atomic():
+                last_entry_id = 0
+                entries_by_pk = {}
+                for row in HistoryEntry.objects.filter(model=model_label,
+                                                       object_id__in=batch):
+                    last_entry_id = max(last_entry_id, row.id)
+                    moved_count += 1
+                    entries_by_pk.setdefault(row.object_id, []).append(row.as_entry())
+                if not entries_by_pk or dry_run:
+                    continue
+
+                objs = list(model._base_manager.filter(pk__in=list(entries_by_pk))
+                            .only('pk', 'history').select_for_update())
+                for obj in objs:
+                    history = list(obj.history or []) + entries_by_pk[obj.pk]
+                    history.sort(key=_entry_time, reverse=True)
+                    obj.history = history
+                model._base_manager.bulk_update(objs, ['history'], batch_size=batch_size)
+                # Only the entries read. Not the ones a save may have added meanwhile.
+                HistoryEntry.objects.filter(model=model_label,
+                                            object_id__in=list(entries_by_pk),
+                                            id__lte=last_entry_id).delete()
+                for related_model in (FieldChange, HistorySnapshot):
+                    related_model.objects.filter(model=model_label,
+                                                 object_id__in=list(entries_by_pk)) \
+                        .delete()
+        return moved_count
@@ -0,0 +1,92 @@
+"""Management command which rewrites the values stored in HistoryFields using the
+currently configured codec and compression (settings CHANGE_HISTORY_CODEC and
+CHANGE_HISTORY_COMPRESSION or the values passed to the field).
+
+Rows are processed in batches ordered by pk and only the rows whose stored format
+differs from the target format are written back. Safe to interrupt and rerun.
+
+Usage:
+    python manage.py rewrite_history
+    python manage.py rewrite_history --model Resource.Resource --batch-size 1000
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+from django.db.models.functions import Cast
+
+from apps.ChangeHistory.models import HistoryField
+from apps.ChangeHistory import codec as history_codec
+
+
+class Command(BaseCommand):
+    help = "Rewrites the stored history values using the configured codec and compression."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models',
+                            help="'<app_label>.<Model>' to rewrite. Can be repeated. "
+                                 "Defaults to all models having a HistoryField.")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Number of rows read and written per batch.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report the number of rows needing a rewrite.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size should be a positive number.")
+
+        if options['models']:
+            try:
+                model_list = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+        else:
+            model_list = apps.get_models()
+
+        for model in model_list:
+            history_fields = [field for field in model._meta.concrete_fields
+                              if isinstance(field, HistoryField)]
+            for field in history_fields:
+                self.rewrite_field(model, field, options['batch_size'], options['dry_run'])
+
+    def rewrite_field(self, model, field, batch_size, dry_run):
+        target = (field.get_codec(), field.get_compression())
+        # Read the raw stored string so that rows already in the target format are
+        # skipped without decoding them.
+        raw_name = 'raw_%s' % (field.name,)
+        queryset = model._base_manager.annotate(
+            **{raw_name: Cast(field.name, output_field=models.TextField())}
+        ).order_by('pk')
+
+        scanned_count = 0
+        rewritten_count = 0
+        last_pk = None
+        while True:
+            batch_qset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            batch = list(batch_qset.values_list('pk', raw_name)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            scanned_count += len(batch)
+
+            objs = []
+            for pk, raw in batch:
+                if not raw or history_codec.parse_header(raw) == target:
+                    continue
+                value = history_codec.decode(raw)
+                # Small values are stored uncompressed even when compression is enabled.
+                if field.get_prep_value(value) == raw:
+                    continue
+                obj = model(pk=pk)
+                setattr(obj, field.attname, value)
+                objs.append(obj)
+
+            if objs and not dry_run:
+                with transaction.atomic():
+                    model._base_manager.bulk_update(objs, [field.name])
+            rewritten_count += len(objs)
+
+        self.stdout.write("%s.%s: scanned %d rows, %s %d rows to %s/%s" % (
+            model._meta.label, field.name, scanned_count,
+            'would rewrite' if dry_run else 'rewrote', rewritten_count,
+            target[0], target[1]))
@@ -0,0 +1,62 @@
+"""Management command which snapshots the state of the objects tracked by the
+ChangeHistoryMixin. An object is snapshotted once CHANGE_HISTORY_SNAPSHOT_EVERY entries
+have been recorded since its last snapshot. See snapshots.py
+
+Should be run periodically (Eg: nightly from cron). Safe to interrupt and rerun.
+
+Usage:
+    python manage.py snapshot_history
+    python manage.py snapshot_history --model Resource.Resource --every 20
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.ChangeHistory.backends import get_history_backend, TableHistoryBackend
+from apps.ChangeHistory.models import ChangeHistoryMixin
+from apps.ChangeHistory.snapshots import take_snapshots, get_snapshot_every
+
+
+class Command(BaseCommand):
+    help = "Snapshots the tracked objects having enough new history entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models',
+                            help="'<app_label>.<Model>' to snapshot. Can be repeated. "
+                                 "Defaults to all models storing their history in the "
+                                 "HistoryEntry table.")
+        parser.add_argument('--every', type=int, default=None,
+                            help="Number of new entries after which an object is "
+                                 "snapshotted. Defaults to CHANGE_HISTORY_SNAPSHOT_EVERY.")
+        parser.add_argument('--force', action='store_true',
+                            help="Snapshot every object having at least one new entry.")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Number of objects processed per transaction.")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0:
+            raise CommandError("--chunk-size should be a positive number.")
+        every = options['every'] if options['every'] is not None else get_snapshot_every()
+        if every <= 0:
+            raise CommandError("--every should be a positive number.")
+
+        if options['models']:
+            try:
+                model_list = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+        else:
+            model_list = [
+                model for model in apps.get_models()
+                if issubclass(model, ChangeHistoryMixin) and
+                isinstance(get_history_backend(model.history__backend), TableHistoryBackend)
+            ]
+
+        for model in model_list:
+            try:
+                written_count = take_snapshots(
+                    model._base_manager.all(), every=every,
+                    chunk_size=options['chunk_size'], force=options['force'])
+            except (AttributeError, ValueError) as e:
+                raise CommandError("%s: %s" % (model._meta.label, e))
+            self.stdout.write("%s: wrote %d snapshots" % (model._meta.label, written_count))
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:48
+
+import apps.ChangeHistory.models
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('who', models.CharField(blank=True, max_length=254)),
+                ('when', models.DateTimeField(default=django.utils.timezone.now)),
+                ('what', apps.ChangeHistory.models.HistoryField(default=list)),
+            ],
+            options={
+                'verbose_name': 'history entry',
+                'verbose_name_plural': 'history entries',
+                'ordering': ['-when', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='historyentry',
+            index=models.Index(fields=['model', 'object_id', '-when'], name='changehist_obj_when_idx'),
+        ),
+    ]
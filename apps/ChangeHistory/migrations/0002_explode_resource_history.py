@@ -0,0 +1,107 @@
+"""Data migration which moves the history stored as a JSON list in the 'history' column
+of every Resource into the HistoryEntry table, one row per entry. The column is emptied
+once its entries have been copied.
+
+The history is always moved, whichever backend is configured: the migration only
+depends on the schema. Deployments using the FieldHistoryBackend run
+'python manage.py move_history' afterwards, which moves it back into the column.
+
+Ordering: the migrations of the Resource app are generated at deploy time
+(docker-entrypoint.sh runs 'makemigrations' before 'migrate'). This migration needs the
+first of them to create the Resource table with its 'history' column, as the model
+always had, and has to run before any later Resource migration dropping that column.
+"""
+
+from django.db import migrations
+from django.utils.dateparse import parse_datetime
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of resources processed per batch. Keeps the memory bounded for large tables.
+BATCH_SIZE = 500
+
+
+def entry_to_fields(model_label, object_id, entry):
+    """Frozen copy of TableHistoryBackend.entry_to_fields() as of this migration."""
+    when = entry.get('when')
+    if isinstance(when, str):
+        when = parse_datetime(when)
+
+    return {
+        'model': model_label,
+        'object_id': object_id,
+        'who': entry.get('who') or '',
+        'when': when,
+        'what': entry.get('what', []),
+    }
+
+
+def explode_history(apps, schema_editor):
+    ResourceModel = apps.get_model('Resource', 'Resource')
+    HistoryEntryModel = apps.get_model('ChangeHistory', 'HistoryEntry')
+
+    model_label = ResourceModel._meta.label_lower
+
+    def flush(rows, res_ids):
+        HistoryEntryModel.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        ResourceModel.objects.filter(pk__in=res_ids).update(history=[])
+
+    rows = []
+    res_ids = []
+    moved_count = 0
+    # Only fetch the two columns we need. values_list also avoids instantiating the
+    # model objects.
+    res_qset = ResourceModel.objects.values_list('id', 'history')
+    for res_id, history in res_qset.iterator(chunk_size=BATCH_SIZE):
+        if not history:
+            continue
+        # Entries are stored newest first. Insert them oldest first so that the ids are
+        # in the same order as the timestamps.
+        for entry in reversed(history):
+            rows.append(HistoryEntryModel(
+                **entry_to_fields(model_label, res_id, entry)))
+        res_ids.append(res_id)
+        moved_count += len(history)
+
+        if len(res_ids) >= BATCH_SIZE:
+            flush(rows, res_ids)
+            rows, res_ids = [], []
+
+    if res_ids:
+        flush(rows, res_ids)
+
+    logger.info("Moved %d history entries into the HistoryEntry table." % (moved_count,))
+
+
+def implode_history(apps, schema_editor):
+    ResourceModel = apps.get_model('Resource', 'Resource')
+    HistoryEntryModel = apps.get_model('ChangeHistory', 'HistoryEntry')
+    model_label = ResourceModel._meta.label_lower
+
+    res_id_list = ResourceModel.objects.values_list('id', flat=True)
+    for res_id in res_id_list.iterator(chunk_size=BATCH_SIZE):
+        entries = HistoryEntryModel.objects.filter(model=model_label, object_id=res_id)
+        history = []
+        for row in entries.order_by('-when', '-id'):
+            entry = {"when": row.when.isoformat(), "what": row.what}
+            if row.who:
+                entry["who"] = row.who
+            history.append(entry)
+        if history:
+            ResourceModel.objects.filter(pk=res_id).update(history=history)
+            entries.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChangeHistory', '0001_initial'),
+        # Required to reference `Resource` in `apps.get_model()`. See the ordering note
+        # in the module docstring.
+        ('Resource', '__first__'),
+    ]
+
+    operations = [
+        migrations.RunPython(explode_history, implode_history),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:59
+
+import apps.ChangeHistory.models
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChangeHistory', '0002_explode_resource_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistorySnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('when', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_entry_id', models.PositiveIntegerField(default=0)),
+                ('entry_count', models.PositiveIntegerField(default=0)),
+                ('state', apps.ChangeHistory.models.HistoryField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'history snapshot',
+                'verbose_name_plural': 'history snapshots',
+                'ordering': ['-when', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='historysnapshot',
+            index=models.Index(fields=['model', 'object_id', '-when'], name='changehist_snap_obj_when_idx'),
+        ),
+    ]
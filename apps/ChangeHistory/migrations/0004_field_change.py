@@ -0,0 +1,54 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:01
+
+import apps.ChangeHistory.models
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChangeHistory', '0003_history_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FieldChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('who', models.CharField(blank=True, max_length=254)),
+                ('when', models.DateTimeField(default=django.utils.timezone.now)),
+                ('scope', models.PositiveIntegerField(null=True)),
+                ('field', models.CharField(max_length=100)),
+                ('value', models.CharField(blank=True, max_length=255)),
+                ('change', apps.ChangeHistory.models.HistoryField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'field change',
+                'verbose_name_plural': 'field changes',
+                'ordering': ['-when', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='fieldchange',
+            index=models.Index(fields=['scope', '-when', '-id'], name='changehist_fc_scope_when_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fieldchange',
+            index=models.Index(fields=['scope', 'who', '-when', '-id'], name='changehist_fc_who_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fieldchange',
+            index=models.Index(fields=['scope', 'field', '-when', '-id'], name='changehist_fc_field_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fieldchange',
+            index=models.Index(fields=['scope', 'field', 'value', '-when', '-id'], name='changehist_fc_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fieldchange',
+            index=models.Index(fields=['scope', 'model', 'object_id', '-when', '-id'], name='changehist_fc_obj_idx'),
+        ),
+    ]
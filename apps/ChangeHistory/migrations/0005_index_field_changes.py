@@ -0,0 +1,90 @@
+"""Data migration which writes the FieldChange rows of the HistoryEntry rows recorded
+before the FieldChange table existed. The scope of the changes is read from the current
+value of the model's history__scope_field.
+"""
+
+from django.apps import apps as global_apps
+from django.db import migrations
+
+from apps.ChangeHistory.backends import TableHistoryBackend
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of entries processed per batch. Keeps the memory bounded for large tables.
+BATCH_SIZE = 500
+
+
+def _scope_of_model(model_label):
+    """Returns (model, attname of its scope field) or None. The hook attributes are not
+    available on the historical models, hence the current model is used.
+    """
+    try:
+        model = global_apps.get_model(model_label)
+    except LookupError:
+        return None
+    scope_field = getattr(model, 'history__scope_field', None)
+    if scope_field is None:
+        return None
+    return model, model._meta.get_field(scope_field).attname
+
+
+def index_field_changes(apps, schema_editor):
+    HistoryEntryModel = apps.get_model('ChangeHistory', 'HistoryEntry')
+    FieldChangeModel = apps.get_model('ChangeHistory', 'FieldChange')
+
+    scope_of_model = {}
+    indexed_count = 0
+    last_id = 0
+    while True:
+        batch = list(HistoryEntryModel.objects.filter(id__gt=last_id).order_by('id')
+                     .values_list('id', 'model', 'object_id', 'who', 'when', 'what')
+                     [:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        # Fetch the scope of all the objects of the batch. One query per model.
+        pks_by_label = {}
+        for _, label, object_id, _, _, _ in batch:
+            pks_by_label.setdefault(label, set()).add(object_id)
+        scope_by_obj = {}
+        for label, pks in pks_by_label.items():
+            if label not in scope_of_model:
+                scope_of_model[label] = _scope_of_model(label)
+            if scope_of_model[label] is None:
+                continue
+            model, scope_attname = scope_of_model[label]
+            for pk, scope in model._base_manager.filter(pk__in=pks).values_list(
+                    'pk', scope_attname):
+                scope_by_obj[(label, pk)] = scope
+
+        rows = []
+        for _, label, object_id, who, when, what in batch:
+            fields = {'model': label, 'object_id': object_id, 'who': who, 'when': when,
+                      'what': what or []}
+            for change in TableHistoryBackend.entry_to_changes(
+                    fields, scope_by_obj.get((label, object_id))):
+                rows.append(FieldChangeModel(
+                    model=change.model, object_id=change.object_id, who=change.who,
+                    when=change.when, scope=change.scope, field=change.field,
+                    value=change.value, change=change.change))
+        FieldChangeModel.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        indexed_count += len(rows)
+
+    logger.info("Indexed %d field changes." % (indexed_count,))
+
+
+def remove_field_changes(apps, schema_editor):
+    apps.get_model('ChangeHistory', 'FieldChange').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ChangeHistory', '0004_field_change'),
+    ]
+
+    operations = [
+        migrations.RunPython(index_field_changes, remove_field_changes),
+    ]
@@ -1,8 +1,14 @@
-from django.db import models
+import datetime
 
-import json
-from django.forms.models import model_to_dict
+from django.db import connections, models, transaction
+
+from django.conf import settings
 from django.utils import timezone
+from . import codec as history_codec
+from .backends import get_history_backend
+from .resolver import resolve_fk_display_names
+from .signals import history_bulk_updated
+from .snapshots import iter_states_as_of, DEFAULT_CHUNK_SIZE
 
 import logging
 logger = logging.getLogger(__name__)
@@ -10,27 +16,65 @@ logger = logging.getLogger(__name__)
 class HistoryField(models.TextField):
     description = "Essentially a Textfield which stores the JSON representation of the history list."
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, codec=None, compression=None, lazy=False, **kwargs):
+        """Accepts the codec and compression used to store the value. See codec.py
+        When None, the values of the settings CHANGE_HISTORY_CODEC and
+        CHANGE_HISTORY_COMPRESSION are used. Values are always decoded based on the
+        header they were stored with, so these can be changed at any point.
+
+        When lazy is True, values read from the DB are returned as a LazyDecodedList
+        which is only decoded when it is first accessed.
+        """
+        self.codec = codec
+        self.compression = compression
+        self.lazy = lazy
         super(HistoryField, self).__init__(*args, **kwargs)
 
-    def to_python(self, value):
-        if not value:
-            value = []
+    def deconstruct(self):
+        name, path, args, kwargs = super(HistoryField, self).deconstruct()
+        if self.codec is not None:
+            kwargs['codec'] = self.codec
+        if self.compression is not None:
+            kwargs['compression'] = self.compression
+        if self.lazy:
+            kwargs['lazy'] = True
+        return name, path, args, kwargs
+
+    def get_codec(self):
+        if self.codec is not None:
+            return self.codec
+        return getattr(settings, 'CHANGE_HISTORY_CODEC', history_codec.CODEC_JSON)
 
-        if isinstance(value, list):
+    def get_compression(self):
+        if self.compression is not None:
+            return self.compression
+        return getattr(settings, 'CHANGE_HISTORY_COMPRESSION',
+                       history_codec.COMPRESSION_NONE)
+
+    def to_python(self, value):
+        if isinstance(value, (list, dict)):
             return value
 
-        return json.loads(value)
+        if not value:
+            return []
+
+        return history_codec.decode(value)
 
     def from_db_value(self, value, expression, connection):
         if value is None:
             return value
-        return json.loads(value)
+        if self.lazy:
+            return history_codec.LazyDecodedList(value)
+        return history_codec.decode(value)
 
     def get_prep_value(self, value):
         if value is None:
             return value
-        return json.dumps(value)
+        if isinstance(value, history_codec.LazyDecodedList) and not value.is_decoded:
+            # Never looked at and hence never changed. Write back what was read.
+            return value.raw
+        return history_codec.encode(value, codec=self.get_codec(),
+                            compression=self.get_compression())
 
 
 class ChangeHistoryMixin(models.Model):
@@ -47,32 +91,45 @@ class ChangeHistoryMixin(models.Model):
     # History is stored in the field in JSON format. HistoryField is essentially a
     # Textfield with operations to serialize and de-serialize data.
     # TODO: Make the field name configurable like we are allowed in case of template_name in CBV
-    # TODO: Should I include Zlib compression like in PickleField() as the history can get quite long ?
-    # TODO: Also evaluate if it would be good idea to store History is a separate table. 
-    #       One entry for each Resource. Considering this as history can grow quite large.
-    #       It would give us the flexibility to trim it down and handle issues.
-    #       But having in the same table gives us benefits like ease of access, everything
-    #       under one entry.
+    # NOTE: The value can be stored using a faster codec and compressed. See codec.py
+    # NOTE: History can also be stored in a separate table (one row per change) by
+    #       configuring the TableHistoryBackend. See history__backend below. This field
+    #       is then left empty.
     # TODO: If we use PostgreSQL, this could also be a JSONField. I didn't want to restrict
     #       the database at this point hence using a custom TextField.
-    history = HistoryField(editable=True,default=[])
+    # The list is decoded only when accessed, views which do not display the history do
+    # not pay for parsing it. Use HistoryDeferringManager to not even load it.
+    history = HistoryField(editable=True, default=list, lazy=True)
 
-    # Hook Function, if defined, is called after the model is converted to dict using 
-    # model_to_dict function. This is required because at times we would want to handle 
-    # certain fields in a certain way Eg: Storing 'username' or email instead of ID value 
-    # for ForeignKeys.
+    # Hook Function, if defined, is called with a dict of the changed fields while the
+    # history entry is being formed. The dict maps the field name to the raw value
+    # stored in the model i.e. the id in case of ForeignKeys. It is called once for the
+    # previous values and once for the current values of the changed fields. This is
+    # required because at times we would want to handle certain fields in a certain way
+    # Eg: Storing 'username' or email instead of ID value for ForeignKeys.
     #
     # Example custom Serializer
     # def CustomFieldSerializer(instance, object_dict, *args, **kwargs):
     #   for field in object_dict:
-    #     field_val = getattr(instance,field)
-    #     if issubclass(field_val.__class__, User):
-    #         object_dict[field] = field_val.get_username()
+    #     if field == 'owner' and object_dict[field] is not None:
+    #         object_dict[field] = User.objects.get(pk=object_dict[field]).get_username()
 
     #     # Add other fields which need custom processing.
     #   return
     history__process_dict_hook = None
 
+    # ForeignKeys are stored as ids in the history diffs so that saving never fetches the
+    # related objects. While displaying, the ids are resolved in bulk (see resolver.py).
+    # Hook Function, if defined, is called with a related object and should return the
+    # string to be displayed for it. When None, str() of the object is displayed.
+    #
+    # Example display hook
+    # def CustomFKDisplayHook(related_obj):
+    #   if isinstance(related_obj, User):
+    #       return related_obj.get_username()
+    #   return str(related_obj)
+    history__fk_display_hook = None
+
     # Set the number of history entries we wish to store.
     # By default there is no limit and entries will be prepended. If a value is set, then
     # while inserting the record into the list we will trim out the extra entires. 
@@ -88,17 +145,113 @@ class ChangeHistoryMixin(models.Model):
     # which will be stored in the 'who' field. Function is not called when it is None.
     history__get_user_hook = None
 
+    # Dotted path of the backend used to store the history entries. See backends.py
+    # When None, the backend set in settings.CHANGE_HISTORY_BACKEND is used and if that
+    # is not set, entries are stored in the 'history' field itself.
+    history__backend = None
+
+    # Names of the fields whose changes should be tracked. When None, all the editable
+    # concrete fields other than the 'history' field itself are tracked.
+    history__tracked_fields = None
+
+    # Name of the field (generally a ForeignKey like 'org') whose raw value is stored
+    # along with every change in the FieldChange table by the TableHistoryBackend.
+    # Audit queries are always restricted to one scope. None stores no scope.
+    history__scope_field = None
+
+    # The initial state of the tracked fields is not captured when the object is created
+    # as most of the objects loaded (list pages, search results) are never modified.
+    # Instead it is captured just before a tracked field is first assigned a new value.
+    # The snapshot holds the raw values stored in the instance ('*_id' in case of
+    # ForeignKeys) so that taking it never results in a query.
+    # Below attribute is set to True at the end of __init__. Assignments made while the
+    # object is being constructed are not treated as changes.
+    _history__ready = False
+
     def __init__(self, *args, **kwargs):
         super(ChangeHistoryMixin, self).__init__(*args, **kwargs)
-        self.__initial = self._dict
+        self._history__ready = True
+
+    def __setattr__(self, name, value):
+        instance_dict = self.__dict__
+        if instance_dict.get('_history__ready') and name in self._history_tracked_names():
+            if '_history__initial' not in instance_dict:
+                instance_dict['_history__initial'] = self._history_snapshot()
+            attname = self._history__attname_map[name]
+            if (attname not in instance_dict['_history__initial'] and
+                    attname not in instance_dict and
+                    not instance_dict.get('_history__refreshing')):
+                # A deferred field is being changed. Load its current value so that
+                # the change can be recorded. Only costs a query in this rare case.
+                self.refresh_from_db(fields=[attname])
+        super(ChangeHistoryMixin, self).__setattr__(name, value)
+
+    @classmethod
+    def _history_tracked_fields(cls):
+        """Returns the list of model fields being tracked. Computed once per model."""
+        tracked = cls.__dict__.get('_history__tracked_field_list')
+        if tracked is None:
+            if cls.history__tracked_fields is not None:
+                tracked = [cls._meta.get_field(name) for name in cls.history__tracked_fields]
+            else:
+                tracked = [field for field in cls._meta.concrete_fields
+                           if field.editable and field.name != 'history']
+            # Both 'current_user' and 'current_user_id' can be assigned to change a FK.
+            attname_map = {field.name: field.attname for field in tracked}
+            attname_map.update({field.attname: field.attname for field in tracked})
+            cls._history__attname_map = attname_map
+            cls._history__tracked_name_set = frozenset(attname_map)
+            cls._history__tracked_field_list = tracked
+        return tracked
+
+    @classmethod
+    def _history_tracked_names(cls):
+        names = cls.__dict__.get('_history__tracked_name_set')
+        if names is None:
+            cls._history_tracked_fields()
+            names = cls._history__tracked_name_set
+        return names
+
+    def _history_snapshot(self):
+        """Returns the raw values of the tracked fields. Deferred fields which are not
+        yet loaded are skipped so that taking the snapshot never hits the DB.
+        """
+        instance_dict = self.__dict__
+        return {field.attname: instance_dict[field.attname]
+                for field in self._history_tracked_fields()
+                if field.attname in instance_dict}
+
+    def refresh_from_db(self, using=None, fields=None):
+        had_snapshot = '_history__initial' in self.__dict__
+        self.__dict__['_history__refreshing'] = True
+        try:
+            super(ChangeHistoryMixin, self).refresh_from_db(using=using, fields=fields)
+        finally:
+            del self.__dict__['_history__refreshing']
+        if not had_snapshot:
+            # Values loaded from the DB are not changes.
+            self.__dict__.pop('_history__initial', None)
+        else:
+            # Loaded values are the new baseline for the refreshed fields.
+            initial = self.__dict__['_history__initial']
+            for field in self._history_tracked_fields():
+                if fields is None or field.name in fields or field.attname in fields:
+                    if field.attname in self.__dict__:
+                        initial[field.attname] = self.__dict__[field.attname]
 
     @property
     def diff(self):
-        d1 = self.__initial
-        d2 = self._dict
-        # diffs = [(k, (v, d2[k])) for k, v in d1.items() if v != d2[k]]
-        diffs = [ { "field":k, "prev":v, "cur": d2[k] } for k, v in d1.items() if v != d2[k]]
-        #return dict(diffs)
+        """List of changes of the form { "field":.., "prev":.., "cur":.. } made since the
+        object was loaded or last saved. Values are the raw values i.e. ids for FKs.
+        """
+        initial = self.__dict__.get('_history__initial')
+        if not initial:
+            return []
+        current = self.__dict__
+        diffs = [{"field": field.name, "prev": initial[field.attname],
+                  "cur": current.get(field.attname)}
+                 for field in self._history_tracked_fields()
+                 if field.attname in initial and initial[field.attname] != current.get(field.attname)]
         return diffs
 
     @property
@@ -107,39 +260,43 @@ class ChangeHistoryMixin(models.Model):
 
     @property
     def changed_fields(self):
-        return self.diff.keys()
+        return [change["field"] for change in self.diff]
 
     def get_field_diff(self, field_name):
         """
         Returns a diff for field if it's changed and None otherwise.
         """
-        return self.diff.get(field_name, None)
+        for change in self.diff:
+            if change["field"] == field_name:
+                return change
+        return None
 
-    @property
-    def _dict(self):
-        object_dict =  model_to_dict(self, fields=[field.name for field in
-                             self._meta.fields])
-        # Call the function which allows to perform custom processing on this dict.
-        # call it only if the user has declared a custom serializer.
-        if self.history__process_dict_hook is not None:
-            self.history__process_dict_hook(object_dict=object_dict) # self passed automatically by python.
-        return object_dict
-
-    def save(self, *args, **kwargs):
-        """
-        Saves model and set initial state.
+    def _process_diff(self, diffs):
+        """Converts the raw values in the diff to the values to be stored in history by
+        calling the history__process_dict_hook on the previous and current values.
         """
-        changesDict = self.diff
+        if self.history__process_dict_hook is None or not diffs:
+            return diffs
 
-        # Let's construct the history record entry and add it to the dict.
-        # Each record is further going to be dictionary stored in the DB as a string.
+        prev_dict = {change["field"]: change["prev"] for change in diffs}
+        cur_dict = {change["field"]: change["cur"] for change in diffs}
+        # self passed automatically by python.
+        self.history__process_dict_hook(object_dict=prev_dict)
+        self.history__process_dict_hook(object_dict=cur_dict)
+        return [{"field": change["field"], "prev": prev_dict[change["field"]],
+                 "cur": cur_dict[change["field"]]} for change in diffs]
 
+    @classmethod
+    def _history_make_entry(cls, changes):
+        """Returns the history record entry for the list of changes passed.
+        Each record is further going to be dictionary stored in the DB.
+        """
         # We need to keep track of which user updated the data. Check if the user has
         # assigned a callable to fetch it. Else we will initialize it to be empty.
         who = None
-        if self.history__get_user_hook is not None:
-            if callable(self.history__get_user_hook):
-                who = self.history__get_user_hook()
+        if cls.history__get_user_hook is not None:
+            if callable(cls.history__get_user_hook):
+                who = cls.history__get_user_hook()
             else:
                 logger.error("history_get_user initialized with a non-callable")
 
@@ -148,26 +305,379 @@ class ChangeHistoryMixin(models.Model):
             entry = {
                 "who"  : str(who),
                 "when" : timezone.now().isoformat(),
-                "what" : changesDict,
+                "what" : changes,
             }
         else:
             entry = {
                 "when" : timezone.now().isoformat(),
-                "what" : changesDict,
+                "what" : changes,
             }
+        return entry
 
-        # prepend this entry into the list
-        if isinstance(self.history, list):
-            self.history.insert(0,entry)
-            if isinstance(self.history__max_entry_count, int):
-                if self.history__max_entry_count >= 0:
-                # Value has been specified. Trim the list. Value of 0 deletes the whole list.
-                    del self.history[self.history__max_entry_count: ]
-            logger.debug('Added the following record to history:\n %s'%(str(entry),))
-        else:
-            logger.error("History field not saved initially as list!!")
+    def save(self, *args, **kwargs):
+        """
+        Saves model and set initial state.
+        """
+        changesDict = self._process_diff(self.diff)
+
+        # Let's construct the history record entry and add it to the dict.
+        entry = self._history_make_entry(changesDict)
+
+        # Hand over the entry to the configured backend. The field backend adds it to
+        # self.history before the row is written whereas the table backend needs the pk
+        # and hence adds it once the row is written.
+        backend = self.get_history_backend()
+        backend.before_save(self, entry)
 
         # Let's not hold up the save. Save and reset the initial state.
         super(ChangeHistoryMixin, self).save(*args, **kwargs)
-        self.__initial = self._dict
+        backend.after_save(self, entry)
+        # The next assignment to a tracked field takes a fresh snapshot.
+        self.__dict__.pop('_history__initial', None)
+
+    def get_history_backend(self):
+        """Returns the backend used to store the history entries of this model.
+        """
+        return get_history_backend(self.history__backend)
+
+    def get_history(self):
+        """Returns the list of history entries, newest first, irrespective of the
+        backend used to store them. Views should use this instead of accessing the
+        'history' field directly.
+        """
+        limit = self.history__max_entry_count
+        if not isinstance(limit, int) or limit < 0:
+            limit = None
+        return self.get_history_backend().get_history(self, limit=limit)
+
+    @classmethod
+    def resolve_history(cls, entries):
+        """Returns a copy of the history entries passed with the FK ids replaced by
+        display names. Fetches all the related objects of the entries in bulk, so call
+        it once for a whole page of entries rather than per entry.
+        """
+        return resolve_fk_display_names(cls, entries, display_hook=cls.history__fk_display_hook)
+
+
+class ChangeHistoryQuerySet(models.QuerySet):
+    """QuerySet for models using the ChangeHistoryMixin which allows updating many rows
+    at once while still recording the history of each row.
+    """
+
+    def tracked_update(self, batch_size=None, **kwargs):
+        """History aware alternative to update(). Updates all the rows matching the
+        queryset with the values passed and records a history entry for every row which
+        actually changed. Costs one SELECT to compute the diffs, one batch write of the
+        history entries and one UPDATE irrespective of the number of rows.
+
+        Values are recorded as is (ids for FKs). history__process_dict_hook is not
+        called as there is no instance to pass to it. Expressions such as F() are not
+        supported as their values cannot be known before the update.
+
+        Like save(), sets the date / time fields with auto_now (Eg: a 'modified_at') of
+        the changed rows to the current time.
+
+        Sends the history_bulk_updated signal with the pks of the changed rows once the
+        transaction commits.
+
+        Keyword Arguments:
+            batch_size {int} -- When set, the UPDATE is issued in chunks of these many
+                                rows. Useful on databases limiting query parameters.
+
+        Returns:
+            int -- Number of rows which changed.
+        """
+        model = self.model
+        fields = []
+        new_values = {}
+        for name, value in kwargs.items():
+            field = model._meta.get_field(name)
+            if hasattr(value, 'resolve_expression'):
+                raise TypeError("tracked_update() does not support expressions. Field: %s"
+                                % (name,))
+            if field.many_to_one:
+                value = value.pk if isinstance(value, models.Model) else value
+            else:
+                value = field.to_python(value)
+            fields.append(field)
+            new_values[field.attname] = value
+
+        tracked_attnames = {field.attname for field in model._history_tracked_fields()}
+
+        with transaction.atomic(using=self.db):
+            queryset = self
+            if connections[self.db].features.has_select_for_update:
+                # Lock the rows so that the values diffed are the ones being updated.
+                queryset = queryset.select_for_update()
+
+            changed_pks = []
+            entries_by_pk = {}
+            template_entry = model._history_make_entry([])
+            rows = queryset.order_by().values_list('pk', *[f.attname for f in fields])
+            for row in rows.iterator():
+                pk, prev_values = row[0], row[1:]
+                changed = [(field, prev) for field, prev in zip(fields, prev_values)
+                           if prev != new_values[field.attname]]
+                if not changed:
+                    continue
+                changed_pks.append(pk)
+                changes = [{"field": field.name, "prev": prev, "cur": new_values[field.attname]}
+                           for field, prev in changed if field.attname in tracked_attnames]
+                if changes:
+                    entry = dict(template_entry)
+                    entry["what"] = changes
+                    entries_by_pk[pk] = entry
+
+            if not changed_pks:
+                return 0
+
+            # Rows which already have the values are neither updated nor recorded.
+            update_values = dict(new_values)
+            now = timezone.now()
+            for field in model._meta.concrete_fields:
+                if getattr(field, 'auto_now', False) and \
+                        field.attname not in update_values:
+                    update_values[field.attname] = field.to_python(now)
+            chunk_size = batch_size or len(changed_pks)
+            for i in range(0, len(changed_pks), chunk_size):
+                model._base_manager.using(self.db).filter(
+                    pk__in=changed_pks[i:i + chunk_size]).update(**update_values)
+
+            if entries_by_pk:
+                get_history_backend(model.history__backend).bulk_record(model, entries_by_pk)
+
+            transaction.on_commit(
+                lambda: history_bulk_updated.send(sender=model, pks=changed_pks),
+                using=self.db)
+
+        return len(changed_pks)
+
+    def states_as_of(self, when, chunk_size=None):
+        """Yields (pk, state) of the objects of the queryset as they were at 'when'.
+        Streams the objects in chunks. See snapshots.iter_states_as_of().
+        """
+        return iter_states_as_of(self, when, chunk_size=chunk_size or DEFAULT_CHUNK_SIZE)
+
 
+class HistoryDeferringQuerySet(ChangeHistoryQuerySet):
+
+    def with_history(self):
+        """Loads the 'history' field which is deferred by HistoryDeferringManager.
+        NOTE: Clears any other deferred fields of the queryset as well.
+        """
+        return self.defer(None)
+
+
+class HistoryDeferringManager(models.Manager.from_queryset(HistoryDeferringQuerySet)):
+    """Manager for models using the ChangeHistoryMixin which does not load the 'history'
+    column unless asked for using with_history(). If the history of an object loaded
+    without it is accessed, it is fetched with an extra query.
+    """
+
+    def get_queryset(self):
+        return super(HistoryDeferringManager, self).get_queryset().defer('history')
+
+
+class HistoryEntryQuerySet(models.QuerySet):
+
+    def for_instance(self, instance):
+        return self.filter(model=instance._meta.label_lower, object_id=instance.pk)
+
+
+class HistoryEntry(models.Model):
+    """
+    A single change made to an object tracked by the ChangeHistoryMixin. Used by the
+    TableHistoryBackend. Each save of a tracked object appends one row to this table
+    instead of rewriting the whole history list stored in the object's row.
+    """
+
+    # Model of the object which was changed, stored as '<app_label>.<model_name>'.
+    # A plain string is used instead of a ContentType FK so that rows can be written
+    # from data migrations before the content types are created.
+    model = models.CharField(max_length=100)
+
+    # pk of the object which was changed. Not a FK as the history should outlive the
+    # object and we want to track multiple models in the same table.
+    object_id = models.PositiveIntegerField()
+
+    # Value returned by the history__get_user_hook. Empty when not available.
+    who = models.CharField(max_length=254, blank=True)
+
+    when = models.DateTimeField(default=timezone.now)
+
+    # List of per field diffs. [ { "field":.., "prev":.., "cur":.. }, ... ]
+    what = HistoryField(default=list)
+
+    objects = HistoryEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "history entry"
+        verbose_name_plural = "history entries"
+        ordering = ['-when', '-id']
+        indexes = [
+            models.Index(fields=['model', 'object_id', '-when'],
+                         name='changehist_obj_when_idx'),
+        ]
+
+    def __str__(self):
+        return "%s:%s @ %s" % (self.model, self.object_id, self.when)
+
+    def as_entry(self):
+        """Returns the row in the same dict format used by the FieldHistoryBackend.
+        """
+        entry = {
+            "when": self.when.isoformat(),
+            "what": self.what,
+        }
+        if self.who:
+            entry["who"] = self.who
+        return entry
+
+
+
+class HistorySnapshotQuerySet(models.QuerySet):
+
+    def for_model(self, model):
+        return self.filter(model=model._meta.label_lower)
+
+
+class HistorySnapshot(models.Model):
+    """
+    State of the tracked fields of an object at a point in time. Written periodically
+    by the 'snapshot_history' command (see snapshots.py) so that the state of an object
+    at any timestamp can be rebuilt by replaying a bounded number of HistoryEntry rows
+    from the nearest snapshot instead of its whole history.
+    """
+
+    # Same meaning as in HistoryEntry.
+    model = models.CharField(max_length=100)
+    object_id = models.PositiveIntegerField()
+
+    when = models.DateTimeField(default=timezone.now)
+
+    # id of the newest HistoryEntry of the object reflected in 'state' and the number of
+    # entries the object had at that point. Entries with a greater id are replayed on
+    # top of the snapshot.
+    last_entry_id = models.PositiveIntegerField(default=0)
+    entry_count = models.PositiveIntegerField(default=0)
+
+    # Raw values of the tracked fields keyed on the field name. { "status": .., ... }
+    state = HistoryField(default=dict)
+
+    objects = HistorySnapshotQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "history snapshot"
+        verbose_name_plural = "history snapshots"
+        ordering = ['-when', '-id']
+        indexes = [
+            models.Index(fields=['model', 'object_id', '-when'],
+                         name='changehist_snap_obj_when_idx'),
+        ]
+
+    def __str__(self):
+        return "%s:%s snapshot @ %s" % (self.model, self.object_id, self.when)
+
+
+class FieldChangeQuerySet(models.QuerySet):
+
+    def for_model(self, model):
+        return self.filter(model=model._meta.label_lower)
+
+    def page(self, cursor=None, size=50):
+        """Returns one page of changes, newest first, using keyset pagination. The cost
+        of fetching a page does not depend on how far back it is.
+
+        Keyword Arguments:
+            cursor {str} -- Value returned as 'next_cursor' by the previous page. None
+                            returns the first page.
+            size {int} -- Number of changes per page.
+
+        Returns:
+            tuple -- (list of FieldChange, next_cursor). next_cursor is None on the last
+                     page.
+
+        Raises:
+            ValueError -- When the cursor is not valid.
+        """
+        queryset = self.order_by('-when', '-id')
+        if cursor:
+            when, last_id = decode_cursor(cursor)
+            queryset = queryset.filter(
+                models.Q(when__lt=when) | models.Q(when=when, id__lt=last_id))
+        # One extra row tells whether there is a next page.
+        rows = list(queryset[:size + 1])
+        next_cursor = encode_cursor(rows[size - 1]) if len(rows) > size else None
+        return rows[:size], next_cursor
+
+
+_CURSOR_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def encode_cursor(change):
+    """Returns the opaque pagination cursor pointing after the change passed."""
+    micros = (change.when - _CURSOR_EPOCH) // datetime.timedelta(microseconds=1)
+    return "%d.%d" % (micros, change.id)
+
+
+def decode_cursor(cursor):
+    """Returns the (when, id) pair encoded by encode_cursor(). Raises ValueError."""
+    micros, _, last_id = str(cursor).partition('.')
+    return (_CURSOR_EPOCH + datetime.timedelta(microseconds=int(micros)), int(last_id))
+
+
+class FieldChange(models.Model):
+    """
+    One row per field changed in a HistoryEntry. Written by the TableHistoryBackend
+    along with the entry so that audit queries (changes by a user, changes of a field to
+    a value, changes in a time range) are answered from indexed columns instead of
+    decoding the entries.
+
+    Rows are scoped using the value of the model's history__scope_field (the Org in case
+    of Resources) and every index leads with the scope.
+    """
+
+    # Same meaning as in HistoryEntry.
+    model = models.CharField(max_length=100)
+    object_id = models.PositiveIntegerField()
+    who = models.CharField(max_length=254, blank=True)
+    when = models.DateTimeField(default=timezone.now)
+
+    # Raw value of the history__scope_field of the object. Eg: Org id of the Resource.
+    scope = models.PositiveIntegerField(null=True)
+
+    field = models.CharField(max_length=100)
+    # New value of the field as a string (ids in case of ForeignKeys) used for filtering.
+    # Truncated to the max length. Empty for None.
+    value = models.CharField(max_length=255, blank=True)
+
+    # The change as recorded in the entry. { "field":.., "prev":.., "cur":.. }
+    change = HistoryField(default=dict)
+
+    objects = FieldChangeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "field change"
+        verbose_name_plural = "field changes"
+        ordering = ['-when', '-id']
+        indexes = [
+            models.Index(fields=['scope', '-when', '-id'],
+                         name='changehist_fc_scope_when_idx'),
+            models.Index(fields=['scope', 'who', '-when', '-id'],
+                         name='changehist_fc_who_idx'),
+            models.Index(fields=['scope', 'field', '-when', '-id'],
+                         name='changehist_fc_field_idx'),
+            models.Index(fields=['scope', 'field', 'value', '-when', '-id'],
+                         name='changehist_fc_value_idx'),
+            models.Index(fields=['scope', 'model', 'object_id', '-when', '-id'],
+                         name='changehist_fc_obj_idx'),
+        ]
+
+    def __str__(self):
+        return "%s:%s %s @ %s" % (self.model, self.object_id, self.field, self.when)
+
+    @staticmethod
+    def value_to_str(value):
+        if value is None:
+            return ''
+        return str(value)[:255]
@@ -0,0 +1,154 @@
+"""Resolves the ForeignKey ids stored in history entries to display names.
+
+The ChangeHistoryMixin stores the raw id of a ForeignKey in the history diffs so that a
+save never has to fetch the related objects. While displaying (or exporting) a page of
+history entries, all the ids are collected and fetched with a single 'IN' query per
+related model. The display names are cached in-process in a small LRU cache which is
+invalidated whenever an object of a cached model is saved or deleted.
+
+Values which are not ids (Eg: usernames stored by older entries) are left untouched.
+"""
+
+from collections import OrderedDict
+import threading
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Max number of display names cached per process.
+DEFAULT_CACHE_SIZE = 1024
+
+
+class DisplayNameCache:
+    """Thread safe LRU cache of display names keyed on (model label, pk)."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, label, pk_set):
+        """Returns a dict of pk -> display name for the pks found in the cache."""
+        found = {}
+        with self._lock:
+            for pk in pk_set:
+                key = (label, pk)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[pk] = self._entries[key]
+        return found
+
+    def set_many(self, label, names_by_pk):
+        with self._lock:
+            for pk, name in names_by_pk.items():
+                self._entries[(label, pk)] = name
+                self._entries.move_to_end((label, pk))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, label, pk):
+        with self._lock:
+            self._entries.pop((label, pk), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+display_name_cache = DisplayNameCache(
+    getattr(settings, 'CHANGE_HISTORY_DISPLAY_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_display_name(sender, instance, **kwargs):
+    """Drop the cached name of any object which was saved or deleted. A no-op for
+    objects which were never cached.
+    """
+    display_name_cache.delete(sender._meta.label_lower, instance.pk)
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def resolve_fk_display_names(model, entries, display_hook=None):
+    """Returns a copy of the history entries with the FK ids in the diffs replaced by
+    display names. Costs at most one query per related model irrespective of the number
+    of entries.
+
+    Arguments:
+        model {Model} -- Model class whose history entries are being resolved.
+        entries {list} -- History entries as returned by get_history().
+
+    Keyword Arguments:
+        display_hook {callable} -- Function which accepts a related object and returns
+                                   the string to display. str() is used when None.
+
+    Returns:
+        list -- New list of entries. The entries passed are not modified.
+    """
+    if display_hook is None:
+        display_hook = str
+
+    # Pass 1: Find out the FK fields present in the diffs and the ids to be resolved.
+    related_model_of_field = {}
+    ids_by_model = {}
+    for entry in entries:
+        for change in entry.get('what', []):
+            field_name = change.get('field')
+            if field_name not in related_model_of_field:
+                try:
+                    model_field = model._meta.get_field(field_name)
+                except FieldDoesNotExist:
+                    # Field was removed from the model after the entry was recorded.
+                    model_field = None
+                related_model_of_field[field_name] = (
+                    model_field.related_model
+                    if model_field is not None and model_field.many_to_one else None)
+
+            related_model = related_model_of_field[field_name]
+            if related_model is None:
+                continue
+            for value in (change.get('prev'), change.get('cur')):
+                if _is_id(value):
+                    ids_by_model.setdefault(related_model, set()).add(value)
+
+    # Pass 2: Fetch the names. Cache first and then one query per model for the rest.
+    names_by_model = {}
+    for related_model, id_set in ids_by_model.items():
+        label = related_model._meta.label_lower
+        names = display_name_cache.get_many(label, id_set)
+        missing_ids = id_set - set(names)
+        if missing_ids:
+            fetched = {pk: display_hook(obj) for pk, obj in
+                       related_model._default_manager.in_bulk(missing_ids).items()}
+            display_name_cache.set_many(label, fetched)
+            names.update(fetched)
+        names_by_model[related_model] = names
+
+    # Pass 3: Build the resolved copy of the entries.
+    resolved_entries = []
+    for entry in entries:
+        resolved_entry = dict(entry)
+        resolved_what = []
+        for change in entry.get('what', []):
+            resolved_change = dict(change)
+            related_model = related_model_of_field.get(change.get('field'))
+            if related_model is not None:
+                names = names_by_model.get(related_model, {})
+                for key in ('prev', 'cur'):
+                    value = change.get(key)
+                    if _is_id(value):
+                        # Show the id itself when the object no longer exists.
+                        resolved_change[key] = names.get(value, value)
+            resolved_what.append(resolved_change)
+        resolved_entry['what'] = resolved_what
+        resolved_entries.append(resolved_entry)
+
+    return resolved_entries
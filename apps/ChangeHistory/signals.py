@@ -0,0 +1,9 @@
+"""Signals sent by the ChangeHistory app."""
+
+from django.dispatch import Signal
+
+# Sent after ChangeHistoryQuerySet.tracked_update() has updated the rows and recorded
+# their history. Unlike save(), queryset updates do not send post_save. Receivers can use
+# this to process all the updated objects in one go (Eg: reindex them in a batch).
+# sender is the model class and pks is the list of pks of the objects which changed.
+history_bulk_updated = Signal(providing_args=['pks'])
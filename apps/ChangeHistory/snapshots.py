@@ -0,0 +1,277 @@
+"""Point-in-time reconstruction of tracked objects from their history.
+
+The state of an object at a timestamp is rebuilt from an anchor whose state is known and
+the HistoryEntry rows recorded between the anchor and the timestamp:
+
+    * the newest HistorySnapshot taken at or before the timestamp. The 'cur' values of
+      the entries recorded after the snapshot and up to the timestamp are replayed on
+      top of it.
+    * otherwise the oldest HistorySnapshot taken after the timestamp. The entries
+      recorded after the timestamp and up to the snapshot are undone using their 'prev'
+      values.
+    * otherwise the current row of the object, undoing all the entries recorded after
+      the timestamp.
+
+take_snapshots() (run periodically by the 'snapshot_history' command) writes a new
+snapshot of an object once 'every' entries have been recorded since its last one. Hence
+no more than 'every' entries are replayed per object, plus whatever was recorded since
+the command last ran.
+
+Objects are processed in chunks of pks with a fixed number of queries per chunk so that
+a whole org can be streamed without loading all of it in memory.
+
+Only the TableHistoryBackend is supported. Objects which have since been deleted are not
+reconstructed as nothing but their history is left behind. Entries recorded before the
+ForeignKeys were stored as ids hold display values (Eg: email ids, org names) which
+cannot be mapped back to ids: a reconstruction needing one of them fails with a
+ValueError naming the entry, hence the time from which the states can be rebuilt.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+
+from .backends import get_history_backend, TableHistoryBackend
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Default number of entries recorded for an object after which a new snapshot is taken.
+DEFAULT_SNAPSHOT_EVERY = 50
+
+# Default number of objects reconstructed or snapshotted per chunk.
+DEFAULT_CHUNK_SIZE = 500
+
+
+def get_snapshot_every():
+    return getattr(settings, 'CHANGE_HISTORY_SNAPSHOT_EVERY', DEFAULT_SNAPSHOT_EVERY)
+
+
+def _check_backend(model):
+    backend = get_history_backend(model.history__backend)
+    if not isinstance(backend, TableHistoryBackend):
+        raise ValueError("%s does not store its history using the TableHistoryBackend. "
+                         "Point-in-time reconstruction is not supported."
+                         % (model._meta.label,))
+
+
+def _iter_chunks(queryset, fields, chunk_size):
+    """Yields lists of (pk, value, ...) tuples of the queryset ordered by pk. Each chunk
+    is fetched separately using the last pk seen so that no cursor is held open while
+    the chunk is being processed.
+    """
+    queryset = queryset.order_by('pk').values_list('pk', *fields)
+    last_pk = None
+    while True:
+        chunk_qset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk_qset[:chunk_size])
+        if not chunk:
+            return
+        last_pk = chunk[-1][0]
+        yield chunk
+
+
+def _current_states(model, rows):
+    """Converts the rows returned by _iter_chunks into a dict of pk -> state."""
+    names = [field.name for field in model._history_tracked_fields()]
+    return {row[0]: dict(zip(names, row[1:])) for row in rows}
+
+
+def _tracked_attnames(model):
+    return [field.attname for field in model._history_tracked_fields()]
+
+
+def _fk_names(model):
+    return {field.name for field in model._history_tracked_fields() if field.many_to_one}
+
+
+def _apply(state, entry_row, key, fk_names):
+    """Sets the 'key' ('cur' or 'prev') value of every change of the entry on the state.
+    Changes to fields which are not tracked anymore are ignored.
+
+    Raises:
+        ValueError -- The entry holds the display value of a ForeignKey instead of its id.
+    """
+    for change in entry_row.what:
+        field_name = change.get('field')
+        if field_name not in state:
+            continue
+        value = change.get(key)
+        if field_name in fk_names and value is not None and \
+                (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(
+                "The history entry of %s %d recorded at %s holds the display value of "
+                "'%s' instead of its id. States older than it cannot be rebuilt."
+                % (entry_row.model, entry_row.object_id, entry_row.when.isoformat(),
+                   field_name))
+        state[field_name] = value
+
+
+def take_snapshots(queryset, every=None, chunk_size=DEFAULT_CHUNK_SIZE, force=False):
+    """Snapshots the objects of the queryset which had at least 'every' entries recorded
+    since their last snapshot.
+
+    Arguments:
+        queryset {QuerySet} -- Objects of a model using the ChangeHistoryMixin.
+
+    Keyword Arguments:
+        every {int} -- Setting CHANGE_HISTORY_SNAPSHOT_EVERY is used when None.
+        chunk_size {int} -- Number of objects processed per transaction.
+        force {bool} -- Snapshot every object having new entries irrespective of count.
+
+    Returns:
+        int -- Number of snapshots written.
+    """
+    from .models import HistoryEntry, HistorySnapshot
+
+    model = queryset.model
+    _check_backend(model)
+    if every is None:
+        every = get_snapshot_every()
+    min_new_entries = 1 if force else max(every, 1)
+
+    label = model._meta.label_lower
+    attnames = _tracked_attnames(model)
+    written_count = 0
+    for pk_chunk in _iter_chunks(queryset, [], chunk_size):
+        pks = [row[0] for row in pk_chunk]
+        with transaction.atomic():
+            # Lock the rows first. A concurrent save updates the row before adding its
+            # entry and hence cannot add an entry which is not reflected in the state
+            # read below (or the other way round).
+            rows = model._base_manager.filter(pk__in=pks)
+            if transaction.get_connection().features.has_select_for_update:
+                rows = rows.select_for_update()
+            states = _current_states(model, rows.values_list('pk', *attnames))
+
+            counts = {
+                item['object_id']: (item['count'], item['last_id'])
+                for item in HistoryEntry.objects.filter(model=label, object_id__in=pks)
+                .values('object_id').annotate(count=Count('id'), last_id=Max('id'))
+                .order_by()
+            }
+            snapshotted_counts = dict(
+                HistorySnapshot.objects.filter(model=label, object_id__in=pks)
+                .values('object_id').annotate(count=Max('entry_count'))
+                .order_by().values_list('object_id', 'count'))
+
+            snapshots = []
+            for pk, state in states.items():
+                count, last_id = counts.get(pk, (0, 0))
+                if count - snapshotted_counts.get(pk, 0) < min_new_entries:
+                    continue
+                snapshots.append(HistorySnapshot(
+                    model=label, object_id=pk, last_entry_id=last_id,
+                    entry_count=count, state=state))
+            HistorySnapshot.objects.bulk_create(snapshots)
+            written_count += len(snapshots)
+
+    return written_count
+
+
+def _reconstruct_chunk(model, rows, when):
+    """Returns a list of (pk, state) of the objects in the chunk which existed at 'when'.
+    Costs at most 6 queries irrespective of the number of objects in the chunk.
+    """
+    from .models import HistoryEntry, HistorySnapshot
+
+    label = model._meta.label_lower
+    fk_names = _fk_names(model)
+    states = _current_states(model, rows)
+    pks = list(states)
+
+    # Objects whose first entry (the one recorded when they were created) is newer than
+    # the timestamp did not exist then.
+    first_seen = dict(
+        HistoryEntry.objects.filter(model=label, object_id__in=pks)
+        .values('object_id').annotate(first=Min('when'))
+        .order_by().values_list('object_id', 'first'))
+
+    snapshot_qset = HistorySnapshot.objects.filter(model=label, object_id__in=pks)
+    # Snapshots of an object are written in the order of time and so are their ids.
+    anchor_ids = list(
+        snapshot_qset.filter(when__lte=when).values('object_id')
+        .annotate(anchor=Max('id')).order_by().values_list('anchor', flat=True))
+    anchor_ids += list(
+        snapshot_qset.filter(when__gt=when).values('object_id')
+        .annotate(anchor=Min('id')).order_by().values_list('anchor', flat=True))
+    before, after = {}, {}
+    for snapshot in HistorySnapshot.objects.filter(id__in=anchor_ids):
+        if snapshot.when <= when:
+            before[snapshot.object_id] = snapshot
+        else:
+            after[snapshot.object_id] = snapshot
+    # Replaying forward from an older snapshot is preferred.
+    after = {pk: snapshot for pk, snapshot in after.items() if pk not in before}
+
+    entry_qset = HistoryEntry.objects.filter(model=label, object_id__in=pks) \
+        .defer('who').order_by('id')
+    # Entries newer than their anchor snapshot and not newer than the timestamp.
+    if before:
+        forward_entries = entry_qset.filter(
+            object_id__in=list(before), when__lte=when,
+            id__gt=min(s.last_entry_id for s in before.values()))
+    else:
+        forward_entries = []
+    # Entries newer than the timestamp and not newer than their anchor (snapshot or
+    # the current row).
+    backward_pks = [pk for pk in pks if pk not in before]
+    backward_entries = entry_qset.filter(object_id__in=backward_pks, when__gt=when)
+    if backward_pks and all(pk in after for pk in backward_pks):
+        backward_entries = backward_entries.filter(
+            id__lte=max(s.last_entry_id for s in after.values()))
+
+    for pk, snapshot in before.items():
+        state = states[pk]
+        state.update((name, value) for name, value in snapshot.state.items()
+                     if name in state)
+    for row in forward_entries:
+        if row.id > before[row.object_id].last_entry_id:
+            _apply(states[row.object_id], row, 'cur', fk_names)
+
+    for pk, snapshot in after.items():
+        state = states[pk]
+        state.update((name, value) for name, value in snapshot.state.items()
+                     if name in state)
+    if backward_pks:
+        for row in reversed(list(backward_entries)):
+            snapshot = after.get(row.object_id)
+            if snapshot is None or row.id <= snapshot.last_entry_id:
+                _apply(states[row.object_id], row, 'prev', fk_names)
+
+    return [(pk, states[pk]) for pk in pks
+            if first_seen.get(pk) is None or first_seen[pk] <= when]
+
+
+def iter_states_as_of(queryset, when, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields the state of every object of the queryset as it was at 'when'.
+
+    Arguments:
+        queryset {QuerySet} -- Objects of a model using the ChangeHistoryMixin. The
+                               filters are applied on the current values.
+        when {datetime} -- Timezone aware timestamp.
+
+    Keyword Arguments:
+        chunk_size {int} -- Number of objects reconstructed per batch of queries.
+
+    Yields:
+        tuple -- (pk, state) where state maps the tracked field names to their raw
+                 values (ids in case of ForeignKeys) at 'when'. Objects created after
+                 'when' are skipped.
+    """
+    model = queryset.model
+    _check_backend(model)
+    attnames = _tracked_attnames(model)
+    for rows in _iter_chunks(queryset, attnames, chunk_size):
+        for item in _reconstruct_chunk(model, rows, when):
+            yield item
+
+
+def state_as_of(instance, when):
+    """Returns the state of the tracked fields of the instance as it was at 'when' or
+    None if it did not exist then. See iter_states_as_of().
+    """
+    queryset = instance.__class__._base_manager.filter(pk=instance.pk)
+    for pk, state in iter_states_as_of(queryset, when):
+        return state
+    return None
@@ -1,3 +1,160 @@
-from django.test import TestCase
+import importlib
+import io
 
-# Create your tests here.
+from django.apps import apps
+from django.core.management import call_command
+from django.db.models import F
+from django.test import TestCase, override_settings
+
+from apps.ChangeHistory.models import FieldChange, HistoryEntry
+from apps.Organization.models import Org
+from apps.Resource.models import Resource
+from apps.Users.models import AssetUser
+
+explode_migration = importlib.import_module(
+    'apps.ChangeHistory.migrations.0002_explode_resource_history')
+
+FIELD_BACKEND = 'apps.ChangeHistory.backends.FieldHistoryBackend'
+TABLE_BACKEND = 'apps.ChangeHistory.backends.TableHistoryBackend'
+
+# Stored newest first, like the FieldHistoryBackend does.
+LEGACY_HISTORY = [
+    {'who': 'bob@abc.com', 'when': '2026-10-02T10:00:00+00:00',
+     'what': [{'field': 'status', 'prev': 'Assigned', 'cur': 'Acknowledged'}]},
+    {'when': '2026-10-01T10:00:00+00:00',
+     'what': [{'field': 'name', 'prev': 'Dell', 'cur': 'Dell Latitude'}]},
+]
+
+
+class MoveHistoryTests(TestCase):
+    """Moves of the history between the 'history' column and the HistoryEntry table, by
+    the migration ChangeHistory.0002 and by the 'move_history' command.
+    """
+
+    def setUp(self):
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.resource = Resource.objects.create(name='Dell Latitude', serial_num='SN1',
+                                                current_user=self.user,
+                                                device_admin=self.user,
+                                                description='laptop', org=self.org)
+        # As stored before the TableHistoryBackend.
+        HistoryEntry.objects.all().delete()
+        FieldChange.objects.all().delete()
+        Resource.objects.filter(pk=self.resource.pk).update(history=LEGACY_HISTORY)
+
+    def column(self):
+        return Resource.objects.filter(pk=self.resource.pk).values_list(
+            'history', flat=True).get()
+
+    def table(self):
+        return [row.as_entry()
+                for row in HistoryEntry.objects.for_instance(self.resource)]
+
+    def test_migration_moves_the_history_into_the_table_whatever_the_backend(self):
+        with override_settings(CHANGE_HISTORY_BACKEND=FIELD_BACKEND):
+            explode_migration.explode_history(apps, None)
+        self.assertEqual(self.column(), [])
+        self.assertEqual(self.table(), LEGACY_HISTORY)
+        # Oldest first, so that the ids are in the order of the timestamps.
+        self.assertEqual(
+            list(HistoryEntry.objects.order_by('id').values_list('who', flat=True)),
+            ['', 'bob@abc.com'])
+
+        explode_migration.implode_history(apps, None)
+        self.assertEqual(self.column(), LEGACY_HISTORY)
+        self.assertFalse(HistoryEntry.objects.exists())
+
+    @override_settings(CHANGE_HISTORY_BACKEND=TABLE_BACKEND)
+    def test_move_history_round_trip(self):
+        call_command('move_history', stdout=io.StringIO())
+        self.assertEqual(self.column(), [])
+        self.assertEqual(self.table(), LEGACY_HISTORY)
+        self.assertEqual(FieldChange.objects.for_model(Resource).count(), 2)
+        self.assertEqual(self.resource.get_history(), LEGACY_HISTORY)
+
+        with override_settings(CHANGE_HISTORY_BACKEND=FIELD_BACKEND):
+            call_command('move_history', stdout=io.StringIO())
+            self.assertEqual(self.column(), LEGACY_HISTORY)
+            self.assertEqual(self.table(), [])
+            self.assertFalse(FieldChange.objects.exists())
+            # Nothing left to move.
+            call_command('move_history', stdout=io.StringIO())
+            self.assertEqual(self.column(), LEGACY_HISTORY)
+
+
+class TrackedUpdateTests(TestCase):
+    """History recorded by ChangeHistoryQuerySet.tracked_update()."""
+
+    def setUp(self):
+        self.alice = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                   name='Alice Smith')
+        self.bob = AssetUser.objects.create_user('bob@abc.com', 'secret', name='Bob')
+        self.org = Org.objects.create(org_name='Abc', admin=self.alice)
+        self.resources = [
+            Resource.objects.create(name='Dell %d' % (i,), serial_num='SN%d' % (i,),
+                                    current_user=self.alice,
+                                    device_admin=admin, description='', org=self.org)
+            for i, admin in enumerate([self.alice, self.bob, self.alice])]
+        self.created_at = {res.pk: res.modified_at for res in self.resources}
+
+    def entries(self, resource):
+        return HistoryEntry.objects.for_instance(resource)
+
+    def test_only_the_rows_which_change_are_updated_and_recorded(self):
+        changed_count = Resource.objects.filter(org=self.org).tracked_update(
+            device_admin=self.bob, status=Resource.RES_ACKNOWLEDGED, batch_size=1)
+        self.assertEqual(changed_count, 3)
+
+        first, second, third = self.resources
+        for resource in (first, third):
+            latest = self.entries(resource)[0]
+            self.assertEqual(
+                sorted(latest.what, key=lambda change: change['field']),
+                [{'field': 'device_admin', 'prev': self.alice.pk, 'cur': self.bob.pk},
+                 {'field': 'status', 'prev': Resource.RES_ASSIGNED,
+                  'cur': Resource.RES_ACKNOWLEDGED}])
+        # Only the status of the second one changed.
+        self.assertEqual(self.entries(second)[0].what,
+                         [{'field': 'status', 'prev': Resource.RES_ASSIGNED,
+                           'cur': Resource.RES_ACKNOWLEDGED}])
+        self.assertEqual(
+            FieldChange.objects.filter(field='status', scope=self.org.pk).count(), 3)
+
+        for resource in Resource.objects.filter(org=self.org):
+            self.assertEqual(resource.device_admin_id, self.bob.pk)
+            self.assertGreater(resource.modified_at, self.created_at[resource.pk])
+
+    def test_rows_which_already_have_the_values_are_left_alone(self):
+        changed_count = Resource.objects.filter(org=self.org).tracked_update(
+            device_admin=self.alice)
+        self.assertEqual(changed_count, 1)
+
+        for resource in Resource.objects.filter(org=self.org):
+            entries = self.entries(resource)
+            if resource.pk == self.resources[1].pk:
+                self.assertEqual(entries[0].what, [{'field': 'device_admin',
+                                                    'prev': self.bob.pk,
+                                                    'cur': self.alice.pk}])
+                self.assertGreater(resource.modified_at, self.created_at[resource.pk])
+            else:
+                # Only the creation entry.
+                self.assertEqual(len(entries), 1)
+                self.assertEqual(resource.modified_at, self.created_at[resource.pk])
+
+        self.assertEqual(Resource.objects.filter(org=self.org).tracked_update(
+            device_admin=self.alice), 0)
+
+    @override_settings(CHANGE_HISTORY_BACKEND=FIELD_BACKEND)
+    def test_history_is_stored_in_the_row_with_the_field_backend(self):
+        Resource.objects.filter(pk=self.resources[0].pk).tracked_update(name='Dell XPS')
+        resource = Resource.objects.get(pk=self.resources[0].pk)
+        self.assertEqual(resource.name, 'Dell XPS')
+        self.assertEqual(resource.history[0]['what'],
+                         [{'field': 'name', 'prev': 'Dell 0', 'cur': 'Dell XPS'}])
+
+    def test_expressions_are_refused(self):
+        with self.assertRaises(TypeError):
+            Resource.objects.tracked_update(name=F('serial_num'))
+        self.assertEqual(Resource.objects.filter(name__startswith='SN').count(), 0)
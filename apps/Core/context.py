@@ -0,0 +1,156 @@
+"""Request scoped context (current request, org and the user making the changes) stored
+in contextvars.
+
+The values are set by the middlewares at the start of every request and reset once the
+response is returned, so nothing leaks into the next request served by the same thread.
+Unlike thread locals, contextvars are also isolated per task under ASGI and copied by
+asgiref when a sync view is run on a thread.
+
+Work handed over to other threads does not see the context unless it is carried over:
+
+    # Threads / executors of the same process.
+    executor.submit(context.wrap(send_mail_func), ...)
+
+    # Queued tasks picked up by another process. The captured dict is stored along with
+    # the task (Eg: OutboxMessage.request_context) and bound by the worker.
+    task.request_context = json.dumps(context.capture())
+    ...
+    with context.bind_captured(json.loads(task.request_context)):
+        process_task()
+
+Helpers like get_current_org() return None outside of a request or bound context.
+"""
+
+import contextlib
+import contextvars
+import functools
+
+_request_var = contextvars.ContextVar('trackzilla_request', default=None)
+_org_var = contextvars.ContextVar('trackzilla_org', default=None)
+# Email id of the user making the changes. When not bound, the logged in user of the
+# current request is used.
+_actor_var = contextvars.ContextVar('trackzilla_actor', default=None)
+
+# Marks the arguments not passed to bind().
+_UNSET = object()
+
+
+class LazyValue:
+    """Value computed on first access. Used to bind values whose computation costs a
+    query (Eg: the org of the logged in user) but which are not used by every request.
+    """
+
+    def __init__(self, func):
+        self._func = func
+        self._evaluated = False
+        self._value = None
+
+    def get(self):
+        if not self._evaluated:
+            self._value = self._func()
+            self._evaluated = True
+        return self._value
+
+
+def _resolve(value):
+    if isinstance(value, LazyValue):
+        return value.get()
+    return value
+
+
+def get_current_request():
+    """Returns the HttpRequest being served or None."""
+    return _request_var.get()
+
+
+def get_current_org():
+    """Returns the Org chosen by the user (apps.Organization.models.Org) or None."""
+    return _resolve(_org_var.get())
+
+
+def get_current_actor():
+    """Returns the email id of the user making the changes or None. Falls back to the
+    logged in user of the current request when no actor has been bound.
+    """
+    actor = _resolve(_actor_var.get())
+    if actor is not None:
+        return actor
+    request = _request_var.get()
+    if request is not None:
+        # AnonymousUser does not have an email.
+        return getattr(request.user, 'email', None) or None
+    return None
+
+
+@contextlib.contextmanager
+def bind(request=_UNSET, org=_UNSET, actor=_UNSET):
+    """Context manager which sets the values passed for the duration of the block and
+    restores the previous values on exit. org and actor can be LazyValues.
+    """
+    tokens = []
+    for var, value in ((_request_var, request), (_org_var, org), (_actor_var, actor)):
+        if value is not _UNSET:
+            tokens.append((var, var.set(value)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def wrap(func):
+    """Returns a callable which runs func in a copy of the current context. Use it to
+    pass work to threads or executors.
+    """
+    ctx = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return ctx.run(func, *args, **kwargs)
+    return wrapper
+
+
+def capture():
+    """Returns the current context as a JSON serializable dict which can be stored along
+    with a queued task and restored using bind_captured() by the worker.
+    """
+    org = get_current_org()
+    return {
+        'org_id': org.pk if org is not None else None,
+        'actor': get_current_actor(),
+    }
+
+
+def bind_captured(captured):
+    """Context manager which binds the context returned by capture(). The Org is only
+    fetched if it is used.
+    """
+    captured = captured or {}
+    org_id = captured.get('org_id')
+
+    def load_org():
+        from apps.Organization.models import Org
+
+        if org_id is None:
+            return None
+        return Org.objects.filter(pk=org_id).first()
+
+    return bind(request=None, org=LazyValue(load_org), actor=captured.get('actor'))
+
+
+class ContextMiddleware:
+    """Base middleware binding the values returned by get_context_values() while the
+    request is being served. Sync only, like the rest of the middlewares on Django 2.2.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def get_context_values(self, request):
+        """Returns the keyword arguments passed to bind()."""
+        raise NotImplementedError('subclasses of ContextMiddleware must provide a '
+                                  'get_context_values() method')
+
+    def __call__(self, request):
+        with bind(**self.get_context_values(request)):
+            return self.get_response(request)
@@ -0,0 +1,9 @@
+from django.contrib import admin
+from .models import (
+    MailRunCheckpoint, NotificationEvent, OrgNotificationSettings, OutboxMessage,
+)
+
+admin.site.register(OutboxMessage)
+admin.site.register(MailRunCheckpoint)
+admin.site.register(NotificationEvent)
+admin.site.register(OrgNotificationSettings)
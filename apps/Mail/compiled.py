@@ -0,0 +1,154 @@
+"""Mail templates compiled ahead of time.
+
+The mail templates wrap their HTML in {% inlinecss %}, which parses mail/styles.css and
+inlines it into every element of every mail rendered. The 'compile_mail_templates'
+command (run at deploy time, after 'collectstatic') does it once per template instead:
+
+    - The body of {% inlinecss %} is inlined as is, the Django tags and variables in it
+      being plain text to the CSS inliner. The result is a template rendering the same
+      mail (up to the whitespace between the rows of tables) without any CSS work.
+    - The plain text variant is strip_tags() of the compiled template, rendering the same
+      text as strip_tags() of the rendered HTML.
+
+Both are saved under MAIL_COMPILED_TEMPLATES_ROOT and parsed once per process by
+render_mail(). A template which is not compiled, or older than its source, is compiled
+in the process on first use instead.
+"""
+
+import functools
+import os
+import re
+
+from django.conf import settings
+from django.template import TemplateSyntaxError, Variable, engines
+from django.template.loader import get_template
+from django.template.utils import get_app_template_dirs
+from django.utils.html import strip_tags
+from django_inlinecss import conf as inlinecss_conf
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Directory of the mail templates in the template directories.
+MAIL_TEMPLATE_DIR = 'mail'
+
+# Suffix of the plain text variant of a compiled template.
+TEXT_SUFFIX = '.txt'
+
+_LOAD_RE = re.compile(r'{%\s*load\s+inlinecss\s*%}')
+_INLINECSS_RE = re.compile(r'{%\s*inlinecss\s+(.+?)\s*%}(.*?){%\s*endinlinecss\s*%}',
+                           re.DOTALL)
+
+
+def get_compiled_root():
+    return getattr(settings, 'MAIL_COMPILED_TEMPLATES_ROOT', None)
+
+
+def find_mail_templates():
+    """Returns the names of the templates in the 'mail' template directories, Eg:
+    mail/dispute.html. The names found in several template directories are listed once.
+    """
+    template_dirs = list(engines['django'].engine.dirs) + \
+        list(get_app_template_dirs('templates'))
+    names = set()
+    for template_dir in template_dirs:
+        mail_dir = os.path.join(template_dir, MAIL_TEMPLATE_DIR)
+        for dir_path, _, file_names in os.walk(mail_dir):
+            for file_name in file_names:
+                if file_name.endswith('.html'):
+                    path = os.path.join(dir_path, file_name)
+                    names.add(os.path.relpath(path, template_dir).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def _inline(match):
+    css = ''
+    for path in match.group(1).split():
+        path = Variable(path)
+        if path.literal is None:
+            raise TemplateSyntaxError("Only {%% inlinecss %%} with quoted paths can be "
+                                      "compiled. Got: %s" % (path.var,))
+        css += inlinecss_conf.get_css_loader()().load(path.literal)
+    return inlinecss_conf.get_engine()(html=match.group(2), css=css).render()
+
+
+def compile_template(template_name):
+    """Compiles a mail template. See the module docstring.
+
+    Arguments:
+        template_name {str} -- Name of the template, Eg: mail/dispute.html
+
+    Returns:
+        tuple -- (html template source, plain text template source)
+    """
+    source = get_template(template_name).template.source
+    html_source = _INLINECSS_RE.sub(_inline, _LOAD_RE.sub('', source))
+    return html_source, strip_tags(html_source)
+
+
+def _compiled_path(template_name):
+    return os.path.join(get_compiled_root(), *template_name.split('/'))
+
+
+def save_compiled(template_name):
+    """Compiles a mail template into MAIL_COMPILED_TEMPLATES_ROOT.
+
+    Returns:
+        str -- Path of the compiled html template.
+    """
+    html_source, text_source = compile_template(template_name)
+    path = _compiled_path(template_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    for file_path, content in ((path, html_source), (path + TEXT_SUFFIX, text_source)):
+        with open(file_path, 'w', encoding='utf-8') as compiled_file:
+            compiled_file.write(content)
+    return path
+
+
+def _load_compiled(template_name):
+    """Returns the saved (html, text) sources of the template, or None when they are
+    missing or older than the template.
+    """
+    if not get_compiled_root():
+        return None
+    path = _compiled_path(template_name)
+    try:
+        compiled_at = min(os.path.getmtime(path), os.path.getmtime(path + TEXT_SUFFIX))
+        origin = get_template(template_name).origin.name
+        if os.path.exists(origin) and os.path.getmtime(origin) > compiled_at:
+            return None
+        sources = []
+        for file_path in (path, path + TEXT_SUFFIX):
+            with open(file_path, encoding='utf-8') as compiled_file:
+                sources.append(compiled_file.read())
+    except OSError:
+        return None
+    return tuple(sources)
+
+
+@functools.lru_cache(maxsize=None)
+def get_compiled(template_name):
+    """Returns the compiled (html, plain text) templates, parsed once per process."""
+    sources = _load_compiled(template_name)
+    if sources is None:
+        logger.warning("Mail template %s is not compiled or changed since. Compiling it "
+                       "in the process. Run 'python manage.py compile_mail_templates'." %
+                       (template_name,))
+        sources = compile_template(template_name)
+    engine = engines['django']
+    return engine.from_string(sources[0]), engine.from_string(sources[1])
+
+
+def render_mail(template_name, context):
+    """Renders a mail template compiled ahead of time. Same as render_to_string() of the
+    template and strip_tags() of the result, without inlining the CSS.
+
+    Arguments:
+        template_name {str} -- Name of the template, Eg: mail/dispute.html
+        context {dict} -- Context of the template.
+
+    Returns:
+        tuple -- (plain text body, html body)
+    """
+    html_template, text_template = get_compiled(template_name)
+    return text_template.render(context), html_template.render(context)
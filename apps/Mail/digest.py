@@ -0,0 +1,218 @@
+"""Digests of the notifications of each recipient.
+
+Instead of one mail per event (Eg: per device assigned), notify() records a
+NotificationEvent per recipient in the current transaction. The events of a recipient
+are gathered for the digest window of the Org (OrgNotificationSettings.digest_window,
+MAIL_DIGEST_WINDOW by default) from his first pending event, and sent as a single mail:
+
+    - The first event of a recipient without pending events sets when his digest is
+      sent (send_after). The events following it join that digest.
+    - An event of a kind sent right away (OrgNotificationSettings.immediate_kinds,
+      MAIL_DIGEST_IMMEDIATE_KINDS by default), or of an Org with a window of 0, makes
+      the digest of the recipient due at once, along with the events already pending.
+    - flush_due(), called by the 'run_mail_worker' command, turns the due digests into
+      mails of the outbox (see outbox.py), in the transaction deleting their events.
+
+The renderer of a digest is called with {'events': [{'kind': .., 'context': ..}, ...]},
+the events in the order they happened.
+"""
+
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from apps.Core import context as request_context
+from . import outbox
+from .models import NotificationEvent, OrgNotificationSettings
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of due events picked up per transaction by default.
+DEFAULT_BATCH_SIZE = 500
+
+# Keeps the 'IN' lists within the parameter limits of all the supported DBs.
+_QUERY_CHUNK_SIZE = 500
+
+
+def get_digest_settings(org_id=None):
+    """Returns the digest settings of the Org.
+
+    Returns:
+        tuple -- (seconds the notifications are gathered for,
+                  set of the kinds of the events mailed right away)
+    """
+    org_settings = None
+    if org_id is not None:
+        org_settings = OrgNotificationSettings.objects.filter(org_id=org_id).first()
+
+    window = getattr(settings, 'MAIL_DIGEST_WINDOW', 300)
+    immediate_kinds = set(getattr(settings, 'MAIL_DIGEST_IMMEDIATE_KINDS', ()))
+    if org_settings is not None:
+        if org_settings.digest_window is not None:
+            window = org_settings.digest_window
+        immediate_kinds = {kind.strip()
+                           for kind in org_settings.immediate_kinds.split(',')
+                           if kind.strip()}
+    return window, immediate_kinds
+
+
+def notify_many(renderer, events, org_id=None, from_email=None):
+    """Records events to be mailed in the digests of their recipients. Call it in the
+    transaction of the change the events are about. See the module docstring.
+
+    Arguments:
+        renderer {function or str} -- Module level function (or its dotted path)
+                                      rendering the digests. See the module docstring.
+        events {iterable} -- (kind, recipients, context) of each event. context should
+                             be serializable to JSON.
+
+    Keyword Arguments:
+        org_id {int} -- id of the Org of the events. Its settings apply. (default: {None})
+        from_email {str} -- Email id shown in the from section.
+                            (default: {settings.EMAIL_FROM_ADDRESS})
+
+    Returns:
+        int -- Number of events recorded (one per recipient).
+    """
+    renderer = outbox.renderer_path(renderer)
+    from_email = from_email or settings.EMAIL_FROM_ADDRESS
+    rows = []
+    for kind, recipients, context in events:
+        context = json.dumps(context, cls=DjangoJSONEncoder)
+        # A recipient listed twice (Eg: the previous user is the admin) is notified once.
+        for recipient in dict.fromkeys(recipients):
+            rows.append((kind, recipient, context))
+    if not rows:
+        return 0
+
+    now = timezone.now()
+    captured = json.dumps(request_context.capture())
+    window, immediate_kinds = get_digest_settings(org_id)
+    recipients = {recipient for _, recipient, _ in rows}
+    if window <= 0:
+        due_now = recipients
+    else:
+        due_now = {recipient for kind, recipient, _ in rows if kind in immediate_kinds}
+
+    # The events join the pending digests of their recipients.
+    send_after = {}
+    pending = NotificationEvent.objects.filter(renderer=renderer)
+    recipient_list = sorted(recipients - due_now)
+    for i in range(0, len(recipient_list), _QUERY_CHUNK_SIZE):
+        send_after.update(
+            pending.filter(recipient__in=recipient_list[i:i + _QUERY_CHUNK_SIZE])
+            .order_by().values('recipient').annotate(send_after=Min('send_after'))
+            .values_list('recipient', 'send_after'))
+    if due_now:
+        due_list = sorted(due_now)
+        for i in range(0, len(due_list), _QUERY_CHUNK_SIZE):
+            pending.filter(recipient__in=due_list[i:i + _QUERY_CHUNK_SIZE],
+                           send_after__gt=now).update(send_after=now)
+
+    default_send_after = now + timedelta(seconds=window)
+    NotificationEvent.objects.bulk_create(
+        [NotificationEvent(recipient=recipient, renderer=renderer, kind=kind,
+                           context=context, from_email=from_email, org_id=org_id,
+                           request_context=captured, created_at=now,
+                           send_after=now if recipient in due_now else
+                           send_after.get(recipient, default_send_after))
+         for kind, recipient, context in rows],
+        batch_size=_QUERY_CHUNK_SIZE)
+    return len(rows)
+
+
+def notify(renderer, kind, recipients, context, org_id=None, from_email=None):
+    """Records an event to be mailed in the digests of the recipients. See notify_many().
+
+    Arguments:
+        kind {str} -- Type of the event, Eg: 'assigned'.
+        recipients {list(str)} -- Email ids notified.
+        context {dict} -- Data of the event.
+
+    Returns:
+        int -- Number of events recorded (one per recipient).
+    """
+    return notify_many(renderer, [(kind, recipients, context)], org_id=org_id,
+                       from_email=from_email)
+
+
+def digest_stats():
+    """Returns the number of events waiting for their digest and of recipients.
+
+    Returns:
+        dict -- {'events': events buffered, 'recipients': recipients with pending
+                 events, 'due': events of the digests to be sent now}
+    """
+    pending = NotificationEvent.objects.all()
+    return {
+        'events': pending.count(),
+        'recipients': pending.order_by().values('recipient').distinct().count(),
+        'due': pending.filter(send_after__lte=timezone.now()).count(),
+    }
+
+
+def flush_due(batch_size=DEFAULT_BATCH_SIZE):
+    """Queues the due digests in the outbox. See the module docstring.
+
+    Keyword Arguments:
+        batch_size {int} -- Max number of due events picked up. All the pending events
+                            of their recipients are sent along.
+
+    Returns:
+        int -- Number of digests queued. 0 when none is due (or all of them are being
+               flushed by others).
+    """
+    using = NotificationEvent.objects.db
+    skip_locked = connections[using].features.has_select_for_update_skip_locked
+
+    def locked(queryset):
+        if skip_locked:
+            return queryset.select_for_update(skip_locked=True)
+        return queryset
+
+    with transaction.atomic(using=using):
+        due = list(locked(NotificationEvent.objects.filter(send_after__lte=timezone.now())
+                          .order_by('id')).values_list('recipient', 'renderer')
+                   [:batch_size])
+        if not due:
+            return 0
+
+        digests = {}
+        recipient_list = sorted({recipient for recipient, _ in due})
+        due = set(due)
+        for i in range(0, len(recipient_list), _QUERY_CHUNK_SIZE):
+            events = locked(NotificationEvent.objects.filter(
+                recipient__in=recipient_list[i:i + _QUERY_CHUNK_SIZE]).order_by('id'))
+            for event in events:
+                key = (event.recipient, event.renderer)
+                # Pending events of another renderer wait for their own digest.
+                if key in due:
+                    digests.setdefault(key, []).append(event)
+
+        # One INSERT per renderer. A digest is rendered in the request context of its
+        # latest event.
+        mails_by_renderer = {}
+        for (recipient, renderer), events in digests.items():
+            context = {'events': [{'kind': event.kind,
+                                    'context': json.loads(event.context)}
+                                   for event in events]}
+            key = (renderer, events[0].from_email, events[-1].request_context)
+            mails_by_renderer.setdefault(key, []).append((context, [recipient]))
+        for (renderer, from_email, captured), mails in mails_by_renderer.items():
+            outbox.enqueue_many(renderer, mails, from_email=from_email,
+                                captured=json.loads(captured))
+
+        event_ids = sorted(event.pk for events in digests.values() for event in events)
+        for i in range(0, len(event_ids), _QUERY_CHUNK_SIZE):
+            NotificationEvent.objects.filter(
+                id__in=event_ids[i:i + _QUERY_CHUNK_SIZE]).delete()
+
+    queued = len(digests)
+    logger.debug("Queued %d digests of %d events" % (queued, len(event_ids)))
+    return queued
@@ -0,0 +1,35 @@
+"""Management command compiling the mail templates: the CSS is inlined and the plain text
+variants are generated once, instead of for every mail. See apps/Mail/compiled.py
+
+Run it at deploy time, after 'collectstatic' (the CSS is read from the static files),
+and again after changing a mail template or mail/styles.css.
+
+Usage:
+    python manage.py compile_mail_templates
+    python manage.py compile_mail_templates mail/assigned.html mail/dispute.html
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.Mail import compiled
+
+
+class Command(BaseCommand):
+    help = "Compiles the mail templates into MAIL_COMPILED_TEMPLATES_ROOT."
+
+    def add_arguments(self, parser):
+        parser.add_argument('template_names', nargs='*',
+                            help="Templates to compile. All the mail/ templates by "
+                                 "default.")
+
+    def handle(self, *args, **options):
+        if not compiled.get_compiled_root():
+            raise CommandError("Set MAIL_COMPILED_TEMPLATES_ROOT to compile the mail "
+                               "templates.")
+
+        template_names = options['template_names'] or compiled.find_mail_templates()
+        for template_name in template_names:
+            path = compiled.save_compiled(template_name)
+            self.stdout.write("Compiled %s into %s" % (template_name, path))
+        compiled.get_compiled.cache_clear()
+        self.stdout.write("Compiled %d mail templates." % (len(template_names),))
@@ -0,0 +1,43 @@
+"""Management command printing the depth and lag of the mail outbox, and the number of
+notifications waiting for their digest, as JSON. Fails (exit status 1) when the limits
+passed are exceeded, so that it can be used as a monitoring check.
+
+Usage:
+    python manage.py mail_outbox_status
+    python manage.py mail_outbox_status --max-lag 600 --max-depth 5000 --max-dead 0
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.Mail.digest import digest_stats
+from apps.Mail.outbox import queue_stats
+
+
+class Command(BaseCommand):
+    help = "Prints the depth and lag of the mail outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-lag', type=float,
+                            help="Fail when the oldest queued mail is older (seconds).")
+        parser.add_argument('--max-depth', type=int,
+                            help="Fail when more mails are queued.")
+        parser.add_argument('--max-dead', type=int,
+                            help="Fail when more mails are dead-lettered.")
+
+    def handle(self, *args, **options):
+        stats = queue_stats()
+        stats['digests'] = digest_stats()
+        self.stdout.write(json.dumps(stats, cls=DjangoJSONEncoder))
+
+        if options['max_lag'] is not None and stats['lag_seconds'] > options['max_lag']:
+            raise CommandError("Mails are %.0f s behind. Limit: %.0f s" %
+                               (stats['lag_seconds'], options['max_lag']))
+        if options['max_depth'] is not None and stats['depth'] > options['max_depth']:
+            raise CommandError("%d mails in the outbox. Limit: %d" %
+                               (stats['depth'], options['max_depth']))
+        if options['max_dead'] is not None and stats['dead'] > options['max_dead']:
+            raise CommandError("%d mails dead-lettered. Limit: %d" %
+                               (stats['dead'], options['max_dead']))
@@ -0,0 +1,89 @@
+"""Management command which sends the mails queued in the outbox. See apps/Mail/outbox.py
+The digests of notifications which are due (see apps/Mail/digest.py) are queued first.
+
+Runs until stopped (SIGTERM / Ctrl+C), waiting for the current batch to finish. The
+connection to the mail server is reused across the batches and closed when the outbox is
+empty. When the mail server cannot be reached, it is retried with an increasing delay.
+
+Usage:
+    python manage.py run_mail_worker
+    python manage.py run_mail_worker --once    # Send the due mails and exit. Eg: cron.
+"""
+
+import signal
+import time
+
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from apps.Mail import digest, outbox
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Max delay between retries when the mail server keeps failing.
+MAX_RETRY_DELAY = 60
+
+
+class Command(BaseCommand):
+    help = "Sends the mails queued in the outbox in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.DEFAULT_BATCH_SIZE,
+                            help="Number of mails claimed and sent per batch.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to wait when no mail is due.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no mail is due.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size should be a positive number.")
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+
+        connection = mail.get_connection()
+        retry_delay = 0
+        total = {'sent': 0, 'retried': 0, 'dead': 0}
+        try:
+            while not self.stopping:
+                close_old_connections()
+                try:
+                    digests = digest.flush_due()
+                    result = outbox.process_batch(options['batch_size'], connection)
+                except Exception:
+                    if options['once']:
+                        raise
+                    retry_delay = min(max(retry_delay * 2, 1), MAX_RETRY_DELAY)
+                    logger.exception("Failed to send the queued mails. Retrying in %d s" %
+                                     (retry_delay,))
+                    time.sleep(retry_delay)
+                    continue
+                retry_delay = 0
+
+                if digests:
+                    logger.info("Queued %d digests." % (digests,))
+                if result['rows'] or digests:
+                    for name in total:
+                        total[name] += result[name]
+                    logger.info("Mails processed. sent:%(sent)d retried:%(retried)d "
+                                "dead:%(dead)d" % result)
+                    continue
+
+                # Not kept open while idle. Mail servers drop idle connections.
+                connection.close()
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
+        self.stdout.write("Sent %(sent)d mails. %(retried)d to be retried, %(dead)d "
+                          "dead-lettered." % total)
+
+    def stop(self, signum, frame):
+        # The current batch is completed before exiting.
+        self.stopping = True
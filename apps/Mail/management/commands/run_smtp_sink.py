@@ -0,0 +1,87 @@
+"""Management command running a local SMTP server which accepts and discards the mails,
+with the latency and the failures requested. See apps/Mail/smtp_sink.py
+
+Point the app and the mail workers at it with OUR_EMAIL_BACKEND=sink (SMTP_SINK_HOST and
+SMTP_SINK_PORT when not on this host / port) to load test the mail paths without a real
+mail server.
+
+Usage:
+    python manage.py run_smtp_sink
+    python manage.py run_smtp_sink --port 8025 --latency 0.05 --temp-failure-rate 0.01
+"""
+
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.Mail import smtp_sink
+
+
+def add_sink_arguments(parser):
+    """Adds the options of SinkHandler. Shared with the 'benchmark_mail_throughput'
+    command.
+    """
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="Seconds each mail takes to be accepted.")
+    parser.add_argument('--temp-failure-rate', type=float, default=0.0,
+                        help="Share of the mails refused temporarily (451). Eg: 0.01")
+    parser.add_argument('--perm-failure-rate', type=float, default=0.0,
+                        help="Share of the mails refused permanently (554).")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0,
+                        help="Share of the mails for which the connection is dropped.")
+    parser.add_argument('--seed', type=int,
+                        help="Seed of the failures, to repeat a run.")
+
+
+def get_sink_options(options):
+    """Returns the SinkHandler arguments of the options added by add_sink_arguments()."""
+    rates = ('temp_failure_rate', 'perm_failure_rate', 'disconnect_rate')
+    if options['latency'] < 0 or any(not 0 <= options[rate] <= 1 for rate in rates) or \
+            sum(options[rate] for rate in rates) > 1:
+        raise CommandError("--latency should not be negative and the rates should be "
+                           "between 0 and 1, adding up to 1 at most.")
+    return {name: options[name] for name in ('latency', 'seed') + rates}
+
+
+class Command(BaseCommand):
+    help = "Runs a local SMTP server discarding the mails, to load test the mail paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=smtp_sink.DEFAULT_HOST,
+                            help="Address to listen on. 0.0.0.0 for all.")
+        parser.add_argument('--port', type=int, default=smtp_sink.DEFAULT_PORT,
+                            help="Port to listen on.")
+        parser.add_argument('--report-interval', type=float, default=10.0,
+                            help="Seconds between two reports of the counters.")
+        add_sink_arguments(parser)
+
+    def handle(self, *args, **options):
+        sink_options = get_sink_options(options)
+        try:
+            sink = smtp_sink.SmtpSink(options['host'], options['port'], **sink_options)
+        except ImportError as error:
+            raise CommandError(str(error))
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        sink.start()
+        self.stdout.write("SMTP sink listening on %s:%d" % (sink.host, sink.port))
+        try:
+            while not self.stopping:
+                time.sleep(options['report_interval'])
+                self.report(sink.get_stats())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.stop()
+        self.report(sink.get_stats())
+
+    def report(self, stats):
+        self.stdout.write("accepted:%(accepted)d (%(per_second).1f/s) "
+                          "recipients:%(recipients)d temp_failed:%(temp_failed)d "
+                          "perm_failed:%(perm_failed)d disconnected:%(disconnected)d" %
+                          stats)
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Mail', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailRunCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('first_user_id', models.PositiveIntegerField()),
+                ('last_user_id', models.PositiveIntegerField()),
+                ('done_until', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('skipped', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('queued', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'mail run checkpoint',
+                'verbose_name_plural': 'mail run checkpoints',
+                'unique_together': {('name', 'first_user_id', 'last_user_id')},
+            },
+        ),
+    ]
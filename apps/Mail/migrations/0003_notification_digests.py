@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:58
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Mail', '0002_mail_run_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.CharField(max_length=254)),
+                ('renderer', models.CharField(max_length=200)),
+                ('kind', models.CharField(max_length=50)),
+                ('context', models.TextField()),
+                ('from_email', models.CharField(max_length=254)),
+                ('org_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('send_after', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'notification event',
+                'verbose_name_plural': 'notification events',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='OrgNotificationSettings',
+            fields=[
+                ('org_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('digest_window', models.PositiveIntegerField(blank=True, null=True)),
+                ('immediate_kinds', models.CharField(blank=True, max_length=200)),
+            ],
+            options={
+                'verbose_name': 'org notification settings',
+                'verbose_name_plural': 'org notification settings',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notificationevent',
+            index=models.Index(fields=['send_after'], name='mail_event_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationevent',
+            index=models.Index(fields=['recipient'], name='mail_event_recipient_idx'),
+        ),
+    ]
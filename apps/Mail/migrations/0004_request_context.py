@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Mail', '0003_notification_digests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationevent',
+            name='request_context',
+            field=models.TextField(default='{}'),
+        ),
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='request_context',
+            field=models.TextField(default='{}'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Mail', '0004_request_context'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='claim_token',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
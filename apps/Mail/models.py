@@ -0,0 +1,168 @@
+from django.db import models
+from django.utils import timezone
+
+
+class OutboxMessage(models.Model):
+    """
+    A mail waiting to be sent. Written by the web requests in the same transaction as the
+    change the mail is about (see outbox.enqueue) and sent by the 'run_mail_worker'
+    command, which deletes the row once the mail has been accepted by the mail server.
+
+    Only the data the mail is made of is stored. The mail is rendered by the worker, so
+    that a request never waits for template rendering, CSS inlining or the mail server.
+    Mails which cannot be sent (rejected by the server, or failing
+    MAIL_OUTBOX_MAX_ATTEMPTS times) are kept with dead_at set, for an admin to look at.
+    """
+
+    # Dotted path of the function rendering the mail. Called with the context, it returns
+    # (subject, plain text body, html body or None).
+    renderer = models.CharField(max_length=200)
+
+    # JSON object passed to the renderer.
+    context = models.TextField()
+
+    from_email = models.CharField(max_length=254)
+
+    # JSON list of the email addresses the mail is sent to.
+    recipients = models.TextField()
+
+    # JSON object of the request context the mail was queued in (Org and user making the
+    # change, see apps.Core.context.capture). Bound by the worker while rendering.
+    request_context = models.TextField(default='{}')
+
+    # Used to measure how far behind the worker is.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    # The worker picks up the rows due. Moved forward on every failed attempt, and by
+    # MAIL_OUTBOX_CLAIM_TIMEOUT while a worker is sending the mail (see outbox.py).
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+
+    # Token of the worker which claimed the row last. The outcome of the mail is only
+    # recorded while the row still carries it.
+    claim_token = models.CharField(max_length=32, blank=True)
+
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    # Set when the mail was given up on.
+    dead_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "outbox message"
+        verbose_name_plural = "outbox messages"
+        # Oldest first. The pk increases with time and is used for ordering.
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['dead_at', 'next_attempt_at'],
+                         name='mail_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        state = "dead @ %s" % (self.dead_at,) if self.dead_at else \
+            "due @ %s" % (self.next_attempt_at,)
+        return "%s to %s %s" % (self.renderer.rsplit('.', 1)[-1], self.recipients, state)
+
+
+class MailRunCheckpoint(models.Model):
+    """
+    Progress of a run of a command mailing the users in bulk (Eg: 'send_summary_mails')
+    over the users with ids in [first_user_id, last_user_id]. The users are mailed in
+    the order of their ids, so that an interrupted run resumes after the last user done.
+    Runs over disjoint ranges of users can run side by side, Eg: on several hosts.
+    """
+
+    # Name of the run, Eg: 'summary-2026-10-18'. Running it again resumes it.
+    name = models.CharField(max_length=100)
+    first_user_id = models.PositiveIntegerField()
+    last_user_id = models.PositiveIntegerField()
+
+    # The users with ids up to this were mailed (or skipped).
+    done_until = models.PositiveIntegerField(default=0)
+
+    sent = models.PositiveIntegerField(default=0)
+    # Users with nothing to mail.
+    skipped = models.PositiveIntegerField(default=0)
+    # Mails refused permanently.
+    failed = models.PositiveIntegerField(default=0)
+    # Mails refused temporarily, queued in the outbox to be retried.
+    queued = models.PositiveIntegerField(default=0)
+
+    started_at = models.DateTimeField(default=timezone.now)
+    # Null while the run is not completed.
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "mail run checkpoint"
+        verbose_name_plural = "mail run checkpoints"
+        unique_together = [('name', 'first_user_id', 'last_user_id')]
+
+    def __str__(self):
+        return "%s users %d-%d done until %d" % (self.name, self.first_user_id,
+                                                 self.last_user_id, self.done_until)
+
+
+class NotificationEvent(models.Model):
+    """
+    A notification waiting to be mailed to a recipient, along with the others he gets
+    within the digest window of his Org (see digest.py). The pending events of a
+    recipient are sent as a single mail once the first of them is due.
+    """
+
+    recipient = models.CharField(max_length=254)
+    # Dotted path of the function rendering the digest. Called with
+    # {'events': [{'kind': .., 'context': ..}, ...]} like the renderers of OutboxMessage.
+    renderer = models.CharField(max_length=200)
+    # Type of the event, Eg: 'assigned'. Used for the immediate send overrides.
+    kind = models.CharField(max_length=50)
+    # JSON object describing the event. Passed to the renderer.
+    context = models.TextField()
+    from_email = models.CharField(max_length=254)
+
+    # id of the Org the event belongs to. Not a FK, see OrgIndexGeneration.
+    org_id = models.PositiveIntegerField(null=True, blank=True)
+
+    # JSON object of the request context the event was recorded in. Passed on to the
+    # mail of the digest, see OutboxMessage.request_context.
+    request_context = models.TextField(default='{}')
+
+    created_at = models.DateTimeField(default=timezone.now)
+    # When the digest of the recipient is sent. Same for all his pending events.
+    send_after = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "notification event"
+        verbose_name_plural = "notification events"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['send_after'], name='mail_event_due_idx'),
+            models.Index(fields=['recipient'], name='mail_event_recipient_idx'),
+        ]
+
+    def __str__(self):
+        return "%s to %s @ %s" % (self.kind, self.recipient, self.send_after)
+
+
+class OrgNotificationSettings(models.Model):
+    """
+    Digest settings of an Org, overriding MAIL_DIGEST_WINDOW and
+    MAIL_DIGEST_IMMEDIATE_KINDS. The Orgs without a row use the settings.
+    """
+
+    # id of the Org. Not a FK, see OrgIndexGeneration.
+    org_id = models.PositiveIntegerField(primary_key=True)
+
+    # Seconds the notifications of a recipient are gathered for before being mailed. 0
+    # mails them right away. MAIL_DIGEST_WINDOW when empty.
+    digest_window = models.PositiveIntegerField(null=True, blank=True)
+
+    # Comma separated kinds of the events mailed right away (along with the other events
+    # pending for the recipient), Eg: 'dispute'. None when empty.
+    immediate_kinds = models.CharField(max_length=200, blank=True)
+
+    class Meta:
+        verbose_name = "org notification settings"
+        verbose_name_plural = "org notification settings"
+
+    def __str__(self):
+        return "%s: window %s immediate %s" % (self.org_id, self.digest_window,
+                                               self.immediate_kinds or '-')
@@ -0,0 +1,358 @@
+"""Outbox of the mails sent by the app.
+
+A web request only queues the mail with enqueue(), inside the transaction of the change
+the mail is about: the mail is queued if and only if the change is committed, and the
+request never waits for rendering or for the mail server. The 'run_mail_worker' command
+sends the queued mails in batches:
+
+    1. The oldest due rows are claimed: a conditional UPDATE marks them with a token
+       of the worker and moves their next_attempt_at MAIL_OUTBOX_CLAIM_TIMEOUT seconds
+       ahead, so that the other workers skip them. Where the DB supports it, the rows
+       are read with SKIP LOCKED in a short transaction, so that workers do not wait
+       for each other. A worker which dies while sending leaves its rows due again
+       once the claim expires.
+    2. Each mail is rendered, with the Org and user of the request which queued it bound
+       (see apps/Core/context.py), and sent over a single connection to the mail
+       server, kept open across the batches while there are mails to send. No
+       transaction is open and no row is locked while sending.
+    3. The outcome of the mails is recorded afterwards, on the rows still carrying the
+       token only. Sent rows are deleted. A mail sent whose outcome could not be
+       recorded (the worker died, or took longer than the claim) is sent again (at
+       least once delivery).
+    4. A mail refused for a temporary reason is retried later with an increasing delay
+       (MAIL_OUTBOX_RETRY_DELAY, doubled on every attempt up to
+       MAIL_OUTBOX_MAX_RETRY_DELAY), and so is a mail failing to render (Eg:
+       mail/styles.css missing until 'collectstatic' has run). A mail refused permanently
+       (5xx reply, or its template or a value of its context missing), or failing
+       MAIL_OUTBOX_MAX_ATTEMPTS times, is dead-lettered: kept with dead_at set. Clearing
+       dead_at (Eg: in the admin) queues it again.
+    5. When the connection to the mail server fails, the batch stops and the error is
+       raised once the mails sent are recorded. The mails not sent are not charged an
+       attempt and are due again at once, the worker retries the connection with an
+       increasing delay.
+"""
+
+import json
+import smtplib
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.template import TemplateDoesNotExist
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apps.Core import context as request_context
+from .models import OutboxMessage
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of mails claimed and sent per batch by default.
+DEFAULT_BATCH_SIZE = 100
+
+# Keeps the 'IN' lists within the parameter limits of all the supported DBs.
+_QUERY_CHUNK_SIZE = 500
+
+
+def get_max_attempts():
+    return getattr(settings, 'MAIL_OUTBOX_MAX_ATTEMPTS', 8)
+
+
+def get_claim_timeout():
+    return getattr(settings, 'MAIL_OUTBOX_CLAIM_TIMEOUT', 600)
+
+
+def get_retry_delay(attempts):
+    """Returns the seconds to wait before the next attempt of a mail which failed
+    attempts times.
+    """
+    delay = getattr(settings, 'MAIL_OUTBOX_RETRY_DELAY', 60) * 2 ** max(attempts - 1, 0)
+    return min(delay, getattr(settings, 'MAIL_OUTBOX_MAX_RETRY_DELAY', 3600))
+
+
+def renderer_path(renderer):
+    """Returns the dotted path of the renderer stored in the rows."""
+    if isinstance(renderer, str):
+        return renderer
+    return '%s.%s' % (renderer.__module__, renderer.__qualname__)
+
+
+def _new_message(renderer, context, recipients, from_email, captured):
+    return OutboxMessage(renderer=renderer_path(renderer),
+                         context=json.dumps(context, cls=DjangoJSONEncoder),
+                         from_email=from_email or settings.EMAIL_FROM_ADDRESS,
+                         recipients=json.dumps(list(recipients)),
+                         request_context=json.dumps(captured))
+
+
+def enqueue(renderer, context, recipients, from_email=None):
+    """Queues a mail. Call it in the transaction of the change the mail is about.
+
+    Arguments:
+        renderer {function or str} -- Module level function (or its dotted path) called
+                                      by the worker with the context. Returns (subject,
+                                      plain text body, html body or None).
+        context {dict} -- Data of the mail. Should be serializable to JSON.
+        recipients {list(str)} -- Email ids the mail is sent to.
+
+    Keyword Arguments:
+        from_email {str} -- Email id shown in the from section.
+                            (default: {settings.EMAIL_FROM_ADDRESS})
+
+    Returns:
+        OutboxMessage -- The row queued.
+    """
+    message = _new_message(renderer, context, recipients, from_email,
+                           request_context.capture())
+    message.save(force_insert=True)
+    return message
+
+
+def render_prerendered(context):
+    """Renderer of the mails queued already rendered. Eg: a mail of a bulk run which was
+    refused temporarily. The context has the keys 'subject', 'body' and 'html_body'.
+    """
+    return context['subject'], context['body'], context.get('html_body')
+
+
+def enqueue_many(renderer, mails, from_email=None, captured=None):
+    """Queues many mails rendered by the same renderer with one INSERT. See enqueue().
+
+    Arguments:
+        renderer {function or str} -- See enqueue().
+        mails {iterable} -- (context, recipients) of each mail.
+
+    Keyword Arguments:
+        captured {dict} -- Request context the mails are rendered in, as returned by
+                           apps.Core.context.capture(). The current one when None.
+                           (default: {None})
+
+    Returns:
+        int -- Number of mails queued.
+    """
+    if captured is None:
+        captured = request_context.capture()
+    messages = [_new_message(renderer, context, recipients, from_email, captured)
+                for context, recipients in mails]
+    OutboxMessage.objects.bulk_create(messages, batch_size=_QUERY_CHUNK_SIZE)
+    return len(messages)
+
+
+def queue_stats():
+    """Returns the number of mails waiting to be sent and how old the oldest of them is.
+
+    Returns:
+        dict -- {'depth': mails not sent yet, 'due': of which to be sent now,
+                 'retrying': of which failed before, 'dead': dead-lettered mails,
+                 'oldest': datetime or None, 'lag_seconds': float}
+    """
+    now = timezone.now()
+    pending = OutboxMessage.objects.filter(dead_at=None)
+    oldest = pending.order_by('id').values_list('created_at', flat=True).first()
+    lag = (now - oldest).total_seconds() if oldest is not None else 0.0
+    return {
+        'depth': pending.count(),
+        'due': pending.filter(next_attempt_at__lte=now).count(),
+        'retrying': pending.filter(attempts__gt=0).count(),
+        'dead': OutboxMessage.objects.exclude(dead_at=None).count(),
+        'oldest': oldest,
+        'lag_seconds': max(lag, 0.0),
+    }
+
+
+class _ConnectionFailed(Exception):
+    pass
+
+
+def is_connection_error(error):
+    """Returns True when the error is of the connection to the mail server, not of the
+    mail sent.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 421: The server is closing the connection.
+        return error.smtp_code in (-1, 421)
+    # Socket errors. (smtplib.SMTPException is an OSError as well.)
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_permanent_error(error):
+    """Returns True when sending the mail again will fail the same way."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(code >= 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+def is_permanent_render_error(error):
+    """Returns True when rendering the mail again will fail the same way: its template
+    or a value of its context is missing.
+    """
+    return isinstance(error, (TemplateDoesNotExist, KeyError))
+
+
+def _build_email(message, connection):
+    renderer = import_string(message.renderer)
+    subject, body, html_body = renderer(json.loads(message.context))
+    email = EmailMultiAlternatives(subject, body, message.from_email,
+                                   json.loads(message.recipients), connection=connection)
+    if html_body:
+        email.attach_alternative(html_body, 'text/html')
+    return email
+
+
+def _send(message, connection):
+    """Sends the mail. Returns None on success, (error, permanent) on failure.
+
+    Raises:
+        _ConnectionFailed -- The connection to the mail server failed.
+    """
+    try:
+        # Rendered as in the request which queued the mail: get_current_org() and
+        # get_current_actor() return its Org and user.
+        with request_context.bind_captured(json.loads(message.request_context)):
+            email = _build_email(message, connection)
+    except Exception as e:
+        logger.exception("Failed to render the mail %d" % (message.pk,))
+        return e, is_permanent_render_error(e)
+
+    try:
+        connection.send_messages([email])
+    except Exception as e:
+        if is_connection_error(e):
+            raise _ConnectionFailed(e)
+        return e, is_permanent_error(e)
+    return None
+
+
+def _record_failure(message, error, permanent, now):
+    message.attempts += 1
+    message.last_error = "%s: %s" % (type(error).__name__, error)
+    if permanent or message.attempts >= get_max_attempts():
+        message.dead_at = now
+        logger.error("Giving up on the mail %d to %s after %d attempts. %s" %
+                     (message.pk, message.recipients, message.attempts,
+                      message.last_error))
+    else:
+        delay = get_retry_delay(message.attempts)
+        message.next_attempt_at = now + timedelta(seconds=delay)
+        logger.warning("Failed to send the mail %d to %s. Attempt %d. %s" %
+                       (message.pk, message.recipients, message.attempts,
+                        message.last_error))
+    OutboxMessage.objects.filter(pk=message.pk, claim_token=message.claim_token).update(
+        attempts=message.attempts, last_error=message.last_error,
+        dead_at=message.dead_at, next_attempt_at=message.next_attempt_at,
+        claim_token='')
+
+
+def _claim(batch_size, using):
+    """Claims the oldest due mails for the caller. See the module docstring.
+
+    Returns:
+        list(OutboxMessage) -- The rows claimed. They carry the token of the claim.
+    """
+    skip_locked = connections[using].features.has_select_for_update_skip_locked
+    token = uuid.uuid4().hex
+    now = timezone.now()
+    due = OutboxMessage.objects.filter(dead_at=None, next_attempt_at__lte=now)
+
+    def claim(queryset):
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if ids:
+            # Conditions repeated: a row claimed by another worker since it was read is
+            # not due any more.
+            due.filter(id__in=ids).update(
+                claim_token=token,
+                next_attempt_at=now + timedelta(seconds=get_claim_timeout()))
+        return ids
+
+    if skip_locked:
+        with transaction.atomic(using=using):
+            ids = claim(due.select_for_update(skip_locked=True))
+    else:
+        # Not in a transaction: the conditional UPDATE alone makes the claim safe, and
+        # SQLite fails a transaction which reads and then writes when another worker
+        # wrote in between.
+        ids = claim(due)
+    if not ids:
+        return []
+    return list(OutboxMessage.objects.filter(id__in=ids, claim_token=token)
+                .order_by('id'))
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE, connection=None):
+    """Sends the oldest batch of due mails. See the module docstring.
+
+    Keyword Arguments:
+        batch_size {int} -- Max number of mails picked up.
+        connection {} -- Mail backend to send with, Eg: kept open by the caller across
+                         the batches. A new one is opened and closed when None.
+                         (default: {None})
+
+    Raises:
+        Exception -- The error of the connection to the mail server, when it failed.
+
+    Returns:
+        dict -- {'rows': mails picked up, 'sent': .., 'retried': .., 'dead': ..}. rows is
+                0 when no mail is due (or all of them are being sent by others).
+    """
+    result = {'rows': 0, 'sent': 0, 'retried': 0, 'dead': 0}
+    using = OutboxMessage.objects.db
+    batch = _claim(batch_size, using)
+    if not batch:
+        return result
+
+    own_connection = connection is None
+    if own_connection:
+        connection = mail.get_connection()
+    connection_error = None
+    sent_ids, failures = [], []
+    try:
+        # Opened once for the batch. A no-op when it already is open.
+        connection.open()
+        for message in batch:
+            failure = _send(message, connection)
+            if failure is None:
+                sent_ids.append(message.pk)
+            else:
+                failures.append((message, ) + failure)
+    except Exception as e:
+        connection_error = e.args[0] if isinstance(e, _ConnectionFailed) else e
+        # Reopened by the next batch.
+        connection.close()
+    finally:
+        if own_connection:
+            connection.close()
+
+    token = batch[0].claim_token
+    done_ids = set(sent_ids) | {message.pk for message, _, _ in failures}
+    not_sent_ids = [message.pk for message in batch if message.pk not in done_ids]
+    # Each statement commits on its own and only writes to the rows still claimed. The
+    # outcomes not recorded when the worker dies are sent again once the claim expires.
+    claimed = OutboxMessage.objects.filter(claim_token=token)
+    for i in range(0, len(sent_ids), _QUERY_CHUNK_SIZE):
+        claimed.filter(id__in=sent_ids[i:i + _QUERY_CHUNK_SIZE]).delete()
+    now = timezone.now()
+    for message, error, permanent in failures:
+        _record_failure(message, error, permanent, now)
+        result['dead' if message.dead_at else 'retried'] += 1
+    # Not charged an attempt. Due again for the next batch.
+    for i in range(0, len(not_sent_ids), _QUERY_CHUNK_SIZE):
+        claimed.filter(id__in=not_sent_ids[i:i + _QUERY_CHUNK_SIZE]).update(
+            next_attempt_at=now, claim_token='')
+    result['sent'] = len(sent_ids)
+    result['rows'] = len(sent_ids) + len(failures)
+
+    logger.debug("Processed %(rows)d queued mails. sent:%(sent)d retried:%(retried)d "
+                 "dead:%(dead)d" % result)
+    if connection_error is not None:
+        raise connection_error
+    return result
@@ -0,0 +1,147 @@
+"""Local SMTP server accepting and discarding every mail, to load test the mail paths
+without a real mail server. Needs the aiosmtpd package.
+
+The mails can be delayed and refused at random to see how the senders cope:
+
+    - latency: seconds each mail takes to be accepted, Eg: 0.05 for a remote relay.
+    - temp_failure_rate: share of the mails refused with a temporary error (451),
+      retried by the outbox.
+    - perm_failure_rate: share of the mails refused with a permanent error (554),
+      dead-lettered by the outbox.
+    - disconnect_rate: share of the mails for which the connection is dropped, which
+      the senders reconnect after.
+
+Run it with 'python manage.py run_smtp_sink' and OUR_EMAIL_BACKEND=sink, or in the
+process with SmtpSink (see the 'benchmark_mail_throughput' command).
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8025
+
+
+class SinkHandler:
+    """aiosmtpd handler counting the mails received, with the latency and the failures
+    injected. See the module docstring.
+    """
+
+    def __init__(self, latency=0.0, temp_failure_rate=0.0, perm_failure_rate=0.0,
+                 disconnect_rate=0.0, seed=None):
+        self.latency = latency
+        self.temp_failure_rate = temp_failure_rate
+        self.perm_failure_rate = perm_failure_rate
+        self.disconnect_rate = disconnect_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears the counters."""
+        with self.lock:
+            self.counts = {'accepted': 0, 'recipients': 0, 'bytes': 0,
+                           'temp_failed': 0, 'perm_failed': 0, 'disconnected': 0}
+            self.first_at = self.last_at = None
+
+    def get_stats(self):
+        """Returns the counters, and the rate at which the mails were accepted.
+
+        Returns:
+            dict -- accepted, recipients, bytes, temp_failed, perm_failed, disconnected
+                    and per_second (accepted mails per second between the first and the
+                    last mail accepted).
+        """
+        with self.lock:
+            stats = dict(self.counts)
+            elapsed = (self.last_at - self.first_at) if self.first_at is not None else 0
+        stats['per_second'] = stats['accepted'] / elapsed if elapsed > 0 else 0.0
+        return stats
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counts[name] += value
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        roll = self.random.random()
+        if roll < self.disconnect_rate:
+            self._count('disconnected')
+            server.transport.close()
+            return '421 Closing the connection'
+        roll -= self.disconnect_rate
+        if roll < self.temp_failure_rate:
+            self._count('temp_failed')
+            return '451 Try again later'
+        roll -= self.temp_failure_rate
+        if roll < self.perm_failure_rate:
+            self._count('perm_failed')
+            return '554 Transaction failed'
+
+        now = time.perf_counter()
+        with self.lock:
+            self.counts['accepted'] += 1
+            self.counts['recipients'] += len(envelope.rcpt_tos)
+            self.counts['bytes'] += len(envelope.content or b'')
+            if self.first_at is None:
+                self.first_at = now
+            self.last_at = now
+        return '250 Message accepted'
+
+
+class SmtpSink:
+    """SMTP sink served by a thread of the current process.
+
+    Arguments:
+        host {str} -- Address listened on.
+        port {int} -- Port listened on.
+
+    Keyword Arguments:
+        See SinkHandler.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, **handler_options):
+        if Controller is None:
+            raise ImportError("The SMTP sink needs the aiosmtpd package. "
+                              "Run 'pip install aiosmtpd'.")
+        self.handler = SinkHandler(**handler_options)
+        self.controller = Controller(self.handler, hostname=host, port=port)
+
+    @property
+    def host(self):
+        return self.controller.hostname
+
+    @property
+    def port(self):
+        return self.controller.port
+
+    def start(self):
+        # aiosmtpd logs every command at INFO level, which costs more than the mail.
+        logging.getLogger('mail.log').setLevel(logging.WARNING)
+        self.controller.start()
+        logger.info("SMTP sink listening on %s:%d" % (self.host, self.port))
+        return self
+
+    def stop(self):
+        self.controller.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def get_stats(self):
+        return self.handler.get_stats()
@@ -0,0 +1,196 @@
+import smtplib
+from datetime import timedelta
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from apps.Core import context
+from apps.Mail import digest, outbox
+from apps.Mail.models import NotificationEvent, OutboxMessage
+from apps.Organization.models import Org
+from apps.Users.models import AssetUser
+
+# (org, actor) seen by render_with_context() on each call.
+rendered_in = []
+
+
+def render_with_context(mail_context):
+    org = context.get_current_org()
+    rendered_in.append((org.pk if org is not None else None,
+                        context.get_current_actor()))
+    return 'Subject', 'Body', None
+
+
+def render_plain(mail_context):
+    if 'missing' in mail_context:
+        raise KeyError(mail_context['missing'])
+    if 'unreadable' in mail_context:
+        raise FileNotFoundError(mail_context['unreadable'])
+    return 'Subject', 'Body', None
+
+
+# Results of the worker run while the mails of another worker are being sent.
+other_worker_results = []
+
+
+def render_and_run_other_worker(mail_context):
+    other_worker_results.append(outbox.process_batch())
+    return 'Subject', 'Body', None
+
+
+class FailingBackend(BaseEmailBackend):
+    """Mail backend refusing every mail with the error passed."""
+
+    def __init__(self, error, **kwargs):
+        super().__init__(**kwargs)
+        self.error = error
+
+    def send_messages(self, email_messages):
+        raise self.error
+
+
+class MailRequestContextTests(TestCase):
+    """The worker renders the mails with the Org and user of the request which queued
+    them bound.
+    """
+
+    def setUp(self):
+        rendered_in.clear()
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def test_queued_mail_is_rendered_in_the_request_context(self):
+        with context.bind(request=self.request, org=self.org):
+            outbox.enqueue(render_with_context, {}, ['bob@abc.com'])
+        self.assertIsNone(context.get_current_org())
+
+        result = outbox.process_batch()
+        self.assertEqual(result['sent'], 1)
+        self.assertEqual(rendered_in, [(self.org.pk, 'alice@abc.com')])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_digest_is_rendered_in_the_request_context(self):
+        with context.bind(request=self.request, org=self.org, actor='carol@abc.com'):
+            digest.notify(render_with_context, 'assigned', ['bob@abc.com'], {},
+                          org_id=self.org.pk)
+        NotificationEvent.objects.update(send_after=timezone.now())
+
+        self.assertEqual(digest.flush_due(), 1)
+        outbox.process_batch()
+        self.assertEqual(rendered_in, [(self.org.pk, 'carol@abc.com')])
+
+    def test_mail_queued_outside_of_a_request_has_no_context(self):
+        outbox.enqueue(render_with_context, {}, ['bob@abc.com'])
+        outbox.process_batch()
+        self.assertEqual(rendered_in, [(None, None)])
+
+
+class OutboxWorkerTests(TestCase):
+    """Retries, dead-lettering and claims of the mails sent by the worker."""
+
+    def setUp(self):
+        other_worker_results.clear()
+
+    def make_due(self):
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+
+    def test_temporary_failure_is_retried_then_dead_lettered(self):
+        message = outbox.enqueue(render_plain, {}, ['bob@abc.com'])
+        refused = smtplib.SMTPRecipientsRefused({'bob@abc.com': (450, b'Try later')})
+
+        with override_settings(MAIL_OUTBOX_MAX_ATTEMPTS=2):
+            result = outbox.process_batch(connection=FailingBackend(refused))
+            self.assertEqual((result['retried'], result['dead']), (1, 0))
+            message.refresh_from_db()
+            self.assertEqual(message.attempts, 1)
+            self.assertIsNone(message.dead_at)
+            self.assertGreater(message.next_attempt_at, timezone.now())
+            self.assertEqual(message.claim_token, '')
+            self.assertIn('SMTPRecipientsRefused', message.last_error)
+            # Not due yet.
+            self.assertEqual(outbox.process_batch()['rows'], 0)
+
+            self.make_due()
+            result = outbox.process_batch(connection=FailingBackend(refused))
+            self.assertEqual((result['retried'], result['dead']), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.attempts, 2)
+        self.assertIsNotNone(message.dead_at)
+
+        # Dead-lettered mails are not picked up any more.
+        self.make_due()
+        self.assertEqual(outbox.process_batch()['rows'], 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_permanent_failures_are_dead_lettered_at_once(self):
+        outbox.enqueue(render_plain, {}, ['bob@abc.com'])
+        outbox.enqueue(render_plain, {'missing': 'device_name'}, ['bob@abc.com'])
+        refused = smtplib.SMTPRecipientsRefused({'bob@abc.com': (550, b'No such user')})
+
+        result = outbox.process_batch(connection=FailingBackend(refused))
+        self.assertEqual((result['rows'], result['dead']), (2, 2))
+        self.assertEqual(list(OutboxMessage.objects.values_list('attempts', flat=True)),
+                         [1, 1])
+
+    def test_render_failure_is_retried(self):
+        message = outbox.enqueue(render_plain, {'unreadable': 'mail/styles.css'},
+                                 ['bob@abc.com'])
+        result = outbox.process_batch()
+        self.assertEqual(result['retried'], 1)
+        message.refresh_from_db()
+        self.assertIsNone(message.dead_at)
+        self.assertIn('FileNotFoundError', message.last_error)
+
+    def test_connection_failure_does_not_charge_an_attempt(self):
+        outbox.enqueue(render_plain, {}, ['bob@abc.com'])
+        outbox.enqueue(render_plain, {}, ['carol@abc.com'])
+        failing = FailingBackend(smtplib.SMTPServerDisconnected('Connection lost'))
+
+        with self.assertRaises(smtplib.SMTPServerDisconnected):
+            outbox.process_batch(connection=failing)
+        for message in OutboxMessage.objects.all():
+            self.assertEqual(message.attempts, 0)
+            self.assertEqual(message.claim_token, '')
+            self.assertLessEqual(message.next_attempt_at, timezone.now())
+
+        self.assertEqual(outbox.process_batch()['sent'], 2)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_claimed_mails_are_skipped_by_the_other_workers(self):
+        outbox.enqueue(render_and_run_other_worker, {}, ['bob@abc.com'])
+        outbox.enqueue(render_plain, {}, ['carol@abc.com'])
+
+        result = outbox.process_batch()
+        self.assertEqual(result['sent'], 2)
+        # The other worker found both mails claimed while the first was being sent.
+        self.assertEqual([result['rows'] for result in other_worker_results], [0])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_expired_claim_is_taken_over(self):
+        message = outbox.enqueue(render_plain, {}, ['bob@abc.com'])
+        claimed = outbox._claim(10, 'default')
+        self.assertEqual([row.pk for row in claimed], [message.pk])
+        self.assertEqual(outbox._claim(10, 'default'), [])
+
+        # The first worker is gone. Once its claim expires the mail is sent by another.
+        OutboxMessage.objects.update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.process_batch()['sent'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        # The outcome of the first worker is not recorded on the row of the new claim.
+        message = outbox.enqueue(render_plain, {}, ['bob@abc.com'])
+        stale = outbox._claim(10, 'default')[0]
+        OutboxMessage.objects.update(
+            next_attempt_at=timezone.now() - timedelta(seconds=1))
+        current = outbox._claim(10, 'default')[0]
+        outbox._record_failure(stale, OSError('Timed out'), False, timezone.now())
+        current.refresh_from_db()
+        self.assertEqual(current.attempts, 0)
+        self.assertNotEqual(current.claim_token, '')
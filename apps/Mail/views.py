@@ -0,0 +1,19 @@
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from .digest import digest_stats
+from .outbox import queue_stats
+
+
+@staff_member_required
+def mail_outbox_status(request):
+    """Depth and lag of the mail outbox and of the notification digests. Used for
+    monitoring.
+    """
+    stats = queue_stats()
+    stats['digests'] = digest_stats()
+    the_data = json.dumps(stats, cls=DjangoJSONEncoder)
+    return HttpResponse(the_data, content_type='application/json')
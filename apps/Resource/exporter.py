@@ -0,0 +1,286 @@
+"""Export of the Resources of an Org as CSV, NDJSON or XLSX.
+
+The Resources are read with iterator(chunk_size=..) so that only one chunk is held in
+memory at a time irrespective of the size of the Org. Users are fetched along with the
+Resources using select_related and the team names of all the users of the Org are
+fetched once up front, so the cost is a fixed number of queries per chunk instead of
+per Resource (like org_context.html does).
+
+Optional columns:
+    history     -- When, by whom and what was changed in the latest history entry.
+    status_age  -- When the status was last changed and the number of days since then.
+                   The time of the creation entry if it never was.
+
+CSV and NDJSON are written as they are read. XLSX needs the XlsxWriter package and is
+written to a temporary file in its constant memory mode before being sent.
+
+Values starting with a formula character are exported as text: prefixed with a quote in
+CSV and written as string cells in XLSX, so that a spreadsheet opening the file does not
+run the names or descriptions entered by the users as formulas.
+"""
+
+import csv
+from itertools import islice
+import json
+import tempfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.ChangeHistory.backends import get_history_backend, TableHistoryBackend
+from apps.ChangeHistory.models import HistoryEntry, FieldChange
+from apps.Organization.models import Team
+from .models import Resource
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+FORMAT_XLSX = 'xlsx'
+FORMATS = [FORMAT_CSV, FORMAT_NDJSON, FORMAT_XLSX]
+
+CONTENT_TYPES = {
+    FORMAT_CSV: 'text/csv',
+    FORMAT_NDJSON: 'application/x-ndjson',
+    FORMAT_XLSX: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Number of Resources fetched from the DB per query.
+DEFAULT_CHUNK_SIZE = 2000
+
+COLUMNS = ['id', 'name', 'serial_num', 'status', 'current_user', 'current_user_name',
+           'previous_user', 'device_admin', 'teams', 'description']
+OPTIONAL_COLUMNS = {
+    'history': ['last_changed_at', 'last_changed_by', 'last_change'],
+    'status_age': ['status_since', 'status_age_days'],
+}
+
+# Leading characters making a spreadsheet read a cell as a formula.
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def get_columns(include=()):
+    """Returns the names of the columns exported along with the optional ones passed."""
+    columns = list(COLUMNS)
+    for name in include:
+        columns.extend(OPTIONAL_COLUMNS[name])
+    return columns
+
+
+def _team_names_by_user(org):
+    """Returns user id -> comma separated names of the teams of the user. One query."""
+    team_names = {}
+    for user_id, team_name in Team.objects.filter(org=org, team_members__isnull=False) \
+            .order_by('team_name').values_list('team_members', 'team_name'):
+        team_names.setdefault(user_id, []).append(team_name)
+    return {user_id: ', '.join(names) for user_id, names in team_names.items()}
+
+
+def _describe_change(entry):
+    """Returns a one line summary of a (resolved) history entry."""
+    return '; '.join("%s: %s -> %s" % (change.get('field'), change.get('prev'),
+                                       change.get('cur'))
+                     for change in entry.get('what', []))
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _HistoryColumns:
+    """Computes the optional history based columns of a chunk of Resources."""
+
+    def __init__(self, org, include):
+        self.org = org
+        self.include = include
+        self.use_table = isinstance(get_history_backend(Resource.history__backend),
+                                    TableHistoryBackend)
+        self.now = timezone.now()
+
+    def extra_fields(self):
+        """Returns the fields of the Resource to be loaded in addition."""
+        if self.include and not self.use_table:
+            # History is stored in the row itself.
+            return ['history']
+        return []
+
+    def annotate(self, queryset):
+        """Adds the annotations needed to the queryset of Resources."""
+        if not self.include or not self.use_table:
+            return queryset
+
+        label = Resource._meta.label_lower
+        if 'history' in self.include:
+            latest = HistoryEntry.objects.filter(model=label, object_id=OuterRef('pk')) \
+                .order_by('-when', '-id').values('id')[:1]
+            queryset = queryset.annotate(latest_entry_id=Subquery(latest))
+        if 'status_age' in self.include:
+            status_changes = FieldChange.objects.filter(
+                scope=self.org.pk, model=label, object_id=OuterRef('pk'), field='status')
+            # Resources created by the form have no FieldChange for their initial status,
+            # their creation entry has no 'what'.
+            created = HistoryEntry.objects.filter(model=label, object_id=OuterRef('pk')) \
+                .order_by('when', 'id').values('when')[:1]
+            queryset = queryset.annotate(status_since=Coalesce(
+                Subquery(status_changes.order_by('-when', '-id').values('when')[:1]),
+                Subquery(created)))
+        return queryset
+
+    def _latest_entries(self, resources):
+        """Returns pk -> latest history entry of the Resources passed."""
+        if self.use_table:
+            entry_ids = [res.latest_entry_id for res in resources
+                         if res.latest_entry_id is not None]
+            rows = HistoryEntry.objects.in_bulk(entry_ids)
+            return {res.pk: rows[res.latest_entry_id].as_entry() for res in resources
+                    if res.latest_entry_id in rows}
+        return {res.pk: res.history[0] for res in resources if res.history}
+
+    def _status_since(self, res):
+        if self.use_table:
+            return res.status_since
+        if not res.history:
+            return None
+        for entry in res.history:
+            if any(change.get('field') == 'status' for change in entry.get('what', [])):
+                return parse_datetime(entry['when'])
+        # Status unchanged since the creation entry (newest first, hence the last one).
+        return parse_datetime(res.history[-1]['when'])
+
+    def values(self, resources):
+        """Returns pk -> dict of the optional column values of the Resources passed."""
+        values_by_pk = {res.pk: {} for res in resources}
+        if 'history' in self.include:
+            latest = self._latest_entries(resources)
+            pks = list(latest)
+            # FK ids to names for the whole chunk at once.
+            resolved = Resource.resolve_history([latest[pk] for pk in pks])
+            for pk, entry in zip(pks, resolved):
+                values_by_pk[pk].update({
+                    'last_changed_at': latest[pk]['when'],
+                    'last_changed_by': entry.get('who', ''),
+                    'last_change': _describe_change(entry),
+                })
+        if 'status_age' in self.include:
+            for res in resources:
+                since = self._status_since(res)
+                values_by_pk[res.pk].update({
+                    'status_since': since.isoformat() if since is not None else None,
+                    'status_age_days': (self.now - since).days if since is not None
+                    else None,
+                })
+        return values_by_pk
+
+
+def iter_resource_rows(org, include=(), chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields one dict per Resource of the org keyed on the column names returned by
+    get_columns(include).
+
+    Arguments:
+        org {Org} -- Org whose Resources are exported.
+
+    Keyword Arguments:
+        include {iterable} -- Keys of OPTIONAL_COLUMNS to be added.
+        chunk_size {int} -- Number of Resources fetched per query.
+    """
+    team_names = _team_names_by_user(org)
+    history_columns = _HistoryColumns(org, include)
+
+    # Only the columns exported are loaded. Full user rows cost more to build than the
+    # Resource itself.
+    queryset = Resource.objects.filter(org=org) \
+        .select_related('current_user', 'previous_user', 'device_admin') \
+        .only('name', 'serial_num', 'status', 'description', 'current_user__email',
+              'current_user__name', 'previous_user__email', 'device_admin__email',
+              *history_columns.extra_fields()) \
+        .order_by('pk')
+    queryset = history_columns.annotate(queryset)
+
+    for resources in _chunks(queryset.iterator(chunk_size=chunk_size), chunk_size):
+        optional_values = history_columns.values(resources)
+        for res in resources:
+            row = {
+                'id': res.pk,
+                'name': res.name,
+                'serial_num': res.serial_num,
+                'status': res.status,
+                'current_user': res.current_user.email,
+                'current_user_name': res.current_user.name,
+                'previous_user': res.previous_user.email if res.previous_user else None,
+                'device_admin': res.device_admin.email,
+                'teams': team_names.get(res.current_user_id, ''),
+                'description': res.description,
+            }
+            row.update(optional_values[res.pk])
+            yield row
+
+
+class _EchoBuffer:
+    """File like object whose write() returns what was written. Lets csv.writer produce
+    the lines one at a time for a StreamingHttpResponse.
+    """
+
+    def write(self, value):
+        return value
+
+
+def _escape_formula(value):
+    """Returns the value prefixed with a quote if a spreadsheet would read it as a
+    formula.
+    """
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(rows, columns):
+    """Yields the lines of the CSV file, header first."""
+    writer = csv.writer(_EchoBuffer())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow([_escape_formula(row.get(column)) for column in columns])
+
+
+def iter_ndjson(rows, columns):
+    """Yields one JSON object per line."""
+    for row in rows:
+        yield json.dumps({column: row.get(column) for column in columns},
+                         cls=DjangoJSONEncoder) + '\n'
+
+
+def write_xlsx(rows, columns):
+    """Writes the rows into a temporary XLSX file and returns it, positioned at the
+    start. Requires XlsxWriter. The caller should close the file.
+    """
+    if xlsxwriter is None:
+        raise RuntimeError("The XlsxWriter package is required to export to XLSX.")
+    output = tempfile.TemporaryFile()
+    # constant_memory flushes every row to disk once the next row is written.
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Resources')
+    worksheet.write_row(0, 0, columns)
+    for row_num, row in enumerate(rows, start=1):
+        for col_num, column in enumerate(columns):
+            value = row.get(column)
+            # write() would store the strings starting with '=' as formulas.
+            if isinstance(value, str):
+                worksheet.write_string(row_num, col_num, value)
+            else:
+                worksheet.write(row_num, col_num, value)
+    workbook.close()
+    output.seek(0)
+    return output
@@ -1,8 +1,11 @@
 from django import forms
 from .models import Resource
-from apps.Organization.models import Org
+from . import importer
+from apps.Organization.models import Org, Team
 from django.contrib.auth import get_user_model
 from django_select2.forms import Select2Widget
+from haystack import connections
+from haystack.forms import SearchForm
 
 # Get the current custom User Model.
 User = get_user_model()
@@ -102,3 +105,135 @@ class ResourceUpdateForm(forms.ModelForm):
         exclude = ['org', 'history', 'previous_user', 'status']
         # Org has to be set by the view to the user's current Org.
         # status will also be set to RES_ASSIGNED in the view.
+
+
+class AuditLogFilterForm(forms.Form):
+    """Form holding the filters of the org wide audit log. All the filters are optional
+    and are passed as GET parameters so that the filtered pages can be bookmarked.
+    """
+
+    # Fields of a Resource whose changes are recorded. 'previous_user' is left out as it
+    # always changes along with 'current_user'.
+    FIELD_CHOICES = [('', 'Any field')] + [
+        (name, name.capitalize().replace('_', ' '))
+        for name in Resource.history__tracked_fields if name != 'previous_user'
+    ]
+
+    who = forms.EmailField(required=False, label='Changed by')
+    field = forms.ChoiceField(choices=FIELD_CHOICES, required=False)
+    value = forms.CharField(required=False, max_length=255, label='Changed to',
+                            help_text="Email id of the user in case of user fields.")
+    resource = forms.IntegerField(required=False, min_value=1, widget=forms.HiddenInput)
+    since = forms.DateTimeField(required=False)
+    until = forms.DateTimeField(required=False)
+    cursor = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    def __init__(self, *args, in_org, **kwargs):
+        """Accepts the keyword arg 'in_org' to look up the users of the org.
+
+        Arguments:
+            in_org {apps.Organization.models.Org} -- Org whose audit log is shown.
+        """
+        super(AuditLogFilterForm, self).__init__(*args, **kwargs)
+        self.org = in_org
+
+    def clean(self):
+        cleaned_data = super(AuditLogFilterForm, self).clean()
+        field_name = cleaned_data.get('field')
+        value = cleaned_data.get('value')
+        if field_name and value:
+            # ForeignKeys are recorded as ids. Convert the email id entered to the id.
+            model_field = Resource._meta.get_field(field_name)
+            if model_field.many_to_one and model_field.related_model == User:
+                user = self.org.user_set.filter(email__iexact=value).only('pk').first()
+                if user is None:
+                    self.add_error('value', "No user with this email id in the org.")
+                else:
+                    cleaned_data['value'] = str(user.pk)
+        return cleaned_data
+
+
+class ResourceImportForm(forms.Form):
+    """Form to upload a CSV / NDJSON file of Resources to be imported into the org."""
+
+    file = forms.FileField(help_text="Columns: name, serial_num, current_user, "
+                                     "device_admin and optionally description, status. "
+                                     "Users are identified by their email ids.")
+    format = forms.ChoiceField(choices=[('', 'Guess from the file name')] +
+                               importer.FORMAT_CHOICES, required=False)
+
+    def clean(self):
+        cleaned_data = super(ResourceImportForm, self).clean()
+        uploaded = cleaned_data.get('file')
+        if uploaded is not None and not cleaned_data.get('format'):
+            file_format = importer.guess_format(uploaded.name)
+            if file_format is None:
+                self.add_error('format', "Could not guess the format from the file name. "
+                                         "Choose one.")
+            cleaned_data['format'] = file_format
+        return cleaned_data
+
+
+class ResourceSearchForm(SearchForm):
+    """SearchForm of the search page. Along with the text entered, the results can be
+    filtered on the fields of the search index listed in FILTER_FIELDS. Values of a
+    field are ORed and the fields are ANDed. Either the text or a filter is required.
+    """
+
+    # Fields of the search index (see search_indexes.py) which are filtered and faceted.
+    FILTER_FIELDS = ['status', 'device_admin_id', 'current_user_id', 'team_ids']
+
+    status = forms.MultipleChoiceField(choices=Resource.RES_STATUS_CHOICES,
+                                       required=False)
+    device_admin_id = forms.ModelMultipleChoiceField(queryset=User.objects.none(),
+                                                     required=False)
+    current_user_id = forms.ModelMultipleChoiceField(queryset=User.objects.none(),
+                                                     required=False)
+    team_ids = forms.ModelMultipleChoiceField(queryset=Team.objects.none(),
+                                              required=False)
+
+    def __init__(self, *args, org=None, **kwargs):
+        """Restricts the users and teams which can be filtered on to those of the org.
+
+        Keyword Arguments:
+            org {apps.Organization.models.Org} -- Org searched. (default: {None})
+        """
+        super(ResourceSearchForm, self).__init__(*args, **kwargs)
+        if org is not None:
+            self.fields['device_admin_id'].queryset = org.user_set.all()
+            self.fields['current_user_id'].queryset = org.user_set.all()
+            self.fields['team_ids'].queryset = org.team_set.all()
+
+    def get_filters(self):
+        """Returns the filters selected.
+
+        Returns:
+            dict -- {field name: [values]} in the order of FILTER_FIELDS. Users and teams
+                    are given by their ids.
+        """
+        filters = {}
+        for name in self.FILTER_FIELDS:
+            values = self.cleaned_data.get(name)
+            if values:
+                filters[name] = sorted(getattr(value, 'pk', value) for value in values)
+        return filters
+
+    def search(self):
+        if not self.is_valid():
+            return self.no_query_found()
+        query = self.cleaned_data.get('q')
+        filters = self.get_filters()
+        if not query and not filters:
+            return self.no_query_found()
+
+        sqs = self.searchqueryset
+        if query:
+            sqs = sqs.auto_query(query)
+        # The filters are applied on the exact '<name>_exact' fields.
+        unified_index = connections[sqs.query._using].get_unified_index()
+        for name, values in filters.items():
+            sqs = sqs.filter(**{'%s__in' % (unified_index.get_facet_fieldname(name),):
+                                values})
+        if self.load_all:
+            sqs = sqs.load_all()
+        return sqs
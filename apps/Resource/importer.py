@@ -0,0 +1,281 @@
+"""Import of Resources into an Org from a CSV or NDJSON file.
+
+Used by the 'import_resources' management command and the upload view. The file is
+read as a stream, one row at a time, so the memory used does not depend on its size.
+
+Every row should have the columns (keys in case of NDJSON)
+    name, serial_num, current_user, device_admin
+and optionally
+    description, status
+where current_user and device_admin are the email ids of users of the Org and status
+is one of Resource.RES_STATUS_CHOICES ('Assigned' when empty).
+
+Unlike ResourceCreateView which saves (and indexes) one Resource per request, the rows
+are validated against an email -> id map of the Org users built with one query, written
+with bulk_create in chunks (one INSERT per row on SQLite, which does not return the pks
+of a bulk insert) along with their initial history entries, and the search
+index is updated once all the rows have been written. A row which fails validation is
+reported with its line number and skipped, the rest of the file is still imported.
+"""
+
+import csv
+import io
+import json
+
+from django.db import connections, transaction
+from django.db.models import AutoField
+
+from apps.ChangeHistory.backends import get_history_backend
+from apps.Search.autocomplete import invalidate_orgs
+from .models import Resource, update_search_index
+
+import logging
+logger = logging.getLogger(__name__)
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+FORMAT_CHOICES = [
+    (FORMAT_CSV, 'CSV'),
+    (FORMAT_NDJSON, 'NDJSON (one JSON object per line)'),
+]
+
+# File extensions used to guess the format.
+_EXTENSION_FORMATS = {
+    '.csv': FORMAT_CSV,
+    '.ndjson': FORMAT_NDJSON,
+    '.jsonl': FORMAT_NDJSON,
+}
+
+# Number of rows written per bulk_create.
+DEFAULT_CHUNK_SIZE = 1000
+
+# Number of Resources sent to the search backend per update.
+INDEX_BATCH_SIZE = 500
+
+REQUIRED_COLUMNS = ['name', 'serial_num', 'current_user', 'device_admin']
+OPTIONAL_COLUMNS = ['description', 'status']
+
+
+class ImportResult:
+    """Outcome of import_resources().
+
+    Attributes:
+        created_count {int} -- Number of Resources created.
+        errors {list} -- (line number, message) of every row which was skipped.
+        row_count {int} -- Number of rows read.
+    """
+
+    def __init__(self):
+        self.created_count = 0
+        self.errors = []
+        self.row_count = 0
+
+    @property
+    def error_count(self):
+        return len(self.errors)
+
+
+def guess_format(filename):
+    """Returns the format of the file based on its extension or None when unknown."""
+    filename = (filename or '').lower()
+    for extension, file_format in _EXTENSION_FORMATS.items():
+        if filename.endswith(extension):
+            return file_format
+    return None
+
+
+def _iter_rows(text_stream, file_format):
+    """Yields (line number, row dict or None, error message) for every row of the file.
+    """
+    if file_format == FORMAT_CSV:
+        reader = csv.DictReader(text_stream)
+        missing = [name for name in REQUIRED_COLUMNS if name not in (reader.fieldnames or [])]
+        if missing:
+            yield 1, None, "Missing columns: %s" % (', '.join(missing),)
+            return
+        for row in reader:
+            yield reader.line_num, row, None
+    elif file_format == FORMAT_NDJSON:
+        for line_num, line in enumerate(text_stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_num, None, "Invalid JSON: %s" % (e,)
+                continue
+            if not isinstance(row, dict):
+                yield line_num, None, "Expected a JSON object."
+                continue
+            yield line_num, row, None
+    else:
+        raise ValueError("Unknown import format: %s" % (file_format,))
+
+
+class _RowValidator:
+    """Converts the rows read into unsaved Resources of the org."""
+
+    def __init__(self, org):
+        self.org = org
+        # Only users of the Org can be assigned. One query for the whole import.
+        self.user_ids = {email.lower(): pk for email, pk in
+                         org.user_set.values_list('email', 'pk')}
+        self.statuses = {status for status, _ in Resource.RES_STATUS_CHOICES}
+        self.max_lengths = {name: Resource._meta.get_field(name).max_length
+                            for name in ('name', 'serial_num')}
+
+    def _user_id(self, row, column, errors):
+        email = str(row.get(column) or '').strip().lower()
+        if not email:
+            errors.append("%s is required." % (column,))
+            return None
+        user_id = self.user_ids.get(email)
+        if user_id is None:
+            errors.append("%s '%s' is not a user of %s." % (column, email,
+                                                            self.org.get_name()))
+        return user_id
+
+    def to_resource(self, row):
+        """Returns (Resource, None) for a valid row and (None, error message) otherwise.
+        """
+        errors = []
+        values = {}
+        for column, max_length in self.max_lengths.items():
+            value = str(row.get(column) or '').strip()
+            if not value:
+                errors.append("%s is required." % (column,))
+            elif len(value) > max_length:
+                errors.append("%s is longer than %d characters." % (column, max_length))
+            values[column] = value
+        current_user_id = self._user_id(row, 'current_user', errors)
+        device_admin_id = self._user_id(row, 'device_admin', errors)
+        status = str(row.get('status') or '').strip() or Resource.RES_ASSIGNED
+        if status not in self.statuses:
+            errors.append("Invalid status '%s'." % (status,))
+        if errors:
+            return None, ' '.join(errors)
+
+        resource = Resource(name=values['name'], serial_num=values['serial_num'],
+                            current_user_id=current_user_id,
+                            device_admin_id=device_admin_id,
+                            description=str(row.get('description') or ''), status=status,
+                            org=self.org)
+        return resource, None
+
+
+def _initial_changes(resource):
+    """Returns the diff recorded in the first history entry of a created Resource."""
+    changes = []
+    for field in Resource._history_tracked_fields():
+        value = getattr(resource, field.attname)
+        if value is not None and value != '':
+            changes.append({"field": field.name, "prev": None, "cur": value})
+    return changes
+
+
+def _write_chunk(resources, org):
+    """Creates the Resources along with their history entries in one transaction.
+
+    Returns:
+        list -- pks of the created Resources.
+    """
+    backend = get_history_backend(Resource.history__backend)
+    using = Resource.objects.db
+    with transaction.atomic(using=using):
+        # One 'who'/'when' for the whole chunk.
+        template = Resource._history_make_entry([])
+        entries = []
+        for resource in resources:
+            entry = dict(template, what=_initial_changes(resource))
+            backend.before_save(resource, entry)
+            entries.append(entry)
+
+        if connections[using].features.can_return_ids_from_bulk_insert:
+            Resource.objects.bulk_create(resources)
+        else:
+            # The pks are not returned by a multi-row INSERT on these DBs (SQLite). One
+            # INSERT per row instead, which returns the pk of its row like save() does.
+            # Cheap on SQLite as all of them are in the same transaction.
+            fields = [field for field in Resource._meta.concrete_fields
+                      if not isinstance(field, AutoField)]
+            for resource in resources:
+                resource.pk = Resource._base_manager.using(using)._insert(
+                    [resource], fields=fields, return_id=True, using=using)
+                resource._state.adding = False
+                resource._state.db = using
+        pks = [resource.pk for resource in resources]
+
+        backend.bulk_after_save(Resource, dict(zip(pks, entries)),
+                                scope_by_pk={pk: org.pk for pk in pks})
+    return pks
+
+
+def import_resources(stream, org, file_format, chunk_size=DEFAULT_CHUNK_SIZE,
+                     reindex=True):
+    """Imports the Resources in the file into the org. See the module docstring for the
+    expected columns. The history entries are recorded as made by the current actor
+    (see apps/Core/context.py).
+
+    Arguments:
+        stream {file} -- Binary file object of the CSV / NDJSON file.
+        org {Org} -- Org in which the Resources are created.
+        file_format {str} -- FORMAT_CSV or FORMAT_NDJSON.
+
+    Keyword Arguments:
+        chunk_size {int} -- Number of Resources written per bulk_create.
+        reindex {bool} -- Update the search index once all the rows are written.
+
+    Returns:
+        ImportResult -- Number of Resources created and the errors of skipped rows.
+    """
+    result = ImportResult()
+    validator = _RowValidator(org)
+    created_pks = []
+    pending = []
+    pending_lines = []
+
+    def flush():
+        try:
+            created_pks.extend(_write_chunk(pending, org))
+            result.created_count += len(pending)
+        except Exception as e:
+            logger.exception("Could not import rows at lines %d-%d" %
+                             (pending_lines[0], pending_lines[-1]))
+            result.errors.extend((line_num, "Not imported: %s" % (e,))
+                                 for line_num in pending_lines)
+        pending.clear()
+        pending_lines.clear()
+
+    # utf-8-sig drops the BOM added by spreadsheet apps.
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        for line_num, row, error in _iter_rows(text_stream, file_format):
+            result.row_count += 1
+            if error is None:
+                resource, error = validator.to_resource(row)
+            if error is not None:
+                result.errors.append((line_num, error))
+                continue
+            pending.append(resource)
+            pending_lines.append(line_num)
+            if len(pending) >= chunk_size:
+                flush()
+    except UnicodeDecodeError as e:
+        # Rows read before the error are still imported.
+        result.errors.append((result.row_count + 1, "File is not UTF-8 encoded: %s" % (e,)))
+    finally:
+        # Leave the stream open for the caller.
+        text_stream.detach()
+    if pending:
+        flush()
+
+    if created_pks:
+        # bulk_create does not send post_save.
+        invalidate_orgs([org.pk])
+    if reindex and created_pks:
+        for i in range(0, len(created_pks), INDEX_BATCH_SIZE):
+            update_search_index(created_pks[i:i + INDEX_BATCH_SIZE])
+
+    logger.info("Imported %d resources into %s. Rows:%d errors:%d" % (
+        result.created_count, org.get_name(), result.row_count, result.error_count))
+    return result
@@ -0,0 +1,88 @@
+"""Management command comparing a history-aware bulk update of Resources against the
+save() loop it replaces.
+
+Creates an Org, two users and the requested number of Resources, reassigns the device
+admin of all of them first with a save() loop and then with tracked_update(), and
+reports the time taken and the number of queries of each. Everything runs in a
+transaction which is rolled back at the end, so the DB is left untouched.
+
+Search indexing is switched off while benchmarking so that only the DB work is
+compared and the search index never sees the temporary Resources.
+
+Usage:
+    python manage.py benchmark_bulk_update --count 10000
+"""
+
+import time
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from apps.Organization.models import Org
+from apps.Resource.models import Resource
+
+
+class _Rollback(Exception):
+    pass
+
+
+class QueryCounter:
+    """Execute wrapper counting the queries run on the connection."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks Resource tracked_update() against a save() loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=10000,
+                            help="Number of Resources updated.")
+
+    def handle(self, *args, **options):
+        signal_processor = apps.get_app_config('haystack').signal_processor
+        signal_processor.teardown()
+        try:
+            with transaction.atomic():
+                self.run_benchmark(options['count'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            signal_processor.setup()
+
+    def run_benchmark(self, count):
+        User = get_user_model()
+        admin_1 = User.objects.create_user('bench-admin-1@trackzilla.in', 'bench', name='Admin 1')
+        admin_2 = User.objects.create_user('bench-admin-2@trackzilla.in', 'bench', name='Admin 2')
+        org = Org.objects.create(org_name='Benchmark Org', admin=admin_1)
+        Resource.objects.bulk_create([
+            Resource(name='device %d' % i, serial_num='SN%d' % i, current_user=admin_1,
+                     device_admin=admin_1, description='benchmark', org=org)
+            for i in range(count)], batch_size=500)
+
+        self.stdout.write("Reassigning the device admin of %d resources" % (count,))
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            for res in Resource.objects.filter(org=org):
+                res.device_admin = admin_2
+                res.save()
+        self.report('save() loop', time.perf_counter() - start, counter.count)
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            Resource.objects.filter(org=org).tracked_update(device_admin=admin_1)
+        self.report('tracked_update()', time.perf_counter() - start, counter.count)
+
+    def report(self, label, elapsed, query_count):
+        self.stdout.write("%-18s %9.3f s %8d queries" % (label, elapsed, query_count))
@@ -0,0 +1,90 @@
+"""Management command comparing the render time of a mail from the compiled mail templates
+(see apps/Mail/compiled.py) against render_to_string() with {% inlinecss %} and
+strip_tags() it replaces.
+
+Renders the assignment mail, the dispute mail and a summary mail listing the given
+number of devices per list (synthetic, nothing is read from or written to the DB), and
+reports the average time per mail of each way and the speedup.
+
+Usage:
+    python manage.py benchmark_mail_render
+    python manage.py benchmark_mail_render --devices 20 --iterations 50
+"""
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from apps.Mail import compiled
+from apps.Resource.models import Resource
+
+User = get_user_model()
+
+
+def build_sample_mails(device_count):
+    """Returns (name, template name, context) of the benchmarked mails."""
+    link = "http://trackzilla.example.com/resource/1/"
+    event = {'cur_user': "user1@trackzilla.in", 'prev_user': "user2@trackzilla.in",
+             'device_admin': "admin@trackzilla.in", 'device_name': "Dell Latitude 5490",
+             'ack_link': link + "ack", 'decline_link': link + "deny", 'device_url': link}
+
+    user = User(pk=1, email="user1@trackzilla.in", name="User One")
+    previous_user = User(pk=2, email="user2@trackzilla.in")
+
+    def resources(first_pk):
+        return [Resource(pk=pk, name="Device %d" % (pk,), current_user=user,
+                         previous_user=previous_user)
+                for pk in range(first_pk, first_pk + device_count)]
+
+    current_site = Site(domain="trackzilla.example.com", name="Trackzilla")
+    summary = {'res_in_dispute': resources(1),
+               'res_needing_action': resources(1001),
+               'res_in_use': resources(2001),
+               'res_managed_in_dispute': resources(3001),
+               'current_site': current_site,
+               'domain_url': "http://%s" % (current_site.domain,),
+               'user': user}
+    return [('assigned', 'mail/assigned.html', event),
+            ('dispute', 'mail/dispute.html', event),
+            ('summary', 'mail/summary.html', summary)]
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the render time of the compiled mail templates."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=5,
+                            help="Number of devices per list of the summary mail.")
+        parser.add_argument('--iterations', type=int, default=20,
+                            help="Number of mails rendered per template and way.")
+
+    def handle(self, *args, **options):
+        if options['devices'] <= 0 or options['iterations'] <= 0:
+            raise CommandError("--devices and --iterations should be positive numbers.")
+        iterations = options['iterations']
+
+        self.stdout.write("%d iterations per mail, %d devices per summary list" %
+                          (iterations, options['devices']))
+        self.stdout.write("%-10s %14s %14s %9s" %
+                          ('mail', 'inlinecss(ms)', 'compiled(ms)', 'speedup'))
+        for name, template_name, context in build_sample_mails(options['devices']):
+            # Parsing and compiling are paid once per process, not per mail.
+            compiled.render_mail(template_name, context)
+            render_to_string(template_name, context)
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                strip_tags(render_to_string(template_name, context))
+            inlinecss_ms = (time.perf_counter() - start) * 1e3 / iterations
+
+            start = time.perf_counter()
+            for _ in range(iterations):
+                compiled.render_mail(template_name, context)
+            compiled_ms = (time.perf_counter() - start) * 1e3 / iterations
+
+            self.stdout.write("%-10s %14.2f %14.2f %8.0fx" % (
+                name, inlinecss_ms, compiled_ms, inlinecss_ms / compiled_ms))
@@ -0,0 +1,257 @@
+"""Management command measuring how many mails per second the mail paths send, against
+the local SMTP sink (see apps/Mail/smtp_sink.py) instead of a real mail server. Used to
+size the mail workers.
+
+Creates an Org, the requested number of users and devices per user (held by the user,
+previously by the next user, managed by one of the admins), and runs the scenarios:
+
+    - summary: the 'send_summary_mails' run over the users, rendered in this process:
+      the rate of a single worker process.
+    - reassign: every device reassigned to its user (one assignment notification per
+      device, as ResourceUpdateView does), the digests flushed and the outbox sent, as
+      'run_mail_worker' does.
+    - dispute: every user disputing all his devices at once (as the bulk status views
+      do), the digests of the user, the admins and the previous users flushed and sent.
+
+For each it reports the mails sent, retried later and dead-lettered, the reconnections
+to the mail server and the mails per second. The time of the reassign and dispute
+scenarios is the time of the mail worker: recording the notifications is not counted.
+Everything runs in a transaction which is rolled back at the end, so the DB is left
+untouched. Run it against a development DB: mails already due in the outbox or in the
+digests are sent to the sink along with the benchmarked ones (and stay queued).
+
+Usage:
+    python manage.py benchmark_mail_throughput
+    python manage.py benchmark_mail_throughput --users 1000 --latency 0.02
+    python manage.py benchmark_mail_throughput --scenario reassign --disconnect-rate 0.01
+    python manage.py benchmark_mail_throughput --external --port 8025  # run_smtp_sink
+"""
+
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from apps.Mail import compiled, digest, outbox, smtp_sink
+from apps.Mail.management.commands.run_smtp_sink import (
+    add_sink_arguments, get_sink_options,
+)
+from apps.Mail.models import NotificationEvent, OutboxMessage
+from apps.Organization.models import Org
+from apps.Resource import summary, transitions, views
+from apps.Resource.models import Resource
+
+SCENARIOS = ['summary', 'reassign', 'dispute']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _SiteRequest:
+    """Stands for the request of the views: builds the links on the current Site."""
+
+    def __init__(self, domain):
+        self.domain = domain
+
+    def build_absolute_uri(self, location):
+        return "http://%s%s" % (self.domain, location)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the mails sent per second against a local SMTP sink."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help="Scenario to run. Can be repeated. All by default.")
+        parser.add_argument('--users', type=int, default=200,
+                            help="Number of users created.")
+        parser.add_argument('--devices-per-user', type=int, default=5,
+                            help="Number of devices held by each user.")
+        parser.add_argument('--admins', type=int, default=10,
+                            help="Number of users managing the devices.")
+        parser.add_argument('--batch-size', type=int, default=outbox.DEFAULT_BATCH_SIZE,
+                            help="Number of mails sent per batch of the outbox.")
+        parser.add_argument('--host', default=smtp_sink.DEFAULT_HOST,
+                            help="Address of the SMTP sink.")
+        parser.add_argument('--port', type=int, default=smtp_sink.DEFAULT_PORT,
+                            help="Port of the SMTP sink.")
+        parser.add_argument('--external', action='store_true',
+                            help="Use the SMTP sink running on --host/--port (Eg: "
+                                 "'run_smtp_sink') instead of starting one. The "
+                                 "latency and failure options are then ignored.")
+        add_sink_arguments(parser)
+
+    def handle(self, *args, **options):
+        for name in ('users', 'devices_per_user', 'admins', 'batch_size'):
+            if options[name] <= 0:
+                raise CommandError("--%s should be a positive number." %
+                                   (name.replace('_', '-'),))
+        if options['admins'] > options['users']:
+            raise CommandError("--admins should not be more than --users.")
+        sink_options = get_sink_options(options)
+
+        sink = None
+        if not options['external']:
+            try:
+                sink = smtp_sink.SmtpSink(options['host'], options['port'],
+                                          **sink_options)
+            except ImportError as error:
+                raise CommandError(str(error))
+            sink.start()
+
+        signal_processor = apps.get_app_config('haystack').signal_processor
+        signal_processor.teardown()
+        try:
+            with transaction.atomic():
+                self.run_benchmark(options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            signal_processor.setup()
+            if sink is not None:
+                sink.stop()
+
+        if sink is not None:
+            self.stdout.write("SMTP sink accepted:%(accepted)d temp_failed:"
+                              "%(temp_failed)d perm_failed:%(perm_failed)d "
+                              "disconnected:%(disconnected)d" % sink.get_stats())
+
+    def run_benchmark(self, options):
+        self.options = options
+        self.connection = mail.get_connection(
+            'django.core.mail.backends.smtp.EmailBackend', host=options['host'],
+            port=options['port'], username='', password='', use_tls=False,
+            use_ssl=False)
+        self.request = _SiteRequest(Site.objects.get_current().domain)
+        # Compiled once per process. Not part of the time of a mail.
+        for template_name in compiled.find_mail_templates():
+            compiled.get_compiled(template_name)
+
+        self.create_data(options['users'], options['devices_per_user'],
+                         options['admins'])
+        self.stdout.write("%d users, %d devices per user" %
+                          (options['users'], options['devices_per_user']))
+        self.stdout.write("%-10s %8s %8s %8s %10s %10s %10s" % (
+            'scenario', 'mails', 'retried', 'dead', 'reconnects', 'seconds', 'mails/s'))
+        for scenario in options['scenario'] or SCENARIOS:
+            getattr(self, 'run_' + scenario)()
+
+    def create_data(self, user_count, devices_per_user, admin_count):
+        User = get_user_model()
+        # Users which cannot log in. Saves hashing a password per user.
+        first = User.objects.create(email='bench-user-0@trackzilla.in', name='User 0',
+                                    password='!')
+        User.objects.bulk_create([
+            User(email='bench-user-%d@trackzilla.in' % (i,), name='User %d' % (i,),
+                 password='!')
+            for i in range(1, user_count)], batch_size=500)
+        self.users = list(User.objects.filter(pk__gte=first.pk,
+                                              email__startswith='bench-user-')
+                          .order_by('pk'))
+        admins = self.users[:admin_count]
+        self.org = Org.objects.create(org_name='Benchmark Org', admin=admins[0])
+        User.objects.filter(pk__in=[user.pk for user in self.users]).update(org=self.org)
+
+        Resource.objects.bulk_create([
+            Resource(name='device %d-%d' % (i, j), serial_num='SN%d-%d' % (i, j),
+                     current_user=user,
+                     previous_user=self.users[(i + 1) % len(self.users)],
+                     device_admin=admins[i % len(admins)], status=Resource.RES_ASSIGNED,
+                     description='benchmark', org=self.org)
+            for i, user in enumerate(self.users) for j in range(devices_per_user)],
+            batch_size=500)
+
+    def run_summary(self):
+        checkpoint = summary.get_checkpoint('benchmark-summary', self.users[0].pk,
+                                            self.users[-1].pk, restart=True)
+        reconnects = 0
+        start = time.perf_counter()
+        while checkpoint.finished_at is None:
+            try:
+                # A single process: the worker processes of the command would need
+                # the DB connection closed, which ends the benchmark transaction.
+                for checkpoint in summary.send_summaries(checkpoint,
+                                                         connection=self.connection):
+                    pass
+            except Exception as error:
+                if not outbox.is_connection_error(error):
+                    raise
+                # Resumed after the last chunk sent, as the command does when run again.
+                reconnects += 1
+        self.report('summary', checkpoint.sent, checkpoint.queued, checkpoint.failed,
+                    reconnects, time.perf_counter() - start)
+
+    def run_reassign(self):
+        resources = Resource.objects.filter(org=self.org).select_related(
+            'current_user', 'previous_user').order_by('pk')
+        for res in resources:
+            views.sendAssignmentMail(
+                from_email=settings.EMAIL_FROM_ADDRESS, to_email=res.current_user.email,
+                cur_user=res.current_user.get_username(),
+                prev_user=res.previous_user.get_username(), device_name=res.name,
+                ack_link=self.request.build_absolute_uri(res.get_acknowledge_url()),
+                decline_link=self.request.build_absolute_uri(res.get_deny_url()),
+                org_id=self.org.pk)
+        self.send_notifications('reassign')
+
+    def run_dispute(self):
+        pks_by_user = {}
+        for pk, user_id in Resource.objects.filter(org=self.org).values_list(
+                'pk', 'current_user_id'):
+            pks_by_user.setdefault(user_id, []).append(pk)
+        for user in self.users:
+            result = transitions.bulk_change_status(pks_by_user.get(user.pk, []), user,
+                                                    Resource.RES_DISPUTE)
+            if result.changed:
+                views.sendBulkDisputeMail(settings.EMAIL_FROM_ADDRESS, result.changed,
+                                          user, self.request)
+        self.send_notifications('dispute')
+
+    def send_notifications(self, scenario):
+        """Sends the notifications recorded as the mail worker does, once their digest
+        window is over.
+        """
+        NotificationEvent.objects.filter(
+            recipient__in=[user.email for user in self.users]).update(
+                send_after=timezone.now())
+
+        # The outcome is read from the rows queued by the scenario, as process_batch()
+        # raises without returning its counts when the connection fails.
+        last_id = OutboxMessage.objects.order_by('-id').values_list(
+            'id', flat=True).first() or 0
+        queued = reconnects = 0
+        start = time.perf_counter()
+        while True:
+            try:
+                digests = digest.flush_due()
+                queued += digests
+                result = outbox.process_batch(self.options['batch_size'],
+                                              self.connection)
+            except Exception as error:
+                if not outbox.is_connection_error(error):
+                    raise
+                # The mails sent before the error are recorded. Same as run_mail_worker.
+                reconnects += 1
+                continue
+            if not result['rows'] and not digests:
+                break
+        elapsed = time.perf_counter() - start
+        self.connection.close()
+
+        not_sent = OutboxMessage.objects.filter(id__gt=last_id)
+        dead = not_sent.exclude(dead_at=None).count()
+        retried = not_sent.filter(dead_at=None).count()
+        self.report(scenario, queued - dead - retried, retried, dead, reconnects, elapsed)
+
+    def report(self, scenario, sent, retried, dead, reconnects, elapsed):
+        self.stdout.write("%-10s %8d %8d %8d %10d %10.2f %10.1f" % (
+            scenario, sent, retried, dead, reconnects, elapsed,
+            sent / elapsed if elapsed > 0 else 0.0))
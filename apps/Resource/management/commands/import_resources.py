@@ -0,0 +1,80 @@
+"""Management command which imports Resources into an Org from a CSV or NDJSON file.
+See apps/Resource/importer.py for the expected columns.
+
+Rows which cannot be imported are printed with their line numbers on stderr and do
+not stop the rest of the file from being imported.
+
+Usage:
+    python manage.py import_resources devices.csv --org 1 --actor admin@abc.com
+    python manage.py import_resources devices.ndjson --org 1 --chunk-size 2000
+    cat devices.csv | python manage.py import_resources - --org 1 --format csv
+"""
+
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.Core import context
+from apps.Organization.models import Org
+from apps.Resource import importer
+
+
+class Command(BaseCommand):
+    help = "Imports Resources into an Org from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import. '-' reads from stdin.")
+        parser.add_argument('--org', type=int, required=True,
+                            help="id of the Org in which the Resources are created.")
+        parser.add_argument('--format', choices=[value for value, _ in
+                                                 importer.FORMAT_CHOICES],
+                            help="Format of the file. Guessed from the extension when "
+                                 "not passed.")
+        parser.add_argument('--actor',
+                            help="Email id recorded as the creator in the history. "
+                                 "Defaults to the admin of the Org.")
+        parser.add_argument('--chunk-size', type=int, default=importer.DEFAULT_CHUNK_SIZE,
+                            help="Number of Resources written per batch.")
+        parser.add_argument('--no-reindex', action='store_true',
+                            help="Do not update the search index. Run update_index later.")
+
+    def handle(self, *args, **options):
+        org = Org.objects.select_related('admin').filter(pk=options['org']).first()
+        if org is None:
+            raise CommandError("Org with id %d does not exist." % (options['org'],))
+        if options['chunk_size'] <= 0:
+            raise CommandError("--chunk-size should be a positive number.")
+        file_format = options['format'] or importer.guess_format(options['path'])
+        if file_format is None:
+            raise CommandError("Could not guess the format of '%s'. Pass --format." %
+                               (options['path'],))
+        actor = options['actor']
+        if actor is None and org.admin is not None:
+            actor = org.admin.email
+
+        start = time.perf_counter()
+        with context.bind(org=org, actor=actor):
+            if options['path'] == '-':
+                result = self.run_import(sys.stdin.buffer, org, file_format, options)
+            else:
+                try:
+                    stream = open(options['path'], 'rb')
+                except OSError as e:
+                    raise CommandError("Could not open '%s': %s" % (options['path'], e))
+                with stream:
+                    result = self.run_import(stream, org, file_format, options)
+        elapsed = time.perf_counter() - start
+
+        for line_num, message in result.errors:
+            self.stderr.write("Line %d: %s" % (line_num, message))
+        self.stdout.write("Created %d resources in %s from %d rows in %.2f s (%d rows/s). "
+                          "%d rows skipped." % (
+                              result.created_count, org.get_name(), result.row_count,
+                              elapsed, result.row_count / elapsed if elapsed else 0,
+                              result.error_count))
+
+    def run_import(self, stream, org, file_format, options):
+        return importer.import_resources(stream, org, file_format,
+                                         chunk_size=options['chunk_size'],
+                                         reindex=not options['no_reindex'])
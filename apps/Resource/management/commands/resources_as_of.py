@@ -0,0 +1,105 @@
+"""Management command which prints the state of Resources as it was at a point in time,
+rebuilt from their history. See apps/ChangeHistory/snapshots.py
+
+One JSON object is written per line so that the output of a whole org can be streamed
+into a file or another tool. ForeignKeys are printed using the same display names as the
+history page.
+
+Usage:
+    python manage.py resources_as_of --as-of 2020-03-31 --org 1 > inventory.ndjson
+    python manage.py resources_as_of --as-of 2020-03-31T10:00 --serial SN1234
+    python manage.py resources_as_of --as-of 2020-03-31 --resource 42
+"""
+
+import datetime
+from itertools import islice
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from apps.ChangeHistory.snapshots import DEFAULT_CHUNK_SIZE
+from apps.Resource.models import Resource
+
+
+def parse_as_of(value):
+    """Parses an ISO timestamp or date. A date refers to the end of that day."""
+    try:
+        when = parse_datetime(value)
+        if when is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            when = datetime.datetime.combine(day, datetime.time.max)
+    except ValueError:
+        return None
+    if timezone.is_naive(when):
+        when = timezone.make_aware(when)
+    return when
+
+
+def resolve_states(states):
+    """Returns a copy of the (pk, state) pairs with the FK ids replaced by display
+    names. Resolves all of them with one query per related model.
+    """
+    entries = [{"what": [{"field": name, "cur": value} for name, value in state.items()]}
+               for pk, state in states]
+    resolved = Resource.resolve_history(entries)
+    return [(pk, {change["field"]: change["cur"] for change in entry["what"]})
+            for (pk, state), entry in zip(states, resolved)]
+
+
+class Command(BaseCommand):
+    help = "Prints the state of Resources at a point in time as JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', required=True,
+                            help="ISO timestamp or date (end of the day) to go back to.")
+        parser.add_argument('--org', type=int,
+                            help="id of the Org whose inventory should be printed.")
+        parser.add_argument('--resource', type=int,
+                            help="id of a single Resource.")
+        parser.add_argument('--serial',
+                            help="Only print the Resources having this serial number "
+                                 "now.")
+        parser.add_argument('--raw', action='store_true',
+                            help="Print the ids of ForeignKeys instead of names.")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                            help="Number of Resources reconstructed per batch of queries.")
+
+    def handle(self, *args, **options):
+        when = parse_as_of(options['as_of'])
+        if when is None:
+            raise CommandError("Invalid --as-of value '%s'." % (options['as_of'],))
+        if options['chunk_size'] <= 0:
+            raise CommandError("--chunk-size should be a positive number.")
+
+        queryset = Resource.objects.all()
+        if options['resource'] is not None:
+            queryset = queryset.filter(pk=options['resource'])
+        if options['org'] is not None:
+            # Resources never move across orgs from the UI.
+            queryset = queryset.filter(org_id=options['org'])
+        if options['serial'] is not None:
+            queryset = queryset.filter(serial_num=options['serial'])
+
+        try:
+            states = queryset.states_as_of(when, chunk_size=options['chunk_size'])
+            printed_count = 0
+            while True:
+                chunk = list(islice(states, options['chunk_size']))
+                if not chunk:
+                    break
+                if not options['raw']:
+                    chunk = resolve_states(chunk)
+                for pk, state in chunk:
+                    line = dict(state, id=pk, as_of=when)
+                    self.stdout.write(json.dumps(line, cls=DjangoJSONEncoder))
+                printed_count += len(chunk)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['verbosity'] > 1:
+            self.stderr.write("%d resources as of %s" % (printed_count, when.isoformat()))
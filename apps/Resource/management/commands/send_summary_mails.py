@@ -0,0 +1,81 @@
+"""Management command mailing every user the summary of his resources. See
+apps/Resource/summary.py
+
+The run is named after the day by default: running the command again the same day
+resumes the run where it stopped (SIGTERM / Ctrl+C / failure) instead of mailing the
+users again. To spread a run over several processes or hosts, give each a range of user
+ids, Eg:
+    python manage.py send_summary_mails --from-user-id 1 --to-user-id 25000
+    python manage.py send_summary_mails --from-user-id 25001
+
+Usage:
+    python manage.py send_summary_mails
+    python manage.py send_summary_mails --workers 4
+    python manage.py send_summary_mails --run summary-2026-10-18 --restart
+"""
+
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.Resource import summary
+
+
+class Command(BaseCommand):
+    help = "Mails every user the summary of his resources."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--run',
+                            help="Name of the run, resumed when it exists. "
+                                 "'summary-<today>' by default.")
+        parser.add_argument('--from-user-id', type=int, default=1,
+                            help="Mail the users with this id or above.")
+        parser.add_argument('--to-user-id', type=int, default=summary.MAX_USER_ID,
+                            help="Mail the users with this id or below.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of worker processes rendering the mails.")
+        parser.add_argument('--block-size', type=int, default=summary.DEFAULT_BLOCK_SIZE,
+                            help="Number of users read and rendered at once.")
+        parser.add_argument('--send-chunk-size', type=int,
+                            default=summary.DEFAULT_SEND_CHUNK_SIZE,
+                            help="Number of mails sent between two checkpoints.")
+        parser.add_argument('--restart', action='store_true',
+                            help="Mail all the users of the run again.")
+
+    def handle(self, *args, **options):
+        for name in ('from_user_id', 'to_user_id', 'workers', 'block_size',
+                     'send_chunk_size'):
+            if options[name] <= 0:
+                raise CommandError("--%s should be a positive number." %
+                                   (name.replace('_', '-'),))
+        if options['from_user_id'] > options['to_user_id']:
+            raise CommandError("--from-user-id should not be above --to-user-id.")
+
+        # Stop like on Ctrl+C. The mails sent are kept and the rest resumed later.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        checkpoint = summary.get_checkpoint(
+            options['run'] or summary.default_run_name(), options['from_user_id'],
+            options['to_user_id'], restart=options['restart'])
+        if checkpoint.finished_at is not None:
+            self.stdout.write("%s was completed at %s. Use --restart to run it again." %
+                              (checkpoint.name, checkpoint.finished_at))
+            return
+        self.stdout.write("%s: %s from user %d" % (
+            checkpoint.name, "Resuming" if checkpoint.done_until else "Starting",
+            max(checkpoint.done_until + 1, checkpoint.first_user_id)))
+
+        start = time.monotonic()
+        for checkpoint in summary.send_summaries(
+                checkpoint, workers=options['workers'], block_size=options['block_size'],
+                send_chunk_size=options['send_chunk_size']):
+            if options['verbosity'] > 1:
+                self.stdout.write("  Done until user %d. sent:%d skipped:%d" %
+                                  (checkpoint.done_until, checkpoint.sent,
+                                   checkpoint.skipped))
+
+        self.stdout.write("%s: Sent %d mails in %.1f s. %d users skipped, %d mails "
+                          "failed, %d queued to be retried." % (
+                              checkpoint.name, checkpoint.sent, time.monotonic() - start,
+                              checkpoint.skipped, checkpoint.failed, checkpoint.queued))
@@ -1,9 +1,13 @@
 from django.db import models
-from apps.Organization.models import Org
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+from apps.Organization.models import Org, Team
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from apps.ChangeHistory.middleware import _get_django_request
-from apps.ChangeHistory.models import ChangeHistoryMixin
+from apps.Core.context import get_current_actor
+from apps.ChangeHistory.models import ChangeHistoryMixin, HistoryDeferringManager
+from apps.ChangeHistory.signals import history_bulk_updated
+from django.dispatch import receiver
 
 import logging
 logger = logging.getLogger(__name__)
@@ -12,50 +16,41 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
-def CustomProcessDictHook(instance, object_dict, *args, **kwargs):
-    """Hook function which will be set to the field 'history__process_dict_hook'
-    User FK in Resource get serialized to a number. This replaces the userID number with 
-    a username.
+def CustomFKDisplayHook(related_obj):
+    """Hook function which will be set to the field 'history__fk_display_hook'
+    User FKs in Resource are stored as ids in the history. While displaying the history,
+    this returns the username for a User and the name for an Org.
 
     Arguments:
-        instance {Resource} -- Resource object is passed as self
-        object_dict {dict} -- Dictionary returned by model_to_dict.
-    """
-    for field in object_dict:
+        related_obj {Model} -- Object referred to by a FK of the Resource.
 
-        if hasattr(instance, field):
-            field_val = getattr(instance, field)
-            # for AssetUser and Org name
-            if field_val is not None and issubclass(field_val.__class__, User):
-                object_dict[field] = field_val.get_username()
-            elif field_val is not None and issubclass(field_val.__class__, Org):
-                object_dict[field] = field_val.get_name()
+    Returns:
+        str -- Value to be displayed in place of the id.
+    """
+    # for AssetUser and Org name
+    if isinstance(related_obj, User):
+        return related_obj.get_username()
+    elif isinstance(related_obj, Org):
+        return related_obj.get_name()
 
-        # TODO: add other non-serializable field types or fields which need custom
-        # processing.
-    return
+    # TODO: add other FK types which need custom processing.
+    return str(related_obj)
 
 
 def get_loggedin_user(*args, **kwargs):
     """Custom function called by the ChangeHistory mixin to store the who changed the field.
     This function returns the value to be stored in the 'who' field.
 
-    In our app we want this to be our logged in user. The logged in user is
-    present in the request object which is stored as a thread local variable using
-    the RequestMiddleware. Fetch the request object by calling _get_django_request() and
-    return the user value.
+    In our app we want this to be our logged in user. The logged in user is present in
+    the request which is stored in the request context by the RequestMiddleware.
+    Background tasks carry the user along with the context (see apps/Core/context.py).
 
     Returns:
         str -- The value to be stored in the who field.
     """
-    who = ''
-    request_obj = _get_django_request()
-    if request_obj is not None:
-        # We wish to store the email id in the who field.
-        # TODO: Check if we want email or username.
-        who = request_obj.user.email
-
-    return who
+    # We wish to store the email id in the who field.
+    # TODO: Check if we want email or username.
+    return get_current_actor() or ''
 
 
 class Resource(ChangeHistoryMixin, models.Model):
@@ -125,11 +120,26 @@ class Resource(ChangeHistoryMixin, models.Model):
     # based on a logged in user's organization.
     org = models.ForeignKey(Org, on_delete=models.PROTECT, null=True, related_name='resource_set')
 
+    # When the Resource was last changed. Set on every save, by tracked_update() and by
+    # the other queryset updates of Resources. The 'reindex' command indexes the
+    # Resources changed since its last run using it (see apps/Search/reindex.py).
+    modified_at = models.DateTimeField(auto_now=True, db_index=True)
+
 
     # Configure the Hook functions used by ChangeHistoryMixin.
-    history__process_dict_hook = CustomProcessDictHook
+    # Only the below fields are tracked. The FK values are stored as ids and resolved to
+    # names in bulk only when the history is displayed.
+    history__tracked_fields = ['name', 'serial_num', 'current_user', 'previous_user',
+                               'device_admin', 'status', 'description', 'org']
+    history__fk_display_hook = CustomFKDisplayHook
     history__get_user_hook = get_loggedin_user
     history__max_entry_count = 100  #TODO: Make this configurable via global settings
+    # Changes are indexed per Org for the org wide audit log.
+    history__scope_field = 'org'
+
+    # Most views never show the history. Do not load it unless asked for using
+    # Resource.objects.with_history()
+    objects = HistoryDeferringManager()
 
     class Meta:
         verbose_name = "resource"
@@ -173,3 +183,78 @@ class Resource(ChangeHistoryMixin, models.Model):
         """
         return "/resource/%d/deny"%(self.pk,)
 
+
+def update_search_index(pks):
+    """Updates the search index of the Resources with the pks passed in a single batch
+    per search connection. Used for Resources written without save() (queryset updates,
+    bulk_create) as they are not picked up by the haystack signal processor.
+    When the index updates are queued (see apps/Search/signals.py) the Resources are
+    queued instead.
+
+    Arguments:
+        pks {list} -- pks of the Resources to be reindexed.
+    """
+    # Imported here as the search index module imports this module.
+    from haystack import connections
+    from haystack.exceptions import NotHandled
+    from apps.Search.index_queue import enqueue, is_queue_enabled
+    from apps.Search.signals import index_updated
+
+    if is_queue_enabled():
+        enqueue(Resource, pks)
+        return
+
+    for using in connections.connections_info:
+        try:
+            index = connections[using].get_unified_index().get_index(Resource)
+        except NotHandled:
+            continue
+        queryset = index.index_queryset(using=using).filter(pk__in=pks)
+        connections[using].get_backend().update(index, queryset)
+        logger.debug("Reindexed %d resources. Connection:%s" % (len(pks), using))
+    index_updated.send(sender=Resource, pks=list(pks), removed_pks=[])
+
+
+@receiver(history_bulk_updated, sender=Resource)
+def reindex_bulk_updated_resources(sender, pks, **kwargs):
+    """Updates the search index for all the Resources changed by tracked_update() in a
+    single batch. Queryset updates do not send post_save and hence are not picked up by
+    the haystack signal processor.
+
+    Arguments:
+        sender {Resource} -- Model class of the updated objects.
+        pks {list} -- pks of the Resources which were updated.
+    """
+    update_search_index(pks)
+
+
+@receiver(m2m_changed, sender=Team.team_members.through)
+def reindex_team_member_resources(sender, instance, action, reverse, pk_set, **kwargs):
+    """Updates the search index for the Resources held by the users who joined or left a
+    Team. The Teams of the current user are indexed along with a Resource (team_ids).
+
+    Arguments:
+        sender {Model} -- Through model of Team.team_members.
+        instance {Team or User} -- Team, or User when changed from the User side.
+        action {str} -- 'post_add', 'pre_clear' etc.
+        reverse {bool} -- True when changed from the User side.
+        pk_set {set} -- pks of the Users (Teams when reverse) added / removed.
+    """
+    if action == 'pre_clear':
+        # The members are not known any more after the clear.
+        instance._cleared_member_ids = [instance.pk] if reverse else \
+            list(instance.team_members.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        user_ids = getattr(instance, '_cleared_member_ids', [])
+    elif action in ('post_add', 'post_remove'):
+        user_ids = [instance.pk] if reverse else list(pk_set)
+    else:
+        return
+
+    resources = Resource.objects.filter(current_user_id__in=user_ids)
+    pks = list(resources.values_list('pk', flat=True))
+    if pks:
+        # Their index entries changed. Picked up by the incremental 'reindex' as well.
+        resources.update(modified_at=timezone.now())
+        update_search_index(pks)
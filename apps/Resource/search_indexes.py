@@ -22,10 +22,42 @@ class ResourceIndex(indexes.SearchIndex, indexes.Indexable):
     # We do not want the user to see Resources belonging to other orgs.
     # Since 'id' of the Org is what is unique, we store that as an attribute.
     # This is very important as it allows us to get Org specific results.
-    org_id = indexes.IntegerField(model_attr="org__id")
+    # 'org_id' is read from the row itself. 'org__id' would fetch the Org per Resource.
+    org_id = indexes.IntegerField(model_attr="org_id")
+
+    # Filters and facets of the search page (see ResourceSearchView). faceted=True adds
+    # the exact (not analyzed) field '<name>_exact' which is used for both. team_ids are
+    # the Teams the current user of the Resource is a member of.
+    status = indexes.CharField(model_attr='status', faceted=True)
+    current_user_id = indexes.IntegerField(model_attr='current_user_id', faceted=True)
+    device_admin_id = indexes.IntegerField(model_attr='device_admin_id', faceted=True)
+    team_ids = indexes.MultiValueField(faceted=True)
+
+    # Fields displayed in the search results and the autocomplete suggestions. They are
+    # stored (not indexed) so that both can be rendered from the search results alone,
+    # without loading the Resources (result.object) from the DB.
+    name = indexes.CharField(model_attr='name', indexed=False)
+    serial_num = indexes.CharField(model_attr='serial_num', indexed=False)
+    current_user_name = indexes.CharField(model_attr='current_user__name', indexed=False)
+    current_user_email = indexes.CharField(model_attr='current_user__email',
+                                           indexed=False)
+    device_admin_name = indexes.CharField(model_attr='device_admin__name', indexed=False)
+    url = indexes.CharField(model_attr='get_absolute_url', indexed=False)
+    update_url = indexes.CharField(model_attr='get_update_url', indexed=False)
 
     def get_model(self):
         return Resource
 
+    def get_updated_field(self):
+        # Used by 'update_index --age' and the incremental 'reindex' command.
+        return 'modified_at'
+
+    def prepare_team_ids(self, obj):
+        return [team.pk for team in obj.current_user.team_member_of.all()]
+
     def index_queryset(self, using=None):
-        return self.get_model().objects.all()
+        # The users are read by the stored fields and the text template, the Teams by
+        # team_ids. Fetch them along with the Resources instead of one query per
+        # Resource.
+        return self.get_model().objects.select_related('current_user', 'device_admin') \
+            .prefetch_related('current_user__team_member_of')
@@ -0,0 +1,297 @@
+"""Summary mails of the resources of every user. See the 'send_summary_mails' command.
+
+A run mails the users with ids in a range, in id order, block by block:
+
+    1. A block of users is read along with the resources of their four summaries (in
+       dispute, needing action, in use and managed in dispute) with one query over
+       Resource: the resources held (status Disputed / Assigned / Acknowledged) or
+       managed (status Disputed) by the users of the block.
+    2. The mails of the blocks are rendered by a pool of worker processes, a few blocks
+       ahead of the one being sent.
+    3. The mails are sent over a single connection to the mail server, and the
+       checkpoint (MailRunCheckpoint) moves after every send_chunk_size mails. An
+       interrupted run resumes after the last chunk sent: the mails of the chunk being
+       sent when it stopped may be sent twice, never lost.
+
+A mail refused temporarily by the mail server is handed to the outbox (see
+apps/Mail/outbox.py), which retries it. A mail refused permanently is counted as failed
+and logged. When the connection to the mail server fails, the run stops.
+"""
+
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.db import connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.Mail import compiled, outbox
+from apps.Mail.models import MailRunCheckpoint
+from .models import Resource
+
+import logging
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# Number of users read and rendered at once by default.
+DEFAULT_BLOCK_SIZE = 500
+# Number of mails sent between two saves of the checkpoint by default.
+DEFAULT_SEND_CHUNK_SIZE = 100
+# Upper limit of the user ids. Max value of an AutoField.
+MAX_USER_ID = 2147483647
+
+SUBJECT = "Device Summary"
+
+# Statuses of the resources held by a user listed in his summary, and the list of the
+# summary each goes to. The resources managed are listed when disputed.
+HELD_LISTS = {
+    Resource.RES_DISPUTE: 'res_in_dispute',
+    Resource.RES_ASSIGNED: 'res_needing_action',
+    Resource.RES_ACKNOWLEDGED: 'res_in_use',
+}
+MANAGED_LIST = 'res_managed_in_dispute'
+
+
+def default_run_name():
+    """Name of the run of today. Running the command again the same day resumes it."""
+    return 'summary-%s' % (timezone.localdate().isoformat(),)
+
+
+def get_checkpoint(name, first_user_id=1, last_user_id=MAX_USER_ID, restart=False):
+    """Returns the checkpoint of the run, created when it is a new one.
+
+    Keyword Arguments:
+        restart {bool} -- Start the run again from its first user. (default: {False})
+    """
+    checkpoint, created = MailRunCheckpoint.objects.get_or_create(
+        name=name, first_user_id=first_user_id, last_user_id=last_user_id)
+    if restart and not created:
+        checkpoint.done_until = checkpoint.sent = checkpoint.skipped = 0
+        checkpoint.failed = checkpoint.queued = 0
+        checkpoint.started_at = timezone.now()
+        checkpoint.finished_at = None
+        checkpoint.save()
+    return checkpoint
+
+
+def read_block(after_user_id, last_user_id, block_size):
+    """Reads the next block of users and the resources of their summaries.
+
+    Returns:
+        list -- (user id, email, name, {list name: [resource row, ...]}) of each user,
+                in id order. A resource row is (id, name, current user (id, email),
+                previous user (id, email) or None). Empty when no user is left.
+    """
+    users = list(User.objects.filter(pk__gt=after_user_id, pk__lte=last_user_id)
+                 .order_by('pk').values_list('pk', 'email', 'name')[:block_size])
+    if not users:
+        return []
+    user_range = (users[0][0], users[-1][0])
+
+    lists_by_user = {}
+    rows = Resource.objects.filter(
+        Q(current_user__gte=user_range[0], current_user__lte=user_range[1],
+          status__in=list(HELD_LISTS)) |
+        Q(device_admin__gte=user_range[0], device_admin__lte=user_range[1],
+          status=Resource.RES_DISPUTE)
+    ).order_by('pk').values_list(
+        'pk', 'name', 'status', 'current_user_id', 'device_admin_id',
+        'current_user__email', 'previous_user_id', 'previous_user__email')
+    for (pk, name, status, holder_id, admin_id, holder_email, prev_id,
+         prev_email) in rows.iterator():
+        row = (pk, name, (holder_id, holder_email),
+               (prev_id, prev_email) if prev_id is not None else None)
+        if user_range[0] <= holder_id <= user_range[1]:
+            lists_by_user.setdefault(holder_id, {}).setdefault(
+                HELD_LISTS[status], []).append(row)
+        if status == Resource.RES_DISPUTE and user_range[0] <= admin_id <= user_range[1]:
+            lists_by_user.setdefault(admin_id, {}).setdefault(
+                MANAGED_LIST, []).append(row)
+
+    return [(pk, email, name, lists_by_user.get(pk, {})) for pk, email, name in users]
+
+
+def _resource(row):
+    """Resource instance of a row of read_block(), with what the template uses."""
+    pk, name, (holder_id, holder_email), previous = row
+    previous_user = User(pk=previous[0], email=previous[1]) if previous else None
+    return Resource(pk=pk, name=name, current_user=User(pk=holder_id, email=holder_email),
+                    previous_user=previous_user)
+
+
+def render_block(block, current_site):
+    """Renders the summary mails of a block of users. Called by the worker processes.
+
+    Arguments:
+        block {list} -- Users returned by read_block().
+        current_site {Site} -- Site the links point to.
+
+    Returns:
+        list -- (user id, email, plain text body, html body) of the users with resources
+                to list. The others are skipped.
+    """
+    domain_url = "http://%s" % (current_site.domain,)
+    rendered = []
+    for pk, email, name, lists in block:
+        if not lists:
+            continue
+        context = {'res_in_dispute': [], 'res_needing_action': [], 'res_in_use': [],
+                   MANAGED_LIST: [],
+                   'current_site': current_site,
+                   'domain_url': domain_url,
+                   'user': User(pk=pk, email=email, name=name)}
+        for list_name, rows in lists.items():
+            context[list_name] = [_resource(row) for row in rows]
+        plain_message, html_message = compiled.render_mail('mail/summary.html', context)
+        rendered.append((pk, email, plain_message, html_message))
+    return rendered
+
+
+def iter_rendered_blocks(checkpoint, workers=1, block_size=DEFAULT_BLOCK_SIZE):
+    """Reads and renders the blocks of users not done by the run, in a pool of 'workers'
+    processes when more than 1.
+
+    Yields:
+        tuple -- (block, rendered mails) in user id order. See render_block().
+    """
+    current_site = Site.objects.get_current()
+    after = checkpoint.done_until or checkpoint.first_user_id - 1
+
+    def blocks():
+        nonlocal after
+        while True:
+            block = read_block(after, checkpoint.last_user_id, block_size)
+            if not block:
+                return
+            after = block[-1][0]
+            yield block
+
+    if workers <= 1:
+        for block in blocks():
+            yield block, render_block(block, current_site)
+        return
+
+    # Forked, as the workers need the settings and the apps of this process. They do not
+    # use the DB connections of this process, closed before forking.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('fork')) as executor:
+        # A few blocks ahead per worker. Bounds the memory used by the blocks read.
+        pending = deque()
+        try:
+            for block in blocks():
+                pending.append((block, executor.submit(render_block, block,
+                                                       current_site)))
+                if len(pending) >= workers * 2:
+                    block, future = pending.popleft()
+                    yield block, future.result()
+            while pending:
+                block, future = pending.popleft()
+                yield block, future.result()
+        except BaseException:
+            # Eg: KeyboardInterrupt. The blocks which were not sent are resumed later.
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+def _save_progress(checkpoint, done_until, counts):
+    MailRunCheckpoint.objects.filter(pk=checkpoint.pk).update(
+        done_until=done_until,
+        **{name: F(name) + count for name, count in counts.items()})
+    checkpoint.done_until = done_until
+    for name, count in counts.items():
+        setattr(checkpoint, name, getattr(checkpoint, name) + count)
+
+
+def send_chunk(connection, rendered, from_email):
+    """Sends the mails over the connection. Mails refused temporarily are queued in the
+    outbox.
+
+    Arguments:
+        rendered {list} -- (user id, email, plain text body, html body) of the mails.
+
+    Raises:
+        Exception -- The error of the connection to the mail server, when it failed.
+
+    Returns:
+        dict -- {'sent': .., 'failed': .., 'queued': ..}
+    """
+    counts = {'sent': 0, 'failed': 0, 'queued': 0}
+    to_retry = []
+    for pk, email, body, html_body in rendered:
+        message = EmailMultiAlternatives(SUBJECT, body, from_email, [email],
+                                         connection=connection)
+        message.attach_alternative(html_body, 'text/html')
+        try:
+            # One at a time, so that an error is attributed to its mail.
+            connection.send_messages([message])
+        except Exception as e:
+            if outbox.is_connection_error(e):
+                raise
+            if outbox.is_permanent_error(e):
+                counts['failed'] += 1
+                logger.error("Summary mail to %s refused: %s" % (email, e))
+            else:
+                to_retry.append(({'subject': SUBJECT, 'body': body,
+                                  'html_body': html_body}, [email]))
+            continue
+        counts['sent'] += 1
+
+    if to_retry:
+        counts['queued'] = outbox.enqueue_many(outbox.render_prerendered, to_retry,
+                                               from_email=from_email)
+    return counts
+
+
+def send_summaries(checkpoint, workers=1, block_size=DEFAULT_BLOCK_SIZE,
+                   send_chunk_size=DEFAULT_SEND_CHUNK_SIZE, connection=None):
+    """Sends the summary mails of the users not done by the run. See the module
+    docstring.
+
+    Arguments:
+        checkpoint {MailRunCheckpoint} -- Run returned by get_checkpoint().
+
+    Keyword Arguments:
+        workers {int} -- Number of processes rendering the mails.
+        block_size {int} -- Number of users read and rendered at once.
+        send_chunk_size {int} -- Number of mails sent between two saves of the checkpoint.
+        connection {} -- Mail backend to send with. A new one when None.
+
+    Yields:
+        MailRunCheckpoint -- The checkpoint, after each block of users. finished_at is
+                             set once all the users are done.
+    """
+    if checkpoint.finished_at is not None:
+        return
+    from_email = settings.EMAIL_FROM_ADDRESS
+    connection = connection or mail.get_connection()
+    connection.open()
+    try:
+        for block, rendered in iter_rendered_blocks(checkpoint, workers, block_size):
+            counts = {'skipped': len(block) - len(rendered)}
+            for i in range(0, len(rendered), send_chunk_size):
+                chunk = rendered[i:i + send_chunk_size]
+                counts.update(send_chunk(connection, chunk, from_email))
+                # The skipped users before the end of the chunk are done as well.
+                done_until = chunk[-1][0] if i + send_chunk_size < len(rendered) \
+                    else block[-1][0]
+                _save_progress(checkpoint, done_until, counts)
+                counts = {}
+            if not rendered:
+                _save_progress(checkpoint, block[-1][0], counts)
+            yield checkpoint
+    finally:
+        connection.close()
+
+    checkpoint.finished_at = timezone.now()
+    checkpoint.save(update_fields=['finished_at'])
+    logger.info("Summary mails of %s sent. sent:%d skipped:%d failed:%d queued:%d" % (
+        checkpoint.name, checkpoint.sent, checkpoint.skipped, checkpoint.failed,
+        checkpoint.queued))
@@ -1,3 +1,382 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import zipfile
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from haystack import connections
+
+from apps.ChangeHistory.models import FieldChange, HistoryEntry
+from apps.Mail.models import NotificationEvent
+from apps.Organization.models import Org
+from apps.Resource import exporter, importer, transitions
+from apps.Resource.models import Resource
+from apps.Users.models import AssetUser
+
+
+class ResourceSearchViewTests(TestCase):
+    """Searches of the search page, indexed in the database search backend (see
+    apps/Search/backends.py) as no Elasticsearch service is available to the tests.
+    """
+
+    def setUp(self):
+        self.connections_info = connections.connections_info
+        connections.connections_info = {
+            'default': {
+                'ENGINE': 'apps.Search.backends.DatabaseSearchEngine',
+                'INCLUDE_SPELLING': True,
+            },
+        }
+        connections.reload('default')
+        cache.clear()
+
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.user.org = self.org
+        self.user.save()
+        for i in range(3):
+            Resource.objects.create(name='Dell Latitude %d' % (i,),
+                                    serial_num='SN%d' % (i,), current_user=self.user,
+                                    device_admin=self.user, description='laptop',
+                                    org=self.org)
+        call_command('update_index', verbosity=0)
+        self.client.force_login(self.user)
+
+    def tearDown(self):
+        connections.connections_info = self.connections_info
+        connections.reload('default')
+        cache.clear()
+
+    def test_invalid_filter_does_not_poison_cached_results(self):
+        # A user which is not of the Org: the form is invalid.
+        response = self.client.get('/search/', {'q': 'dell', 'current_user_id': 99999})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['object_list']), 0)
+
+        response = self.client.get('/search/', {'q': 'dell'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 3)
+
+    def test_invalid_filter_is_not_answered_from_cached_results(self):
+        response = self.client.get('/search/', {'q': 'dell'})
+        self.assertEqual(response.context['paginator'].count, 3)
+
+        response = self.client.get('/search/', {'q': 'dell', 'current_user_id': 99999})
+        self.assertEqual(len(response.context['object_list']), 0)
+
+    def test_spelling_suggestions_are_words_of_the_org(self):
+        other_user = AssetUser.objects.create_user('bob@xyz.com', 'secret', name='Bob')
+        other_org = Org.objects.create(org_name='Xyz', admin=other_user)
+        Resource.objects.create(name='Touchscreen', serial_num='SN9',
+                                current_user=other_user, device_admin=other_user,
+                                description='monitor', org=other_org)
+        call_command('update_index', verbosity=0)
+
+        response = self.client.get('/search/', {'q': 'latitde'})
+        self.assertEqual(response.context['spell_suggestion'], 'latitude')
+        response = self.client.get('/search/', {'q': 'touchscren'})
+        self.assertNotIn('spell_suggestion', response.context)
+
+
+class StatusTransitionTests(TestCase):
+    """Acknowledge / dispute of a resource by its current user (see transitions.py)."""
+
+    def setUp(self):
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.other_user = AssetUser.objects.create_user('bob@abc.com', 'secret',
+                                                        name='Bob')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.resource = Resource.objects.create(name='Dell Latitude', serial_num='SN1',
+                                                current_user=self.user,
+                                                device_admin=self.other_user,
+                                                description='laptop', org=self.org)
+
+    def status_changes(self):
+        return [change for entry in HistoryEntry.objects.for_instance(self.resource)
+                for change in entry.what if change['field'] == 'status']
+
+    def test_change_status_records_the_previous_status(self):
+        resource, changed = transitions.change_status(self.resource.pk, self.user,
+                                                      Resource.RES_ACKNOWLEDGED)
+        self.assertTrue(changed)
+        self.assertEqual(resource.status, Resource.RES_ACKNOWLEDGED)
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.status, Resource.RES_ACKNOWLEDGED)
+        self.assertEqual(self.status_changes(), [
+            {'field': 'status', 'prev': Resource.RES_ASSIGNED,
+             'cur': Resource.RES_ACKNOWLEDGED}])
+
+    def test_change_to_the_current_status_is_not_recorded(self):
+        resource, changed = transitions.change_status(self.resource.pk, self.user,
+                                                      Resource.RES_ASSIGNED)
+        self.assertFalse(changed)
+        self.assertEqual(self.status_changes(), [])
+
+    def test_other_user_cannot_change_the_status(self):
+        with self.assertRaises(transitions.NotResourceOwner):
+            transitions.change_status(self.resource.pk, self.other_user,
+                                      Resource.RES_DISPUTE)
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.status, Resource.RES_ASSIGNED)
+        self.assertEqual(self.status_changes(), [])
+
+    def test_missing_resource(self):
+        with self.assertRaises(transitions.ResourceNotFound):
+            transitions.change_status(self.resource.pk + 1, self.user,
+                                      Resource.RES_DISPUTE)
+
+    def test_reassigned_resource_cannot_be_acknowledged(self):
+        Resource.objects.filter(pk=self.resource.pk).update(current_user=self.other_user)
+        self.client.force_login(self.user)
+        response = self.client.get('/resource/%d/acknowledge' % (self.resource.pk,))
+        self.assertEqual(response.status_code, 403)
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.status, Resource.RES_ASSIGNED)
+
+    def test_dispute_queues_the_mail_with_the_change(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/resource/%d/deny' % (self.resource.pk,))
+        self.assertEqual(response.status_code, 200)
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.status, Resource.RES_DISPUTE)
+        self.assertEqual(NotificationEvent.objects.filter(kind='dispute').count(), 2)
+        self.assertEqual(len(self.status_changes()), 1)
+
+        # Disputing it again changes nothing and mails nobody.
+        self.client.get('/resource/%d/deny' % (self.resource.pk,))
+        self.assertEqual(NotificationEvent.objects.filter(kind='dispute').count(), 2)
+        self.assertEqual(len(self.status_changes()), 1)
+
+
+class BulkStatusTransitionTests(TestCase):
+    """Acknowledge / dispute of many resources at once (see transitions.py)."""
+
+    def setUp(self):
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.other_user = AssetUser.objects.create_user('bob@abc.com', 'secret',
+                                                        name='Bob')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.user.org = self.org
+        self.user.save()
+
+        def create(serial_num, current_user, status=Resource.RES_ASSIGNED):
+            return Resource.objects.create(name='Device %s' % (serial_num,),
+                                           serial_num=serial_num,
+                                           current_user=current_user,
+                                           device_admin=self.other_user,
+                                           description='laptop', org=self.org,
+                                           status=status)
+        self.assigned = create('SN1', self.user)
+        self.disputed = create('SN2', self.user, Resource.RES_DISPUTE)
+        self.acknowledged = create('SN3', self.user, Resource.RES_ACKNOWLEDGED)
+        self.of_other_user = create('SN4', self.other_user)
+        self.pks = [self.assigned.pk, self.disputed.pk, self.acknowledged.pk,
+                    self.of_other_user.pk, self.of_other_user.pk + 1]
+
+    def status_of(self, resource):
+        resource.refresh_from_db()
+        return resource.status
+
+    def status_changes(self):
+        return {entry.object_id: change
+                for entry in HistoryEntry.objects.filter(
+                    model=Resource._meta.label_lower)
+                for change in entry.what if change['field'] == 'status'}
+
+    def test_only_the_resources_of_the_user_are_changed(self):
+        result = transitions.bulk_change_status(self.pks, self.user,
+                                                Resource.RES_ACKNOWLEDGED)
+        self.assertEqual(result.as_dict(), {
+            'changed': [self.assigned.pk, self.disputed.pk],
+            'unchanged': [self.acknowledged.pk],
+            'rejected': [self.of_other_user.pk, self.of_other_user.pk + 1],
+        })
+        self.assertEqual(self.status_of(self.assigned), Resource.RES_ACKNOWLEDGED)
+        self.assertEqual(self.status_of(self.disputed), Resource.RES_ACKNOWLEDGED)
+        self.assertEqual(self.status_of(self.of_other_user), Resource.RES_ASSIGNED)
+        self.assertEqual(self.status_changes(), {
+            self.assigned.pk: {'field': 'status', 'prev': Resource.RES_ASSIGNED,
+                               'cur': Resource.RES_ACKNOWLEDGED},
+            self.disputed.pk: {'field': 'status', 'prev': Resource.RES_DISPUTE,
+                               'cur': Resource.RES_ACKNOWLEDGED},
+        })
+
+    def test_bulk_dispute_notifies_the_users_involved(self):
+        self.client.force_login(self.user)
+        response = self.client.post('/resource/bulk-status.json', json.dumps(
+            {'action': 'dispute', 'ids': self.pks}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {
+            'changed': [self.assigned.pk, self.acknowledged.pk],
+            'unchanged': [self.disputed.pk],
+            'rejected': [self.of_other_user.pk, self.of_other_user.pk + 1],
+        })
+        self.assertEqual(self.status_of(self.of_other_user), Resource.RES_ASSIGNED)
+        # The user disputing and the device admin, for each device changed.
+        events = NotificationEvent.objects.filter(kind='dispute')
+        self.assertEqual(sorted(events.values_list('recipient', flat=True)),
+                         ['alice@abc.com', 'alice@abc.com', 'bob@abc.com',
+                          'bob@abc.com'])
+
+
+class ResourcesAsOfTests(TestCase):
+    """States printed by the 'resources_as_of' command."""
+
+    def setUp(self):
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.other_org = Org.objects.create(org_name='Xyz', admin=self.user)
+        self.resource = Resource.objects.create(name='Dell Latitude', serial_num='SN1',
+                                                current_user=self.user,
+                                                device_admin=self.user,
+                                                description='laptop', org=self.org)
+        Resource.objects.create(name='Touchscreen', serial_num='SN2',
+                                current_user=self.user, device_admin=self.user,
+                                description='monitor', org=self.other_org)
+        self.now = timezone.now()
+        HistoryEntry.objects.filter(object_id=self.resource.pk).update(
+            when=self.now - timedelta(days=5))
+        # Recorded when the ForeignKeys were stored as display values.
+        HistoryEntry.objects.create(
+            model=Resource._meta.label_lower, object_id=self.resource.pk,
+            when=self.now - timedelta(days=2),
+            what=[{'field': 'org', 'prev': 'Old Org', 'cur': 'Abc'}])
+
+    def states(self, **options):
+        out = io.StringIO()
+        call_command('resources_as_of', raw=True, stdout=out, **options)
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_filters_apply_on_the_resources(self):
+        states = self.states(as_of=(self.now - timedelta(days=1)).isoformat(),
+                             org=self.org.pk)
+        self.assertEqual([(state['id'], state['org']) for state in states],
+                         [(self.resource.pk, self.org.pk)])
+        states = self.states(as_of=self.now.isoformat(), serial='SN2')
+        self.assertEqual([state['name'] for state in states], ['Touchscreen'])
+
+    def test_display_values_of_old_entries_are_rejected(self):
+        with self.assertRaisesRegex(CommandError, "display value of 'org'"):
+            self.states(as_of=(self.now - timedelta(days=3)).isoformat(),
+                        org=self.org.pk)
+
+
+class ImportResourcesTests(TestCase):
+    """Rows imported by importer.import_resources()."""
+
+    def setUp(self):
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.user.org = self.org
+        self.user.save()
+        # Not of the Org.
+        AssetUser.objects.create_user('bob@xyz.com', 'secret', name='Bob')
+
+    def import_csv(self, text, **kwargs):
+        return importer.import_resources(io.BytesIO(text.encode('utf-8')), self.org,
+                                         importer.FORMAT_CSV, reindex=False, **kwargs)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        result = self.import_csv(
+            "name,serial_num,current_user,device_admin,status\n"
+            "Dell,SN1,alice@abc.com,alice@abc.com,\n"
+            "Dell,,alice@abc.com,alice@abc.com,\n"
+            "Dell,SN3,bob@xyz.com,alice@abc.com,\n"
+            "Dell,SN4,alice@abc.com,alice@abc.com,Lost\n"
+            "Dell,SN5,ALICE@abc.com,alice@abc.com,Disputed\n")
+        self.assertEqual((result.row_count, result.created_count), (5, 2))
+        self.assertEqual([(line, message.split()[0]) for line, message in result.errors],
+                         [(3, 'serial_num'), (4, 'current_user'), (5, 'Invalid')])
+        self.assertEqual(
+            list(Resource.objects.order_by('pk').values_list('serial_num', 'status')),
+            [('SN1', Resource.RES_ASSIGNED), ('SN5', Resource.RES_DISPUTE)])
+
+    def test_history_entries_are_recorded_for_the_rows_created(self):
+        existing = Resource.objects.create(name='Old', serial_num='SN0',
+                                           current_user=self.user,
+                                           device_admin=self.user,
+                                           description='', org=self.org)
+        rows = ''.join("Dell %d,SN%d,alice@abc.com,alice@abc.com\n" % (i, i)
+                       for i in range(1, 6))
+        result = self.import_csv("name,serial_num,current_user,device_admin\n" + rows,
+                                 chunk_size=2)
+        self.assertEqual(result.created_count, 5)
+
+        created = Resource.objects.exclude(pk=existing.pk)
+        for resource in created:
+            entries = HistoryEntry.objects.for_instance(resource)
+            self.assertEqual(len(entries), 1)
+            changes = {change['field']: change['cur'] for change in entries[0].what}
+            self.assertEqual(changes['serial_num'], resource.serial_num)
+            self.assertEqual(changes['org'], self.org.pk)
+        self.assertEqual(
+            FieldChange.objects.filter(field='serial_num', scope=self.org.pk)
+            .exclude(object_id=existing.pk).count(), 5)
+
+
+class ExportResourcesTests(TestCase):
+    """Rows and files written by the exporter."""
+
+    def setUp(self):
+        self.user = AssetUser.objects.create_user('alice@abc.com', 'secret',
+                                                  name='Alice Smith')
+        self.org = Org.objects.create(org_name='Abc', admin=self.user)
+        self.resource = Resource.objects.create(name='=HYPERLINK("http://x.y")',
+                                                serial_num='-SN1',
+                                                current_user=self.user,
+                                                device_admin=self.user,
+                                                description='@SUM(A1)', org=self.org)
+
+    def export_rows(self):
+        return list(exporter.iter_resource_rows(self.org, include=['status_age']))
+
+    def test_csv_values_are_not_read_as_formulas(self):
+        columns = exporter.get_columns()
+        lines = list(exporter.iter_csv(exporter.iter_resource_rows(self.org), columns))
+        row = dict(zip(columns, next(csv.reader(lines[1:]))))
+        self.assertEqual(row['name'], '\'=HYPERLINK("http://x.y")')
+        self.assertEqual(row['serial_num'], "'-SN1")
+        self.assertEqual(row['description'], "'@SUM(A1)")
+        self.assertEqual(row['current_user'], 'alice@abc.com')
+
+    def test_xlsx_values_are_written_as_strings(self):
+        columns = exporter.get_columns()
+        rows = exporter.iter_resource_rows(self.org)
+        with exporter.write_xlsx(rows, columns) as output:
+            with zipfile.ZipFile(output) as xlsx:
+                sheet = xlsx.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertNotIn('<f>', sheet)
+
+    def test_status_since_of_a_resource_never_transitioned_is_its_creation(self):
+        created_at = HistoryEntry.objects.for_instance(self.resource)[0].when
+        row, = self.export_rows()
+        self.assertEqual(row['status_since'], created_at.isoformat())
+        self.assertEqual(row['status_age_days'], 0)
+
+        transitions.change_status(self.resource.pk, self.user, Resource.RES_ACKNOWLEDGED)
+        changed_at = FieldChange.objects.get(field='status').when
+        row, = self.export_rows()
+        self.assertEqual(row['status_since'], changed_at.isoformat())
+
+    @override_settings(CHANGE_HISTORY_BACKEND='apps.ChangeHistory.backends.'
+                                              'FieldHistoryBackend')
+    def test_status_since_with_the_history_in_the_row(self):
+        resource = Resource.objects.create(name='Dell', serial_num='SN2',
+                                           current_user=self.user,
+                                           device_admin=self.user,
+                                           description='', org=self.org)
+        created_at = resource.history[-1]['when']
+        rows = {row['id']: row for row in self.export_rows()}
+        self.assertEqual(rows[resource.pk]['status_since'],
+                         parse_datetime(created_at).isoformat())
@@ -0,0 +1,203 @@
+"""Status transitions of a Resource made by its current user (acknowledge / dispute).
+
+A transition never saves the whole Resource. The ownership check is made by a
+conditional UPDATE, run first in the transaction of the change
+
+    UPDATE resource SET modified_at=<now>
+     WHERE id=<pk> AND current_user_id=<user> AND status<>'<new>'
+
+which locks the row (the whole DB on SQLite) until the transaction commits. The row is
+then read to build the history entry (and the mail), and the status changed. When no row
+was updated, the row read tells a missing resource, a resource of another user and one
+already in the new status apart. The history entry is appended through the history
+backend without rewriting the row.
+"""
+
+from django.db import transaction
+from django.utils import timezone
+
+from apps.ChangeHistory.backends import get_history_backend
+from apps.ChangeHistory.signals import history_bulk_updated
+from .models import Resource
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Max number of resources changed by one bulk_change_status() call. Keeps the 'IN'
+# lists within the parameter limits of all the supported DBs.
+BULK_MAX_RESOURCES = 900
+
+# Columns needed to check and record a transition.
+TRANSITION_FIELDS = ['id', 'name', 'status', 'current_user', 'org']
+
+
+class TransitionError(Exception):
+    pass
+
+
+class ResourceNotFound(TransitionError):
+    pass
+
+
+class NotResourceOwner(TransitionError):
+    pass
+
+
+def change_status(pk, user, new_status, related=()):
+    """Changes the status of the resource to new_status if the user is its current user.
+
+    Arguments:
+        pk {int} -- Primary key of the resource.
+        user {User} -- User making the change. Should be the current user of the resource.
+        new_status {str} -- One of the Resource.RES_* statuses.
+
+    Keyword Arguments:
+        related {tuple} -- Names of the user FKs to fetch along with the resource using
+                           select_related. Pass them only when they are needed (Eg: to
+                           send a mail) as the plain read does not join any table.
+
+    Raises:
+        ResourceNotFound -- No resource with the pk.
+        NotResourceOwner -- The user is not the current user of the resource.
+
+    Returns:
+        tuple -- (resource, changed). The resource only has TRANSITION_FIELDS and the
+                 related objects loaded. changed is False when the resource already
+                 was in new_status.
+    """
+    queryset = Resource.objects.only(*TRANSITION_FIELDS, *related)
+    if related:
+        queryset = queryset.select_related(*related)
+
+    with transaction.atomic():
+        locked = Resource.objects.filter(pk=pk, current_user_id=user.pk) \
+            .exclude(status=new_status).update(modified_at=timezone.now())
+        resource = queryset.filter(pk=pk).first()
+        if not locked:
+            if resource is None:
+                raise ResourceNotFound("Resource with pk %d does not exist." % (pk,))
+            if resource.current_user_id != user.pk:
+                raise NotResourceOwner("Resource %d is not assigned to %s." %
+                                       (pk, user.get_username()))
+            return resource, False
+
+        # Read after the row was locked: the status being changed.
+        prev_status = resource.status
+        Resource.objects.filter(pk=pk).update(status=new_status)
+        entry = Resource._history_make_entry(
+            [{"field": "status", "prev": prev_status, "cur": new_status}])
+        backend = resource.get_history_backend()
+        backend.bulk_record(Resource, {pk: entry}, scope_by_pk={pk: resource.org_id})
+        # Queryset updates are not seen by the search signal processor.
+        transaction.on_commit(
+            lambda: history_bulk_updated.send(sender=Resource, pks=[pk]))
+
+    # Set directly as the change is already recorded. Assigning the attribute would
+    # start tracking it as a new change.
+    resource.__dict__['status'] = new_status
+    return resource, True
+
+
+class BulkTransitionResult:
+    """Outcome of bulk_change_status().
+
+    Attributes:
+        changed {list} -- Resources moved to the new status. Each is a dict with the
+                          keys 'id', 'name', 'prev_status', 'device_admin_id' and
+                          'previous_user_id'.
+        unchanged {list} -- ids of the resources already in the new status.
+        rejected {list} -- ids which do not exist or are not assigned to the user.
+    """
+
+    def __init__(self):
+        self.changed = []
+        self.unchanged = []
+        self.rejected = []
+
+    def as_dict(self):
+        return {
+            'changed': [res['id'] for res in self.changed],
+            'unchanged': self.unchanged,
+            'rejected': self.rejected,
+        }
+
+
+def bulk_change_status(pks, user, new_status):
+    """Changes the status of all the resources passed which are assigned to the user, in
+    one transaction. Costs a fixed number of queries irrespective of the number of
+    resources: the rows are locked and read once, updated with one UPDATE, their history
+    entries are written in one batch and the search index is updated in one batch once
+    the transaction commits.
+
+    Arguments:
+        pks {iterable} -- Primary keys of the resources.
+        user {User} -- User making the change. Should be the current user of them.
+        new_status {str} -- One of the Resource.RES_* statuses.
+
+    Raises:
+        TransitionError -- Some rows read were not updated. The transaction is rolled
+                           back, nothing is changed.
+
+    Returns:
+        BulkTransitionResult -- The resources changed, left unchanged and rejected.
+    """
+    pk_set = set(pks)
+    result = BulkTransitionResult()
+    if not pk_set:
+        return result
+
+    with transaction.atomic():
+        now = timezone.now()
+        queryset = Resource.objects.filter(pk__in=pk_set, current_user_id=user.pk)
+        if transaction.get_connection().features.has_select_for_update:
+            queryset = queryset.select_for_update()
+        else:
+            # No row locks (SQLite). The first write of the transaction locks the whole
+            # DB until it commits, so that the rows read below are the ones updated.
+            # Only the rows changed below are written to.
+            queryset.exclude(status=new_status).update(modified_at=now)
+        rows = queryset.values_list('pk', 'name', 'status', 'org_id', 'device_admin_id',
+                                    'previous_user_id')
+
+        scope_by_pk = {}
+        for pk, name, status, org_id, device_admin_id, previous_user_id in rows:
+            if status == new_status:
+                result.unchanged.append(pk)
+                continue
+            result.changed.append({'id': pk, 'name': name, 'prev_status': status,
+                                   'device_admin_id': device_admin_id,
+                                   'previous_user_id': previous_user_id})
+            scope_by_pk[pk] = org_id
+        found = set(result.unchanged) | set(scope_by_pk)
+        result.rejected = sorted(pk_set - found)
+
+        if result.changed:
+            changed_pks = list(scope_by_pk)
+            # Conditions repeated so that a row changed in between is never overwritten.
+            updated = Resource.objects.filter(pk__in=changed_pks,
+                                              current_user_id=user.pk) \
+                .exclude(status=new_status).update(status=new_status, modified_at=now)
+            if updated != len(changed_pks):
+                # Rolls back the transaction: neither the statuses nor the history
+                # entries (and mails) of the rows read are written.
+                raise TransitionError("%d of the %d resources changed while moving them "
+                                      "to %s." % (len(changed_pks) - updated,
+                                                  len(changed_pks), new_status))
+
+            # One 'who'/'when' for the whole batch.
+            template = Resource._history_make_entry([])
+            entries = {
+                res['id']: dict(template, what=[{"field": "status",
+                                                 "prev": res['prev_status'],
+                                                 "cur": new_status}])
+                for res in result.changed
+            }
+            backend = get_history_backend(Resource.history__backend)
+            backend.bulk_record(Resource, entries, scope_by_pk=scope_by_pk)
+            transaction.on_commit(
+                lambda: history_bulk_updated.send(sender=Resource, pks=changed_pks))
+
+    logger.info("%d resources moved to %s by %s. unchanged:%d rejected:%d" % (
+        len(result.changed), new_status, user.get_username(), len(result.unchanged),
+        len(result.rejected)))
+    return result
@@ -7,6 +7,8 @@ from .views import (
     ResourceUpdateView,
     ResourceDeleteView,
     ResourceHistoryView,
+    ResourceAuditLogView,
+    ResourceImportView,
 )
 
 app_name = 'Resource'
@@ -14,11 +16,17 @@ app_name = 'Resource'
 urlpatterns = [
     path('<int:pk>/', ResourceDetailView.as_view(), name='resource-detail'),
     path('new/', ResourceCreateView.as_view(), name='resource-create'),
+    path('import/', ResourceImportView.as_view(), name='resource-import'),
     path('<int:pk>/update/', ResourceUpdateView.as_view(), name='resource-update'),
     path('<int:pk>/delete/', ResourceDeleteView.as_view(), name='resource-delete'),
     path('<int:pk>/history/', ResourceHistoryView.as_view(), name='resource-history'),
     path('<int:pk>/acknowledge', ackResource, name='acknowledge_resource'),
     path('<int:pk>/deny', denyResource, name='deny_resource'),
     path('list/', views.resources_list, name='resources-list'),
+    path('export/', views.export_resources, name='resources-export'),
+    path('bulk-status/', views.bulkChangeStatus, name='bulk-status'),
+    path('bulk-status.json', views.bulk_status_json, name='bulk-status-json'),
+    path('audit/', ResourceAuditLogView.as_view(), name='audit-log'),
+    path('audit.json', views.audit_log_json, name='audit-log-json'),
 ]
 
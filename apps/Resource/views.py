@@ -1,5 +1,5 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
 
 # For the resource update view
 from django.contrib.auth import get_user_model  # Current user model
@@ -9,11 +9,14 @@ from django.shortcuts import get_object_or_404, redirect
 from haystack.generic_views import SearchView
 from haystack.query import SearchQuerySet
 from haystack.forms import SearchForm
+from django.utils.http import urlencode
 # Imports for autocomplete
 import simplejson as json
+from apps.Search.autocomplete import get_autocomplete_engine
+from apps.Search.result_cache import CachedSearchResults
 
 # Imports for CRUD views
-from .forms import ResourceDetailForm
+from .forms import ResourceDetailForm, ResourceSearchForm
 from .models import Resource
 from django.views.generic import (
     CreateView,
@@ -25,19 +28,28 @@ from apps.Users.mixin import UserHasAccessToResourceMixin
 
 # Imports required for Mail
 from django.core import mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
 from django.core.mail import EmailMessage
+from django.db import transaction
+from apps.Mail import compiled, digest
 from django.conf import settings
 from django.contrib.sites.models import Site
 
 # imports required for acknowledge and deny views
 from django.http import HttpResponseForbidden, Http404
 from django.contrib.auth.decorators import login_required
-
-from .forms import ResourceCreateForm, ResourceUpdateForm
+from django.views.decorators.http import require_POST
+from django.contrib import messages
+from django.template.defaultfilters import pluralize
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .forms import ResourceCreateForm, ResourceUpdateForm, AuditLogFilterForm
+from .forms import ResourceImportForm
+from . import exporter, importer, summary, transitions
 from django.views import View
 from apps.Users.middleware import get_current_org
+from apps.ChangeHistory.models import FieldChange
 
 # Logging
 import logging
@@ -64,7 +76,143 @@ class ResourceSearchView(LoginRequiredMixin, SearchView):
     """
 
     template_name = 'search/search.html'
-    form_class = SearchForm  # Use ModelSeachForm if we need to restrict search to only few models
+    # Text search along with the filters on status, device admin, current user and team.
+    form_class = ResourceSearchForm
+    # The results are rendered from the fields stored in the index (see
+    # search_indexes.py). Do not load the Resources of every page from the DB.
+    load_all = False
+
+    # Labels of the facets displayed, in the order displayed.
+    facet_labels = [
+        ('status', 'Status'),
+        ('device_admin_id', 'Device Admin'),
+        ('current_user_id', 'Current User'),
+        ('team_ids', 'Team'),
+    ]
+    # Max number of values displayed per facet, most frequent first.
+    facet_limit = 10
+
+    # Results of the page of the current search. See paginate_queryset().
+    search_results = None
+    # Filters selected in the form. {field name: [values]}
+    search_filters = {}
+    # Whether the form was valid. Only the results of a valid form are cached.
+    search_form_valid = False
+
+    def get_form_kwargs(self):
+        kwargs = super(ResourceSearchView, self).get_form_kwargs()
+        # Only the users and the teams of the Org can be filtered on.
+        kwargs['org'] = get_current_org()
+        return kwargs
+
+    def form_valid(self, form):
+        self.search_filters = form.get_filters()
+        self.search_form_valid = True
+        return super(ResourceSearchView, self).form_valid(form)
+
+    def form_invalid(self, form):
+        # Eg: A user of another Org passed as a filter. No results, instead of the
+        # unfiltered results SearchView shows. Not cached: the invalid values are
+        # missing from the cleaned data, which would make it the key of another search.
+        context = self.get_context_data(**{
+            self.form_name: form,
+            'query': form.cleaned_data.get(self.search_field) or '',
+            'object_list': form.no_query_found(),
+        })
+        return self.render_to_response(context)
+
+    def paginate_queryset(self, queryset, page_size):
+        # The page of results, its hit count, the facet counts and the spelling
+        # suggestion are fetched in one go and cached per Org (see
+        # apps/Search/result_cache.py).
+        cur_user_org = get_current_org()
+        query = self.request.GET.get(self.search_field, '')
+        page = self.kwargs.get(self.page_kwarg) or \
+            self.request.GET.get(self.page_kwarg) or 1
+        try:
+            page_number = int(page)
+        except ValueError:
+            page_number = 0  # 'last' or invalid. Left to the paginator.
+        if self.search_form_valid and cur_user_org is not None and \
+                (query.strip() or self.search_filters) and page_number > 0:
+            queryset = self.search_results = CachedSearchResults(
+                queryset, cur_user_org.id, query, page_number, page_size)
+        return super(ResourceSearchView, self).paginate_queryset(queryset, page_size)
+
+    def get_facets(self, query, facet_counts):
+        """Returns the facets of the results to be displayed along with them. Selecting a
+        value of a facet adds it to the filters, selecting it again removes it.
+
+        Arguments:
+            query {str} -- Text searched for.
+            facet_counts {dict} -- {field name: [(value, count), ...]}, as returned by
+                                   SearchQuerySet.facet_counts()['fields'].
+
+        Returns:
+            tuple -- (facets, filter_chips). facets is a list of {'label', 'values'} with
+                     values a list of {'label', 'count', 'url', 'selected'}. filter_chips
+                     is a list of {'label', 'remove_url'} of the filters selected.
+        """
+        cur_user_org = get_current_org()
+        counts = {name: facet_counts.get(name, []) for name, _ in self.facet_labels}
+
+        # Values of each facet displayed: the most frequent ones and the ones selected.
+        values = {}
+        for name, _ in self.facet_labels:
+            selected = [str(value) for value in self.search_filters.get(name, [])]
+            shown = [(str(value), count) for value, count in counts[name]
+                     if count][:self.facet_limit]
+            shown_values = {value for value, _ in shown}
+            shown.extend((value, 0) for value in selected if value not in shown_values)
+            values[name] = shown
+
+        # Labels of the values. One query for the users and one for the teams.
+        user_ids = {int(value) for name in ('device_admin_id', 'current_user_id')
+                    for value, _ in values[name] if value.isdigit()}
+        team_ids = {int(value) for value, _ in values['team_ids'] if value.isdigit()}
+        labels = {
+            'status': dict(Resource.RES_STATUS_CHOICES),
+            'device_admin_id': {}, 'current_user_id': {}, 'team_ids': {},
+        }
+        if cur_user_org is not None and user_ids:
+            user_names = {str(pk): name for pk, name in
+                          cur_user_org.user_set.filter(pk__in=user_ids)
+                          .values_list('pk', 'name')}
+            labels['device_admin_id'] = labels['current_user_id'] = user_names
+        if cur_user_org is not None and team_ids:
+            labels['team_ids'] = {str(pk): name for pk, name in
+                                  cur_user_org.team_set.filter(pk__in=team_ids)
+                                  .values_list('pk', 'team_name')}
+
+        facets, filter_chips = [], []
+        for name, facet_label in self.facet_labels:
+            selected = [str(value) for value in self.search_filters.get(name, [])]
+            facet_values = []
+            for value, count in values[name]:
+                label = labels[name].get(value)
+                if label is None:
+                    # Eg: A user who left the Org since the Resource was indexed.
+                    continue
+                is_selected = value in selected
+                toggled = [v for v in selected if v != value] if is_selected else \
+                    selected + [value]
+                url = '?' + self.get_search_querystring(query, {**self.search_filters,
+                                                                 name: toggled})
+                facet_values.append({'label': label, 'count': count, 'url': url,
+                                     'selected': is_selected})
+                if is_selected:
+                    filter_chips.append({'label': '%s: %s' % (facet_label, label),
+                                         'remove_url': url})
+            if facet_values:
+                facets.append({'label': facet_label, 'values': facet_values})
+        return facets, filter_chips
+
+    def get_search_querystring(self, query, filters):
+        """Returns the query string of the search for the text and the filters passed."""
+        params = [(self.search_field, query)] if query else []
+        params.extend((name, value) for name, _ in self.facet_labels
+                      for value in filters.get(name, []))
+        return urlencode(params)
 
     def get_context_data(self, *args, **kwargs):
         context = super(ResourceSearchView, self).get_context_data(*args, **kwargs)
@@ -77,12 +225,23 @@ class ResourceSearchView(LoginRequiredMixin, SearchView):
         # It does not seem to be correcting words which are not in the db and may not
         # correct always. In such a case it returns the query word itself. So Only add if
         # we received a different suggestion
-
-        spell_suggestion = self.get_form().get_suggestion()
-        query = context['query']
-        if spell_suggestion is not None and query.casefold() != spell_suggestion.casefold():
-            context['spell_suggestion'] = spell_suggestion  # Can this ever be a list?
-
+        # Suggestions are only asked for when the query has few hits (see
+        # SEARCH_SPELLING_SUGGESTION_MAX_HITS). They come along with the results.
+
+        if self.search_results is not None:
+            spell_suggestion = self.search_results.spelling_suggestion()
+            query = context['query']
+            if spell_suggestion is not None and \
+                    query.casefold() != spell_suggestion.casefold():
+                context['spell_suggestion'] = spell_suggestion  # Can this ever be a list?
+
+            # The facet counts come along with the results too.
+            context['facets'], context['filter_chips'] = self.get_facets(
+                context['query'] or '', self.search_results.facet_counts())
+
+        context['search_filters'] = self.search_filters
+        context['search_querystring'] = self.get_search_querystring(
+            context.get('query') or '', self.search_filters)
         return context
 
     def get_queryset(self):
@@ -101,6 +260,10 @@ class ResourceSearchView(LoginRequiredMixin, SearchView):
             queryset = SearchQuerySet().none()
         else:
             queryset = SearchQuerySet().filter(org_id=cur_user_org.id)
+            # The counts of the values of the fields which can be filtered on are
+            # returned along with the results, in the same query.
+            for name, _ in self.facet_labels:
+                queryset = queryset.facet(name, size=self.facet_limit)
         return queryset
 
 
@@ -119,13 +282,11 @@ def autocomplete(request):
     cur_user_org = get_current_org()
 
     if cur_user_org is None:
-        sqs_org = SearchQuerySet().none()
+        suggestions = []
     else:
-        sqs_org = SearchQuerySet().filter(org_id=cur_user_org.id)
-
-    sqs = sqs_org.autocomplete(device_name_auto=request.GET.get('query', ''))
-    # TODO: [:5] at the end of the above sqs statement to display only top 5
-    suggestions = [result.object.name for result in sqs]
+        # See apps/Search/autocomplete.py for the engines.
+        suggestions = get_autocomplete_engine().suggest(cur_user_org.id,
+                                                        request.GET.get('query', ''))
     # Make sure you return a JSON object, not a bare list.
     # Otherwise, you could be vulnerable to an XSS attack.
     the_data = json.dumps({
@@ -156,13 +317,15 @@ class ResourceHistoryView(LoginRequiredMixin, UserHasAccessToResourceMixin, View
     """ View to handle showing the history of changes to a resource"""
 
     def get(self, request, *args, pk, **kwargs):
-        resource = get_object_or_404(Resource, pk=pk)
+        # The history is deferred by default. Load it along with the resource.
+        resource = get_object_or_404(Resource.objects.with_history(), pk=pk)
         # Process the history records before showing them. We perform the following
         # 1) Capitalize and replaces '_' with space like labels so that they look good.
         # 2) Remove the 'previous_user' entry as it redundant. 'current_user' is enough
         #    to see how the resource moved. 'previous_user' was only required to handle
         #    sending 3 way mails when device in disputed state.
-        resource_history = resource.history
+        # FK ids in the history are resolved to names in bulk for all the entries.
+        resource_history = Resource.resolve_history(resource.get_history())
         for resEntry in resource_history:
             listOfChangeDict = resEntry['what']
             for changeEntryDict in list(listOfChangeDict):
@@ -181,6 +344,128 @@ class ResourceHistoryView(LoginRequiredMixin, UserHasAccessToResourceMixin, View
         return render(request, 'Resource/resource-history.html', context=context)
 
 
+# Number of changes shown per page of the audit log and the max a JSON client may ask for.
+AUDIT_LOG_PAGE_SIZE = 50
+AUDIT_LOG_MAX_PAGE_SIZE = 200
+
+
+def get_audit_log_page(org, params, page_size=AUDIT_LOG_PAGE_SIZE):
+    """Returns a page of the changes made to the resources of the org filtered as per
+    the GET parameters passed. The changes are read from the indexed FieldChange table
+    and paginated using a cursor so that every page costs the same irrespective of the
+    number of changes recorded for the org.
+
+    Arguments:
+        org {apps.Organization.models.Org} -- Org whose changes are to be shown.
+        params {QueryDict} -- Filters. See AuditLogFilterForm.
+
+    Keyword Arguments:
+        page_size {int} -- Number of changes in the page.
+
+    Returns:
+        tuple -- (form, records, next_cursor). records is None when the filters are not
+                 valid in which case the form contains the errors.
+    """
+    form = AuditLogFilterForm(params, in_org=org)
+    if not form.is_valid():
+        return form, None, None
+    filters = form.cleaned_data
+
+    changes = FieldChange.objects.for_model(Resource).filter(scope=org.pk)
+    if filters['who']:
+        changes = changes.filter(who=filters['who'])
+    if filters['field']:
+        changes = changes.filter(field=filters['field'])
+    if filters['value']:
+        changes = changes.filter(value=filters['value'])
+    if filters['resource'] is not None:
+        changes = changes.filter(object_id=filters['resource'])
+    if filters['since'] is not None:
+        changes = changes.filter(when__gte=filters['since'])
+    if filters['until'] is not None:
+        changes = changes.filter(when__lte=filters['until'])
+
+    try:
+        rows, next_cursor = changes.page(filters['cursor'] or None, size=page_size)
+    except ValueError:
+        form.add_error('cursor', "Invalid cursor.")
+        return form, None, None
+
+    # Resource names and the users/orgs in the changes are fetched in bulk for the page.
+    names = dict(Resource.objects.filter(pk__in={row.object_id for row in rows})
+                 .values_list('pk', 'name'))
+    resolved_entries = Resource.resolve_history([{"what": [row.change]} for row in rows])
+    records = []
+    for row, entry in zip(rows, resolved_entries):
+        change = entry['what'][0]
+        records.append({
+            'id': row.id,
+            'when': row.when,
+            'who': row.who,
+            'resource_id': row.object_id,
+            'resource_name': names.get(row.object_id),
+            'field': row.field,
+            'prev': change.get('prev'),
+            'cur': change.get('cur'),
+        })
+    return form, records, next_cursor
+
+
+class ResourceAuditLogView(LoginRequiredMixin, View):
+    """View listing the changes made to all the resources of the user's current org
+    with filters on who made the change, when, the field changed and the resource.
+    """
+
+    def get(self, request, *args, **kwargs):
+        cur_user_org = get_current_org()
+        if cur_user_org is None:
+            return HttpResponseForbidden("You need to be part of an Org to view its audit log.")
+
+        form, records, next_cursor = get_audit_log_page(cur_user_org, request.GET)
+        for record in records or []:
+            # Same formatting as the history page.
+            record['field'] = record['field'].capitalize().replace('_', ' ')
+        next_page_query = None
+        if next_cursor is not None:
+            params = request.GET.copy()
+            params['cursor'] = next_cursor
+            next_page_query = params.urlencode()
+
+        context = {'org': cur_user_org, 'form': form, 'records': records,
+                   'next_page_query': next_page_query}
+        return render(request, 'Resource/resource-audit-log.html', context=context)
+
+
+@login_required
+def audit_log_json(request):
+    """JSON version of the ResourceAuditLogView. Accepts the same GET parameters and an
+    optional 'limit'. The 'next_cursor' returned should be passed as the 'cursor'
+    parameter to fetch the next page. It is null on the last page.
+    """
+    cur_user_org = get_current_org()
+    if cur_user_org is None:
+        return HttpResponseForbidden("You need to be part of an Org to view its audit log.")
+
+    try:
+        page_size = int(request.GET.get('limit', AUDIT_LOG_PAGE_SIZE))
+    except ValueError:
+        page_size = AUDIT_LOG_PAGE_SIZE
+    page_size = max(1, min(page_size, AUDIT_LOG_MAX_PAGE_SIZE))
+
+    form, records, next_cursor = get_audit_log_page(cur_user_org, request.GET, page_size)
+    if records is None:
+        return HttpResponse(json.dumps({'errors': form.errors.get_json_data()}), status=400,
+                            content_type='application/json')
+
+    for record in records:
+        record['when'] = record['when'].isoformat()
+    the_data = json.dumps({
+        'results': records,
+        'next_cursor': next_cursor,
+    })
+    return HttpResponse(the_data, content_type='application/json')
+
+
 class ResourceCreateView(LoginRequiredMixin, View):
     """View to handle Resource Creation.
 
@@ -221,6 +506,83 @@ class ResourceCreateView(LoginRequiredMixin, View):
             return render(request, 'Resource/resource-new.html', context=context)
 
 
+@login_required
+def export_resources(request):
+    """Streams all the resources of the current org as a file. GET parameters:
+    'format' -- csv (default), ndjson or xlsx.
+    'include' -- Optional columns to add. Comma separated names from
+                 exporter.OPTIONAL_COLUMNS (Eg: 'history,status_age').
+    """
+    current_org = get_current_org()
+    if current_org is None:
+        raise Http404("You are not part of any Org.")
+
+    file_format = request.GET.get('format', exporter.FORMAT_CSV)
+    include = [name for name in request.GET.get('include', '').split(',') if name]
+    if file_format not in exporter.FORMATS or \
+            any(name not in exporter.OPTIONAL_COLUMNS for name in include):
+        return HttpResponse("Invalid format or columns.", status=400)
+    if file_format == exporter.FORMAT_XLSX and exporter.xlsxwriter is None:
+        return HttpResponse("XLSX export is not available.", status=501)
+
+    columns = exporter.get_columns(include)
+    rows = exporter.iter_resource_rows(current_org, include=include)
+    filename = "%s-resources-%s.%s" % (slugify(current_org.get_name()),
+                                       timezone.now().strftime('%Y%m%d'), file_format)
+    logger.info("User %s exporting the resources of %s as %s" %
+                (request.user.get_username(), current_org.get_name(), file_format))
+
+    if file_format == exporter.FORMAT_XLSX:
+        return FileResponse(exporter.write_xlsx(rows, columns), as_attachment=True,
+                            filename=filename,
+                            content_type=exporter.CONTENT_TYPES[file_format])
+
+    if file_format == exporter.FORMAT_CSV:
+        content = exporter.iter_csv(rows, columns)
+    else:
+        content = exporter.iter_ndjson(rows, columns)
+    response = StreamingHttpResponse(content,
+                                     content_type=exporter.CONTENT_TYPES[file_format])
+    response['Content-Disposition'] = 'attachment; filename="%s"' % (filename,)
+    return response
+
+
+# Max number of skipped rows listed after an import. The rest are only counted.
+IMPORT_ERRORS_SHOWN = 100
+
+
+class ResourceImportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """View to create many Resources at once by uploading a CSV / NDJSON file. Only the
+    admin of the Org can import. See importer.py for the format of the file.
+    """
+
+    # Implement the function called by UserPassesTestMixin.
+    def test_func(self):
+        current_org = get_current_org()
+        if current_org is not None and current_org.admin_id == self.request.user.pk:
+            return True
+        logger.warning("User %s DENIED access to the import of resources as not an admin "
+                       "of the Org." % (self.request.user,))
+        return False
+
+    def get(self, request, *args, **kwargs):
+        context = {'form': ResourceImportForm(), 'org': get_current_org()}
+        return render(request, 'Resource/resource-import.html', context=context)
+
+    def post(self, request, *args, **kwargs):
+        current_org = get_current_org()
+        form = ResourceImportForm(request.POST, request.FILES)
+        context = {'form': form, 'org': current_org}
+        if form.is_valid():
+            uploaded = form.cleaned_data['file']
+            result = importer.import_resources(uploaded.file, current_org,
+                                               form.cleaned_data['format'])
+            context['result'] = result
+            context['errors'] = result.errors[:IMPORT_ERRORS_SHOWN]
+            context['form'] = ResourceImportForm()
+        return render(request, 'Resource/resource-import.html', context=context)
+
+
 # TODO: "Only an Admin can have update rights of fields other than current user".
 class ResourceUpdateView(LoginRequiredMixin, UserHasAccessToResourceMixin, View):
 
@@ -264,29 +626,26 @@ class ResourceUpdateView(LoginRequiredMixin, UserHasAccessToResourceMixin, View)
                 resource_obj.status = Resource.RES_ASSIGNED
                 hasOwnershipChanged = True
 
-            # Finally save the object into the DB
-            resource_obj.save()
-
-            # If there was a reassignment, send a mail to the new user.
-            if hasOwnershipChanged:
-                # Form the ack and deny links by fetching the relative portion from the resource
-                ack_url = self.request.build_absolute_uri(resource_obj.get_acknowledge_url())
-                deny_url = self.request.build_absolute_uri(resource_obj.get_deny_url())
-
-                # TODO: The from_email should ideally be read from common settings.
-                ret = sendAssignmentMail(from_email=settings.EMAIL_FROM_ADDRESS,
-                        to_email=resource_obj.current_user.email,
-                        cur_user=resource_obj.current_user.get_username(),
-                        prev_user=resource_obj.previous_user.get_username(),
-                        device_name=resource_obj.name, ack_link=ack_url,
-                        decline_link=deny_url)
-
-                if ret == 0:
-                    # Sending the email failed. Log an error
-                    logger.error("Sending an assignment email failed. Device:%s cur_user:%s cur_user_email:%s prev_user:%s"
-                        % (resource_obj.name, resource_obj.current_user.get_name(),
-                          resource_obj.current_user.get_email(),
-                          resource_obj.previous_user.get_name()))
+            # Finally save the object into the DB. The mail is queued in the same
+            # transaction and sent by the mail worker.
+            with transaction.atomic():
+                resource_obj.save()
+
+                # If there was a reassignment, send a mail to the new user.
+                if hasOwnershipChanged:
+                    # Form the ack and deny links by fetching the relative portion from
+                    # the resource
+                    ack_url = self.request.build_absolute_uri(
+                        resource_obj.get_acknowledge_url())
+                    deny_url = self.request.build_absolute_uri(resource_obj.get_deny_url())
+
+                    # TODO: The from_email should ideally be read from common settings.
+                    sendAssignmentMail(from_email=settings.EMAIL_FROM_ADDRESS,
+                            to_email=resource_obj.current_user.email,
+                            cur_user=resource_obj.current_user.get_username(),
+                            prev_user=resource_obj.previous_user.get_username(),
+                            device_name=resource_obj.name, ack_link=ack_url,
+                            decline_link=deny_url, org_id=resource_obj.org_id)
 
             # On successfull update, redirect to the detail page.
             return redirect('Resource:resource-detail',pk=resource_obj.pk)
@@ -314,9 +673,16 @@ class ResourceDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         return False
 
 
+# Kinds of the notifications mailed in the digests. See apps/Mail/digest.py
+NOTIFY_ASSIGNED = 'assigned'
+NOTIFY_DISPUTE = 'dispute'
+
+
 def sendAssignmentMail(from_email, to_email, cur_user, prev_user,
-                       device_name, ack_link, decline_link):
-    """API to send an email when the device is reassigned.
+                       device_name, ack_link, decline_link, org_id=None):
+    """API to send an email when the device is reassigned. The assignment is recorded in
+    the current transaction and mailed in the next digest of the user, along with the
+    other devices assigned to him meanwhile. See apps/Mail/digest.py
 
     Arguments:
         from_email {str} -- Email id to be shown in from section Eg: no-reply<no-reply@trackzilla.com>
@@ -327,61 +693,245 @@ def sendAssignmentMail(from_email, to_email, cur_user, prev_user,
         ack_link {str} -- Link to acknowledge the assignment.
         decline_link {str} -- Link to decline the assignment.
 
+    Keyword Arguments:
+        org_id {int} -- id of the Org of the device. Its digest settings apply.
+                        (default: {None})
+
     Returns:
-        int -- 1 for success and 0 for failure. (value returned by send_mail api)
+        int -- Number of notifications recorded.
     """
-
-    subject = device_name + " asssigned"
-
     context = {'cur_user': cur_user, 'device_name': device_name,
                'prev_user': prev_user, 'ack_link': ack_link,
                'decline_link': decline_link,
                }
-    html_message = render_to_string('mail/assigned.html', context )
-    plain_message = strip_tags(html_message)
+    return digest.notify(render_notification_digest, NOTIFY_ASSIGNED, [to_email],
+                         context, org_id=org_id, from_email=from_email)
 
-    ret = mail.send_mail(subject, plain_message, from_email, [to_email], html_message=html_message)
-    # If the above mail is causing issues, use the below to send html only email
-    # hmsg = EmailMessage(subject, html_message, from_email, [to])
-    # hmsg.content_subtype = "html"  # Main content is now text/html
-    # ret = hmsg.send()
 
-    return ret
+def render_assignment_mail(context):
+    """Renders the mail of a single assignment. Called by the mail worker.
+
+    Returns:
+        tuple -- (subject, plain text body, html body)
+    """
+    subject = context['device_name'] + " asssigned"
+    plain_message, html_message = compiled.render_mail('mail/assigned.html', context)
+    return subject, plain_message, html_message
+
 
 def sendDisputeMail( from_email, to_email_list, cur_user, prev_user,
-                      device_admin, device_name, device_url ):
-    """API to send an email when the device is in disputed state.
+                      device_admin, device_name, device_url, org_id=None ):
+    """API to send an email when the device is in disputed state. The dispute is recorded
+    in the current transaction and mailed in the next digest of each recipient.
 
     Arguments:
         from_email {str} -- Email id to be shown in from section Eg: no-reply<no-reply@trackzilla.com>
         to_email_list {list(str)} -- List of Email id strs to whom mail should be sent
         cur_user {str} -- Current device user's name or email id
         prev_user {str} -- Previous device user's name or email id
-        device_admin {str} -- Administrator of the device - Name or email id 
+        device_admin {str} -- Administrator of the device - Name or email id
         device_name {str} -- Name of the device
         device_url {str} -- Link which will mostly send the detail or update view of the resource.
 
+    Keyword Arguments:
+        org_id {int} -- id of the Org of the device. Its digest settings apply.
+                        (default: {None})
+
     Returns:
-        int -- 1 for success and 0 for failure. (value returned by send_mail api)
+        int -- Number of notifications recorded.
     """
-
-    subject =  device_name + " in dispute."
-
     context = { 'cur_user':cur_user, 'device_name': device_name,
                 'prev_user': prev_user, 'device_url': device_url,
                 'device_admin': device_admin,
               }
-    html_message = render_to_string('mail/dispute.html', context )
-    plain_message = strip_tags(html_message)
+    return digest.notify(render_notification_digest, NOTIFY_DISPUTE, to_email_list,
+                         context, org_id=org_id, from_email=from_email)
 
-    ret = mail.send_mail(subject, plain_message, from_email, to_email_list, html_message=html_message)
-    # If the above mail is causing issues, use the below to send html only email
-    # hmsg = EmailMessage(subject, html_message, from_email, [to])
-    # hmsg.content_subtype = "html"  # Main content is now text/html
-    # ret = hmsg.send()
 
-    return ret
+def render_dispute_mail(context):
+    """Renders the mail of a single dispute. Called by the mail worker.
+
+    Returns:
+        tuple -- (subject, plain text body, html body)
+    """
+    subject = context['device_name'] + " in dispute."
+    plain_message, html_message = compiled.render_mail('mail/dispute.html', context)
+    return subject, plain_message, html_message
+
+
+# Marks the place of the device rows in the rendered mail/digest.html.
+DEVICE_ROWS_PLACEHOLDER = '__DEVICE_ROWS__'
+
+
+def sendBulkDisputeMail(from_email, disputed, disputed_by, request):
+    """Sends the mails for resources disputed together. Instead of one mail per device,
+    each person involved (the user disputing, the device admins and the previous users)
+    receives one digest listing all the disputed devices which concern him. The disputes
+    are recorded with one INSERT, in the current transaction. See apps/Mail/digest.py
+
+    Arguments:
+        from_email {str} -- Email id to be shown in from section.
+        disputed {list} -- 'changed' list of the BulkTransitionResult.
+        disputed_by {User} -- Current user of the devices who disputed them.
+        request {HttpRequest} -- Used to build the absolute links of the devices.
+
+    Returns:
+        int -- Number of notifications recorded (one per device and recipient).
+    """
+    # All the users involved are fetched with one query.
+    user_ids = set()
+    for res in disputed:
+        user_ids.add(res['device_admin_id'])
+        if res['previous_user_id'] is not None:
+            user_ids.add(res['previous_user_id'])
+    users = User.objects.in_bulk(user_ids - {disputed_by.pk})
+    users[disputed_by.pk] = disputed_by
+
+    cur_user = disputed_by.get_username()
+    events = []
+    for res in disputed:
+        prev_user = users.get(res['previous_user_id'])
+        context = {
+            'cur_user': cur_user,
+            'device_name': res['name'],
+            'device_url': request.build_absolute_uri(
+                reverse('Resource:resource-detail', kwargs={'pk': res['id']})),
+            # Show as "None" when the resource was never reassigned.
+            'prev_user': prev_user.get_username() if prev_user is not None else 'None',
+            'device_admin': users[res['device_admin_id']].get_username(),
+        }
+        recipients = [disputed_by.email, users[res['device_admin_id']].email]
+        if prev_user is not None:
+            recipients.append(prev_user.email)
+        events.append((NOTIFY_DISPUTE, recipients, context))
+    return digest.notify_many(render_notification_digest, events,
+                              org_id=disputed_by.org_id, from_email=from_email)
+
+
+def _render_with_rows(template_name, context, rows_template_name, rows_context):
+    """Renders a mail template in which the rendered rows template is put in place of
+    {{ device_rows_placeholder }}.
+
+    Returns:
+        tuple -- (plain text body, html body)
+    """
+    context = dict(context, device_rows_placeholder=DEVICE_ROWS_PLACEHOLDER)
+    bodies = compiled.render_mail(template_name, context)
+    rows = compiled.render_mail(rows_template_name, rows_context)
+    return tuple(body.replace(DEVICE_ROWS_PLACEHOLDER, rows_body, 1)
+                 for body, rows_body in zip(bodies, rows))
+
+
+def render_notification_digest(context):
+    """Renders the digest of the notifications of a recipient. Called by the mail worker.
+    A single notification is mailed as before the digests.
+
+    Returns:
+        tuple -- (subject, plain text body, html body)
+    """
+    events = context['events']
+    if len(events) == 1:
+        renderer = {NOTIFY_ASSIGNED: render_assignment_mail,
+                    NOTIFY_DISPUTE: render_dispute_mail}[events[0]['kind']]
+        return renderer(events[0]['context'])
+
+    assigned = [event['context'] for event in events if event['kind'] == NOTIFY_ASSIGNED]
+    disputed = [event['context'] for event in events if event['kind'] == NOTIFY_DISPUTE]
+    changes = []
+    if assigned:
+        changes.append("%d device%s assigned" % (len(assigned), pluralize(len(assigned))))
+    if disputed:
+        changes.append("%d device%s in dispute" % (len(disputed),
+                                                   pluralize(len(disputed))))
+    subject = ", ".join(changes) + "."
+    return (subject,) + _render_with_rows(
+        'mail/digest.html', {'cur_user': assigned[0]['cur_user'] if assigned else None,
+                             'dispute_count': len(disputed)},
+        'mail/digest_rows.html', {'assigned': assigned, 'disputed': disputed})
+
+
+# Actions accepted by the bulk status views and the status they move the resources to.
+BULK_ACTIONS = {
+    'ack': Resource.RES_ACKNOWLEDGED,
+    'dispute': Resource.RES_DISPUTE,
+}
+
+
+def _bulk_change_status(request, action, id_list):
+    """Common part of the bulk status views. Returns the BulkTransitionResult."""
+    new_status = BULK_ACTIONS[action]
+    # The mails are queued in the transaction of the change.
+    with transaction.atomic():
+        result = transitions.bulk_change_status(id_list, request.user, new_status)
+        if new_status == Resource.RES_DISPUTE and result.changed:
+            recorded_count = sendBulkDisputeMail(settings.EMAIL_FROM_ADDRESS,
+                                                 result.changed, request.user, request)
+            logger.info("Recorded %d dispute notifications for %d devices disputed by "
+                        "%s" % (recorded_count, len(result.changed),
+                                request.user.get_username()))
+    return result
+
+
+def _parse_id_list(values):
+    """Converts the list of ids received into ints. Returns None if any is invalid."""
+    try:
+        id_list = [int(value) for value in values]
+    except (TypeError, ValueError):
+        return None
+    if len(id_list) > transitions.BULK_MAX_RESOURCES:
+        return None
+    return id_list
+
+
+@login_required
+@require_POST
+def bulkChangeStatus(request):
+    """Acknowledges or disputes all the resources selected in the home page at once.
+    Expects the POST parameters 'action' ('ack' or 'dispute') and 'resources' (one per
+    selected resource id). Redirects back to the home page with a summary message.
+    """
+    action = request.POST.get('action')
+    id_list = _parse_id_list(request.POST.getlist('resources'))
+    if action not in BULK_ACTIONS or id_list is None:
+        messages.error(request, "Invalid selection. Please try again.")
+        return redirect('home')
+    if not id_list:
+        messages.warning(request, "Select the devices first.")
+        return redirect('home')
+
+    result = _bulk_change_status(request, action, id_list)
+    verb = 'acknowledged' if action == 'ack' else 'disputed'
+    messages.success(request, "%d device%s %s." % (
+        len(result.changed), pluralize(len(result.changed)), verb))
+    if result.rejected:
+        rejected_count = len(result.rejected)
+        messages.warning(request, "%d device%s could not be %s as %s not assigned to "
+                                  "you." % (rejected_count, pluralize(rejected_count), verb,
+                                            pluralize(rejected_count, 'it is,they are')))
+    return redirect('home')
+
+
+@login_required
+@require_POST
+def bulk_status_json(request):
+    """JSON version of bulkChangeStatus. Expects a JSON body of the form
+    {"action": "ack"|"dispute", "ids": [<resource id>, ...]} and returns the ids which
+    were changed, were already in that status and were rejected.
+    """
+    try:
+        body = json.loads(request.body.decode('utf-8'))
+        action = body.get('action')
+        id_list = _parse_id_list(body.get('ids', []))
+    except (ValueError, AttributeError):
+        action, id_list = None, None
+    if action not in BULK_ACTIONS or id_list is None:
+        the_data = json.dumps({'error': "Expected {\"action\": \"ack\"|\"dispute\", "
+                                        "\"ids\": [...]} with at most %d ids." %
+                                        (transitions.BULK_MAX_RESOURCES,)})
+        return HttpResponse(the_data, status=400, content_type='application/json')
 
+    result = _bulk_change_status(request, action, id_list)
+    return HttpResponse(json.dumps(result.as_dict()), content_type='application/json')
 
 
 #TODO: include additional check that the resource belongs to his org.
@@ -389,6 +939,7 @@ def sendDisputeMail( from_email, to_email_list, cur_user, prev_user,
 def ackResource(request, pk):
     """This view changes the state of the resource to acknowledged. Before doing so it
        checks if the user trying to acknowledge the resource has the resource in his name.
+       The check and the change are made atomically. See transitions.py
 
     Arguments:
         request {} -- Standard Django request dictionary which has all the request details
@@ -403,19 +954,16 @@ def ackResource(request, pk):
     # Fetch the currently logged in user
     loggedInUser = request.user
     try:
-        resBeingAckd = Resource.objects.get(id=pk)   #TODO: use select_related for better performance to fetch user info
-    except Resource.DoesNotExist:
+        resBeingAckd, changed = transitions.change_status(pk, loggedInUser,
+                                                          Resource.RES_ACKNOWLEDGED)
+    except transitions.ResourceNotFound:
         raise Http404("Resource with pk %d doesnot exist." % (pk)) # TODO: Use template for this.
-
-    # The resource exists. Allow only the current owner to Ack it.
-    if resBeingAckd.current_user.id != loggedInUser.id:
+    except transitions.NotResourceOwner:
+        # Allow only the current owner to Ack it.
         return HttpResponseForbidden("<h1> Http 403: Trying to ack a resource which you do not own!! </h1>")
         # TODO: Use a better template for the above message.
 
-    # Check the status and ack it it not ackd already.
-    if resBeingAckd.status != Resource.RES_ACKNOWLEDGED:
-        resBeingAckd.status = Resource.RES_ACKNOWLEDGED
-        resBeingAckd.save()
+    if changed:
         logger.info('Device %s ACKd by user %s'% (resBeingAckd.name, loggedInUser.get_username()))
     else:
         logger.info('Device %s already in ACKd state. user %s'% (resBeingAckd.name, loggedInUser.get_username()))
@@ -426,11 +974,35 @@ def ackResource(request, pk):
     # Return a success message that the resource was Acknowledged
     return render(request, template_name='Resource/ack.html', context=context )
 
+
+def _queue_dispute_mail(request, res):
+    """Records the dispute to be mailed to the current user, the previous user and the
+    admin of the resource. See sendDisputeMail().
+    """
+    to_email_list = [res.current_user.email, res.device_admin.email]
+    if res.previous_user is not None:
+        to_email_list.append(res.previous_user.email)
+        prev_user_uname = res.previous_user.get_username()
+    else:
+        # Show as "None" when the resource was never reassigned.
+        prev_user_uname = 'None'
+
+    sendDisputeMail(from_email=settings.EMAIL_FROM_ADDRESS,
+            to_email_list=to_email_list,
+            cur_user=res.current_user.get_username(),
+            prev_user=prev_user_uname,
+            device_admin=res.device_admin.get_username(),
+            device_name=res.name,
+            device_url=request.build_absolute_uri(res.get_absolute_url()),
+            org_id=res.org_id)
+
+
 #TODO: include additional check that the resource belongs to his org.
 @login_required
 def denyResource(request, pk):
     """This view changes the state of the resource to disputed. Before doing so it
        checks if the user trying to dispute the resource has the resource in his name.
+       The check and the change are made atomically. See transitions.py
 
     Arguments:
         request {} -- Standard Django request dictionary which has all the request details
@@ -445,66 +1017,42 @@ def denyResource(request, pk):
     # Fetch the currently logged in user
     loggedInUser = request.user
     try:
-        resBeingDenied = Resource.objects.get(id=pk)   #TODO: use select_related for better performance to fetch user info
-    except Resource.DoesNotExist:
+        # The mail is queued in the transaction of the change.
+        with transaction.atomic():
+            # The users are shown in the page and mailed. Fetch them along with the
+            # resource.
+            resBeingDenied, changed = transitions.change_status(
+                pk, loggedInUser, Resource.RES_DISPUTE,
+                related=('current_user', 'device_admin', 'previous_user'))
+            if changed:
+                _queue_dispute_mail(request, resBeingDenied)
+    except transitions.ResourceNotFound:
         raise Http404("Resource with pk %d doesnot exist." % (pk)) # TODO: Use template for this.
-
-    # The resource exists. Allow only the current owner to Ack it.
-    if resBeingDenied.current_user.id != loggedInUser.id:
+    except transitions.NotResourceOwner:
+        # Allow only the current owner to dispute it.
         return HttpResponseForbidden("<h3> Http 403: Trying to ack a resource which you do not own!! </h3>")
         # TODO: Use a better template for the above message.
 
-    # Check the status and dispute it it not disputed already.
-    if resBeingDenied.status != Resource.RES_DISPUTE:
-        resBeingDenied.status = Resource.RES_DISPUTE
-        resBeingDenied.save()
-        logger.info('Device %s disputed by user %s' % (resBeingDenied.name,
-            loggedInUser.get_username()))
-        # Trigger an email to inform users about the dispute.
-        # Email to be sent to Current_user, prev_user and device_admin.
-        url = request.build_absolute_uri(resBeingDenied.get_absolute_url())
-        res = resBeingDenied
-
-        to_email_list = [res.current_user.email, res.device_admin.email]
-        if res.previous_user is not None:
-            to_email_list.append(res.previous_user.email)
-            prev_user_uname = res.previous_user.get_username()
-        else:
-            # When the resource is created and assigned to a user, previous_user is None
-            # as the resource is not yet reassigned.
-            # Show as "None" in such a case.
-            prev_user_uname = 'None'
-
-        ret = sendDisputeMail(from_email=settings.EMAIL_FROM_ADDRESS,
-                to_email_list=to_email_list,
-                cur_user=res.current_user.get_username(),
-                prev_user=prev_user_uname,
-                device_admin=res.device_admin.get_username(),
-                device_name=res.name, device_url=url)
-        if ret == 0:
-            logger.error("Failed to send email for device dispute. Device:%s cur_user:%s prev_user:%s"%
-                (res.name, res.current_user.get_username(), prev_user_uname))
+    res = resBeingDenied
+    # When the resource is created and assigned to a user, previous_user is None
+    # as the resource is not yet reassigned.
+    # Show as "None" in such a case.
+    if res.previous_user is not None:
+        prev_user_uname = res.previous_user.get_username()
     else:
-        logger.info('Device %s already in Disputed state. user %s' % (resBeingDenied.name,
-            loggedInUser.get_username()))
+        prev_user_uname = 'None'
 
-    # In case we try to Deny a device already in Disputed state, prev_user_uname is
-    # unassigned. Assign the variable here
-    if resBeingDenied.previous_user:
-        prev_user_uname = resBeingDenied.previous_user.get_username()
+    if changed:
+        logger.info('Device %s disputed by user %s' % (res.name,
+            loggedInUser.get_username()))
     else:
-        prev_user_uname = "None"
+        logger.info('Device %s already in Disputed state. user %s' % (res.name,
+            loggedInUser.get_username()))
 
-    context = {'cur_user': resBeingDenied.current_user.get_username(),
+    context = {'cur_user': res.current_user.get_username(),
                'prev_user': prev_user_uname,
-               'device_name': resBeingDenied.name,
-               'device_admin': resBeingDenied.device_admin.get_username(), }
-
-              # TODO: previous_user maybe None if this device was never assigned and the
-              # deny url is hit for the device. Handle it.
-              # UPDATE: This has been mostly handled by checking if prev_user is None and
-              # only then accessing the username and email. Showing username as "None" if
-              # previous_user in None.
+               'device_name': res.name,
+               'device_admin': res.device_admin.get_username(), }
 
     # Return a warning message that the resource is now in Disputed state.
     return render(request, template_name='Resource/deny.html', context=context)
@@ -545,8 +1093,7 @@ def send_summary_email(user):
                 'domain_url': domain_url,
                 'user': user}
 
-    html_message = render_to_string('mail/summary.html', context)
-    plain_message = strip_tags(html_message)
+    plain_message, html_message = compiled.render_mail('mail/summary.html', context)
 
     ret = mail.send_mail(subject, plain_message, from_email, [to_email],
                          html_message=html_message)
@@ -563,24 +1110,14 @@ def send_summary_email(user):
 
 
 def send_summary_email_for_all():
-    """Helper API to trigger sending 'send_summary_email' for each user.
-    We should trigger this from a cron job.
+    """Helper API to trigger sending the summary email to each user.
+    We should trigger this from a cron job. Same as 'python manage.py send_summary_mails'
+    with a single process: see summary.py
     """
-    # Variables to keep track of how many emails were sent, skipped and failed.
-    emailSentCount: int = 0
-    emailSkippedCount: int = 0
-    emailFailedCount: int = 0
-
-    for user in User.objects.all():  # User = get_user_model()
-        result = send_summary_email(user)
-        # Update the counter variables
-        if result == 1:
-            emailSentCount += 1
-        elif result == 0:
-            emailFailedCount += 1
-        else:  # result == -1
-            emailSkippedCount += 1
-
-    logger.info("Summary Email sent for all users. Total_users:(%d) Emails_sent:(%d)"
-        " Emails_skipped:(%d) Emails_failed:(%d)" % (User.objects.count(), emailSentCount,
-        emailSkippedCount, emailFailedCount))
+    checkpoint = summary.get_checkpoint(summary.default_run_name())
+    for checkpoint in summary.send_summaries(checkpoint):
+        pass
+
+    logger.info("Summary Email sent for all users. Emails_sent:(%d) Emails_skipped:(%d)"
+        " Emails_failed:(%d) Emails_queued:(%d)" % (checkpoint.sent, checkpoint.skipped,
+        checkpoint.failed, checkpoint.queued))
@@ -0,0 +1,276 @@
+"""Engines answering the autocomplete suggestions of the search box.
+
+Every keystroke in the search box asks for suggestions, hence the engine is pluggable
+using the setting SEARCH_AUTOCOMPLETE_ENGINE:
+
+SearchIndexAutocompleteEngine -- The default. An EdgeNgram query on the search index
+                                 (Elasticsearch) per request.
+LocalPrefixAutocompleteEngine -- A sorted array of the words of the device names of an
+                                 Org held in the memory of the worker process. Built
+                                 lazily with one query the first time the Org asks for
+                                 suggestions and answered with a binary search after.
+
+Both suggest the names of which every word of the query is the prefix of some word,
+Eg: 'lat 54' suggests 'Dell Latitude 5490'.
+
+The local indexes are invalidated using a generation number per Org kept in the Django
+cache and bumped whenever a Resource of the Org is saved, deleted or updated in bulk.
+With the default (per process) cache, changes made by other processes are only seen
+once the local index is older than SEARCH_AUTOCOMPLETE_LOCAL_MAX_AGE seconds. Configure
+a shared cache (memcached / redis) in CACHES to see them immediately.
+
+The memory used per process is bounded by SEARCH_AUTOCOMPLETE_LOCAL_MAX_ENTRIES, the
+total number of words held across the Orgs. The least recently used Orgs are evicted
+first.
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import heapq
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from haystack.query import SearchQuerySet
+
+from apps.ChangeHistory.signals import history_bulk_updated
+from apps.Resource.models import Resource
+
+import logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUTOCOMPLETE_ENGINE = 'apps.Search.autocomplete.SearchIndexAutocompleteEngine'
+
+# Max number of suggestions returned.
+MAX_SUGGESTIONS = 10
+
+# Engine instances are cached against their dotted path. The local engine holds the
+# indexes of the Orgs, hence there should only be one instance of it per process.
+_engine_cache = {}
+
+_WORD_RE = re.compile(r'\w+')
+
+# Sorts after every character. prefix + _MAX_CHAR sorts after every word with the prefix.
+_MAX_CHAR = chr(0x10ffff)
+
+
+def get_autocomplete_engine(path=None):
+    """Returns the engine instance corresponding to the dotted path passed.
+
+    Keyword Arguments:
+        path {str} -- Dotted path of the engine class. When None the value of the
+                      setting SEARCH_AUTOCOMPLETE_ENGINE is used. (default: {None})
+
+    Returns:
+        BaseAutocompleteEngine -- Instance of the configured engine.
+    """
+    if path is None:
+        path = getattr(settings, 'SEARCH_AUTOCOMPLETE_ENGINE',
+                       DEFAULT_AUTOCOMPLETE_ENGINE)
+
+    engine = _engine_cache.get(path)
+    if engine is None:
+        engine = import_string(path)()
+        _engine_cache[path] = engine
+    return engine
+
+
+def split_words(text):
+    """Returns the casefolded words of the text."""
+    return _WORD_RE.findall(text.casefold())
+
+
+class BaseAutocompleteEngine:
+    """Interface which all the autocomplete engines implement."""
+
+    def suggest(self, org_id, query, limit=MAX_SUGGESTIONS):
+        """Returns the names of the Resources of the Org matching the query.
+
+        Arguments:
+            org_id {int} -- id of the Org of the user.
+            query {str} -- Text entered by the user.
+
+        Keyword Arguments:
+            limit {int} -- Max number of names returned.
+
+        Returns:
+            list -- Distinct names, best match first.
+        """
+        raise NotImplementedError
+
+    def invalidate(self, org_ids):
+        """Called when the Resources of the Orgs passed have changed."""
+        pass
+
+
+class SearchIndexAutocompleteEngine(BaseAutocompleteEngine):
+    """Autocomplete using the EdgeNgram field 'device_name_auto' of the search index."""
+
+    def suggest(self, org_id, query, limit=MAX_SUGGESTIONS):
+        sqs = SearchQuerySet().filter(org_id=org_id).autocomplete(device_name_auto=query)
+        # Only the stored 'name' of the top hits is fetched, in a single round trip.
+        # Iterating over the whole SearchQuerySet would fetch the hits in batches of 10
+        # and reading result.object would load every Resource from the DB.
+        names = sqs.values_list('name', flat=True)[:limit]
+        # Many devices share a name (Eg: 'Dell Latitude 5490'). Suggest it once.
+        return list(dict.fromkeys(name for name in names if name))
+
+
+class _OrgPrefixIndex:
+    """Words of the distinct device names of an Org, sorted, along with the name each
+    word belongs to. The names are sorted too, hence a lower name id sorts first.
+    """
+
+    def __init__(self, names, generation):
+        self.names = sorted(set(names), key=str.casefold)
+        entries = sorted((word, name_id) for name_id, name in enumerate(self.names)
+                         for word in set(split_words(name)))
+        self.words = [word for word, _ in entries]
+        self.name_ids = array('I', (name_id for _, name_id in entries))
+        self.generation = generation
+        self.built_at = time.monotonic()
+
+    @property
+    def size(self):
+        return len(self.words)
+
+    def _range(self, prefix):
+        """Returns the (start, end) positions of the words starting with prefix."""
+        return (bisect_left(self.words, prefix),
+                bisect_left(self.words, prefix + _MAX_CHAR))
+
+    def suggest(self, query_words, limit):
+        if len(query_words) == 1:
+            # Names in the order of their matching word. Stops at the limit.
+            start, end = self._range(query_words[0])
+            name_ids = {}
+            for position in range(start, end):
+                name_ids[self.name_ids[position]] = None
+                if len(name_ids) >= limit:
+                    break
+            return [self.names[name_id] for name_id in name_ids]
+
+        # Names having a match for every word. Intersected starting with the word with
+        # the fewest matches.
+        ranges = sorted((self._range(word) for word in set(query_words)),
+                        key=lambda bounds: bounds[1] - bounds[0])
+        start, end = ranges[0]
+        name_ids = set(self.name_ids[start:end])
+        for start, end in ranges[1:]:
+            if not name_ids:
+                break
+            name_ids.intersection_update(self.name_ids[start:end])
+        return [self.names[name_id] for name_id in heapq.nsmallest(limit, name_ids)]
+
+
+class LocalPrefixAutocompleteEngine(BaseAutocompleteEngine):
+    """Autocomplete answered from prefix indexes of the Orgs held in memory. See the
+    module docstring.
+    """
+
+    generation_key = 'search:autocomplete:generation:%d'
+
+    def __init__(self):
+        self.max_entries = getattr(settings, 'SEARCH_AUTOCOMPLETE_LOCAL_MAX_ENTRIES',
+                                   500000)
+        self.max_age = getattr(settings, 'SEARCH_AUTOCOMPLETE_LOCAL_MAX_AGE', 300)
+        # org_id -> _OrgPrefixIndex, least recently used first.
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _generation(self, org_id):
+        return cache.get(self.generation_key % (org_id,), 0)
+
+    def _get_index(self, org_id):
+        generation = self._generation(org_id)
+        with self._lock:
+            index = self._indexes.get(org_id)
+            if index is not None:
+                if index.generation == generation and \
+                        time.monotonic() - index.built_at < self.max_age:
+                    self._indexes.move_to_end(org_id)
+                    return index
+                del self._indexes[org_id]
+
+        # Built outside the lock so that other Orgs are not held up by the query.
+        names = Resource.objects.filter(org_id=org_id).values_list('name', flat=True) \
+            .distinct()
+        index = _OrgPrefixIndex(names, generation)
+        logger.debug("Built the autocomplete index of Org %d. Words:%d" %
+                     (org_id, index.size))
+
+        with self._lock:
+            self._indexes[org_id] = index
+            self._evict()
+        return index
+
+    def _evict(self):
+        # Evict the least recently used Orgs till the total fits. The Org just added is
+        # the last one and is always kept.
+        total = sum(index.size for index in self._indexes.values())
+        while total > self.max_entries and len(self._indexes) > 1:
+            org_id, index = self._indexes.popitem(last=False)
+            total -= index.size
+            logger.debug("Evicted the autocomplete index of Org %d" % (org_id,))
+
+    def suggest(self, org_id, query, limit=MAX_SUGGESTIONS):
+        query_words = split_words(query)
+        if not query_words:
+            return []
+        return self._get_index(org_id).suggest(query_words, limit)
+
+    def invalidate(self, org_ids):
+        for org_id in org_ids:
+            key = self.generation_key % (org_id,)
+            # add() is a no-op when the key exists. incr() fails when it does not.
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Evicted in between. Any value other than the one indexed will do.
+                cache.set(key, 1, timeout=None)
+        with self._lock:
+            for org_id in org_ids:
+                self._indexes.pop(org_id, None)
+
+    def clear(self):
+        """Drops the indexes of all the Orgs held by this process."""
+        with self._lock:
+            self._indexes.clear()
+
+
+def invalidate_orgs(org_ids):
+    """Invalidates the autocomplete suggestions of the Orgs passed."""
+    org_ids = {org_id for org_id in org_ids if org_id is not None}
+    if org_ids:
+        get_autocomplete_engine().invalidate(org_ids)
+
+
+def _uses_local_engine():
+    return isinstance(get_autocomplete_engine(), LocalPrefixAutocompleteEngine)
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def invalidate_saved_resource(sender, instance, **kwargs):
+    if _uses_local_engine():
+        invalidate_orgs([instance.org_id])
+
+
+@receiver(history_bulk_updated, sender=Resource)
+def invalidate_bulk_updated_resources(sender, pks, **kwargs):
+    if _uses_local_engine():
+        # Chunked to keep the 'IN' list within the parameter limits of the DBs.
+        pks = list(pks)
+        org_ids = set()
+        for i in range(0, len(pks), 900):
+            org_ids.update(Resource.objects.filter(pk__in=pks[i:i + 900])
+                           .values_list('org_id', flat=True).distinct())
+        invalidate_orgs(org_ids)
@@ -0,0 +1,690 @@
+"""Haystack search backend storing the index in the primary database.
+
+An alternative to Elasticsearch for deployments where the DB's own full text search is
+enough. Enable it using
+
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'apps.Search.backends.DatabaseSearchEngine',
+            'INCLUDE_SPELLING': True,
+        },
+    }
+
+or SEARCH_BACKEND=database in the environment (see settings.py) and run
+'python manage.py rebuild_index' once.
+
+Every indexed object is a SearchDocument row holding its stored fields. Its text is
+kept in the full text index of the DB:
+
+    SQLite   -- The FTS5 table 'Search_fts' whose rowid is the id of the SearchDocument.
+    Postgres -- The tsvector column 'content_vector' of the SearchDocument with a GIN
+                index on it. The 'simple' configuration is used (no stemming), the words
+                of the n-gram fields have weight A and the others weight D.
+
+Both are created by the migrations of this app. The text is split into words with the
+same rule as the queries (see spelling.split_words()), so that emails and hyphenated
+names match word by word on both DBs.
+
+Queries:
+    content / document field -- Full text match of all the words. Quoted phrases and
+                                '-word' exclusions of auto_query() are supported.
+    EdgeNgram / Ngram fields -- Prefix match of the words (used by autocomplete()).
+    Other indexed fields     -- Exact (casefolded) match of the whole value using the
+                                SearchTerm table. Filter types: exact, content, in.
+                                The '_exact' fields of faceted fields are not casefolded.
+    django_ct / django_id    -- Compared with the columns.
+
+Field facets (the 'size' most common values) are counted on the SearchTerm table.
+
+Spelling suggestions (INCLUDE_SPELLING) are picked from the words of the documents of
+the Org searched: the vocabulary is kept per value of the SPELLING_ORG_FIELD field of the
+documents, and a search with an 'org_id=<id>' filter is only suggested the words of that
+Org (see spelling.py).
+
+Results are ranked with bm25 (SQLite) / ts_rank (Postgres) on the full text matches.
+Prefix matches are not ranked, they are in the order of indexing. Date and query facets,
+highlighting, narrow queries, spatial queries and sorting on fields are not supported.
+"""
+
+from datetime import date, datetime
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections as db_connections, DatabaseError, transaction
+
+from haystack import connections
+from haystack.backends import (BaseEngine, BaseSearchBackend, BaseSearchQuery,
+                               SearchNode, log_query, SPELLING_SUGGESTION_HAS_NOT_RUN)
+from haystack.constants import DJANGO_CT, DJANGO_ID, ID
+from haystack.exceptions import SearchBackendError, SkipDocument
+from haystack.fields import FacetField
+from haystack.inputs import AutoQuery, Exact, Not
+from haystack.models import SearchResult
+from haystack.utils import get_identifier, get_model_ct
+from haystack.utils.app_loading import haystack_get_model
+
+from . import spelling
+from .models import SearchDocument, SearchTerm
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Field types whose words are matched as prefixes.
+NGRAM_FIELD_TYPES = ('edge_ngram', 'ngram')
+
+# Filter types supported on the fields stored in SearchTerm.
+TERM_FILTER_TYPES = ('content', 'contains', 'exact', 'in')
+
+# Index field the vocabulary of the spelling suggestions is split on.
+SPELLING_ORG_FIELD = 'org_id'
+
+# Keeps the 'IN' lists within the parameter limits of all the supported DBs.
+_QUERY_CHUNK_SIZE = 500
+
+
+def _chunks(values, size=_QUERY_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _text(value):
+    """Returns the words of a prepared field value as one space separated string."""
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple, set)):
+        return ' '.join(_text(item) for item in value)
+    return ' '.join(spelling.split_words(str(value)))
+
+
+def _is_exact(field):
+    """Returns True when the values of the field are matched case sensitively. Like the
+    (not analyzed) facet fields of Elasticsearch, Eg: 'status_exact'.
+    """
+    return isinstance(field, FacetField)
+
+
+def _term_value(value, exact=False):
+    """Returns the value of a field / filter as stored in SearchTerm."""
+    if hasattr(value, 'input_type_name'):
+        value = value.query_string
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    value = str(value)
+    return (value if exact else value.casefold())[:255]
+
+
+def _org_id_of_value(value):
+    """Returns the Org id of a value of SPELLING_ORG_FIELD. NO_ORG when it has none."""
+    if hasattr(value, 'input_type_name'):
+        value = value.query_string
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return spelling.NO_ORG
+
+
+def _filtered_org_id(node):
+    """Returns the id of the Org the SearchNode restricts the search to (a filter on
+    SPELLING_ORG_FIELD ANDed with the rest of the query). None when it does not.
+    """
+    if node.connector != SearchNode.AND or node.negated:
+        return None
+    for child in node.children:
+        if isinstance(child, SearchNode):
+            org_id = _filtered_org_id(child)
+            if org_id is not None:
+                return org_id
+            continue
+        expression, value = child
+        field, filter_type = node.split_expression(expression)
+        if field == SPELLING_ORG_FIELD and filter_type in ('content', 'exact') and \
+                not isinstance(value, Not):
+            return _org_id_of_value(value)
+    return None
+
+
+def _phrases(value):
+    """Returns ([positive phrases], [negative phrases]) of a full text filter value.
+    A phrase is the list of its words.
+    """
+    if isinstance(value, Exact):
+        return [spelling.split_words(value.query_string)], []
+    if isinstance(value, Not):
+        return [], [spelling.split_words(value.query_string)]
+
+    text = value.query_string if hasattr(value, 'input_type_name') else str(value)
+    positives, negatives = [], []
+    if isinstance(value, AutoQuery):
+        # "quoted phrases" and -excluded words.
+        for i, bit in enumerate(AutoQuery.exact_match_re.split(text)):
+            if i % 2:
+                positives.append(spelling.split_words(bit))
+                continue
+            for token in bit.split():
+                if token.startswith('-') and len(token) > 1:
+                    negatives.append(spelling.split_words(token[1:]))
+                else:
+                    positives.append(spelling.split_words(token))
+    else:
+        positives = [spelling.split_words(token) for token in text.split()]
+    return ([words for words in positives if words],
+            [words for words in negatives if words])
+
+
+class _SqliteDialect:
+    """Full text index in the FTS5 table Search_fts(content, autocomplete)."""
+
+    fts_table = '"Search_fts"'
+
+    def write_text(self, cursor, rows):
+        cursor.executemany(
+            'INSERT INTO %s (rowid, content, autocomplete) VALUES (%%s, %%s, %%s)' %
+            (self.fts_table,), rows)
+
+    def delete_text(self, cursor, doc_pks):
+        for chunk in _chunks(doc_pks):
+            cursor.execute('DELETE FROM %s WHERE rowid IN (%s)' %
+                           (self.fts_table, ', '.join(['%s'] * len(chunk))), chunk)
+
+    def clear_text(self, cursor):
+        cursor.execute('DELETE FROM %s' % (self.fts_table,))
+
+    def match_expression(self, column, phrases, prefix, operator='AND'):
+        # Words only have \w characters, hence need no escaping inside the quotes.
+        star = '*' if prefix else ''
+        return (' %s ' % operator).join('%s : "%s"%s' % (column, ' '.join(words), star)
+                                        for words in phrases)
+
+    def match_sql(self, expression):
+        return ('d.id IN (SELECT rowid FROM %s WHERE %s MATCH %%s)' %
+                (self.fts_table, self.fts_table), [expression])
+
+    def rank(self, expressions):
+        """Returns (score sql, params, join sql, params, order sql) ranking the documents
+        matching any of the expressions first.
+        """
+        expression = ' OR '.join('(%s)' % (expression,) for expression in expressions)
+        join = ('LEFT JOIN (SELECT rowid AS doc_pk, bm25(%s) AS rank FROM %s '
+                'WHERE %s MATCH %%s) r ON r.doc_pk = d.id' %
+                (self.fts_table, self.fts_table, self.fts_table))
+        # bm25 is lower for better matches.
+        return '-COALESCE(r.rank, 0)', [], join, [expression], \
+            'r.rank IS NULL, r.rank, d.id'
+
+
+class _PostgresDialect:
+    """Full text index in the tsvector column content_vector of the documents."""
+
+    def write_text(self, cursor, rows):
+        cursor.executemany(
+            'UPDATE "Search_searchdocument" SET content_vector = '
+            "setweight(to_tsvector('simple', %s), 'D') || "
+            "setweight(to_tsvector('simple', %s), 'A') WHERE id = %s",
+            [(content, autocomplete, pk) for pk, content, autocomplete in rows])
+
+    def delete_text(self, cursor, doc_pks):
+        # Stored in the document row itself.
+        pass
+
+    def clear_text(self, cursor):
+        pass
+
+    def match_expression(self, column, phrases, prefix, operator='AND'):
+        # Words of the n-gram fields are the ones with weight A.
+        suffix = ':*A' if prefix else ''
+        return (' %s ' % ('&' if operator == 'AND' else '|',)).join(
+            '(%s)' % (' <-> '.join("'%s'%s" % (word, suffix) for word in words),)
+            for words in phrases)
+
+    def match_sql(self, expression):
+        return "d.content_vector @@ to_tsquery('simple', %s)", [expression]
+
+    def rank(self, expressions):
+        expression = ' | '.join('(%s)' % (expression,) for expression in expressions)
+        return "ts_rank(d.content_vector, to_tsquery('simple', %s))", [expression], \
+            '', [], 'score DESC, d.id'
+
+
+class _QueryCompiler:
+    """Compiles the SearchNode tree of a DatabaseSearchQuery into a SQL condition on
+    the documents (aliased 'd').
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.dialect = backend.dialect
+        unified_index = connections[backend.connection_alias].get_unified_index()
+        self.document_field = unified_index.document_field
+        self.fields = unified_index.all_searchfields()
+        # Full text expressions matched (not excluded) by the query. Used for ranking.
+        self.rank_expressions = []
+
+    def compile(self, node, excluded=False):
+        """Returns (sql, params). sql is None when the node matches everything."""
+        excluded = excluded != node.negated
+        parts = []
+        for child in node.children:
+            if isinstance(child, SearchNode):
+                part = self.compile(child, excluded)
+            else:
+                expression, value = child
+                field, filter_type = node.split_expression(expression)
+                part = self.compile_filter(field, filter_type, value, excluded)
+            if part[0] is None:
+                if node.connector == SearchNode.OR:
+                    # One alternative matching everything.
+                    parts = []
+                    break
+                continue
+            parts.append(part)
+
+        if not parts:
+            sql, params = None, []
+        else:
+            sql = (' %s ' % (node.connector,)).join('(%s)' % (sql,) for sql, _ in parts)
+            params = [param for _, part_params in parts for param in part_params]
+        if node.negated:
+            return ('NOT (%s)' % (sql,) if sql is not None else '1 = 0'), params
+        return sql, params
+
+    def compile_filter(self, field, filter_type, value, excluded):
+        if field in ('content', self.document_field):
+            return self.compile_text('content', value, False, excluded)
+        search_field = self.fields.get(field)
+        if search_field is not None and search_field.field_type in NGRAM_FIELD_TYPES:
+            return self.compile_text('autocomplete', value, True, excluded)
+
+        if filter_type not in TERM_FILTER_TYPES:
+            raise SearchBackendError("Filter '%s__%s' is not supported by the database "
+                                     "search backend." % (field, filter_type))
+        values = list(value) if filter_type == 'in' else [value]
+        if not values:
+            return '1 = 0', []
+        if field in (DJANGO_CT, DJANGO_ID):
+            return ('d.%s IN (%s)' % (field, ', '.join(['%s'] * len(values))),
+                    [str(value) for value in values])
+        # Correlated, so that the documents matched by the full text index are probed
+        # (search_term_document_idx) instead of collecting every document of the Org.
+        exact = _is_exact(search_field)
+        return ('EXISTS (SELECT 1 FROM "Search_searchterm" t WHERE t.document_id = d.id '
+                'AND t.field = %%s AND t.value IN (%s))' %
+                (', '.join(['%s'] * len(values)),),
+                [field] + [_term_value(value, exact) for value in values])
+
+    def compile_text(self, column, value, prefix, excluded):
+        positives, negatives = _phrases(value)
+        parts = []
+        if positives:
+            expression = self.dialect.match_expression(column, positives, prefix)
+            parts.append(self.dialect.match_sql(expression))
+            # Prefix matches are not ranked. Their score mostly reflects how common the
+            # prefix is, and computing it for every device matching 'de' is the bulk
+            # of the cost of an autocomplete.
+            if not excluded and not prefix:
+                self.rank_expressions.append(expression)
+        if negatives:
+            sql, params = self.dialect.match_sql(
+                self.dialect.match_expression(column, negatives, prefix, operator='OR'))
+            parts.append(('NOT (%s)' % (sql,), params))
+        if not parts:
+            return None, []
+        return (' AND '.join('(%s)' % (sql,) for sql, _ in parts),
+                [param for _, params in parts for param in params])
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+
+    def __init__(self, connection_alias, **connection_options):
+        super().__init__(connection_alias, **connection_options)
+        # Alias of the Django database holding the index.
+        self.using = connection_options.get('DATABASE', 'default')
+        self._dialect = None
+
+    @property
+    def dialect(self):
+        if self._dialect is None:
+            vendor = db_connections[self.using].vendor
+            if vendor == 'sqlite':
+                self._dialect = _SqliteDialect()
+            elif vendor == 'postgresql':
+                self._dialect = _PostgresDialect()
+            else:
+                raise ImproperlyConfigured("The database search backend needs SQLite or "
+                                           "Postgres. '%s' is %s." % (self.using, vendor))
+        return self._dialect
+
+    def _split_fields(self, index):
+        """Returns the index field names of (the n-gram fields, the fields stored in
+        SearchTerm along with whether they are exact, the fields returned with the
+        results).
+        """
+        ngram_fields, term_fields, stored_fields = [], [], []
+        for field in index.fields.values():
+            name = field.index_fieldname
+            if field.document:
+                continue
+            if field.field_type in NGRAM_FIELD_TYPES:
+                ngram_fields.append(name)
+                continue
+            if field.indexed:
+                term_fields.append((name, _is_exact(field)))
+            if field.stored:
+                stored_fields.append(name)
+        return ngram_fields, term_fields, stored_fields
+
+    def update(self, index, iterable, commit=True):
+        docs = []
+        for obj in iterable:
+            try:
+                docs.append(index.full_prepare(obj))
+            except SkipDocument:
+                self.log.debug("Indexing for object `%s` skipped", obj)
+        if not docs:
+            return
+
+        try:
+            with transaction.atomic(using=self.using):
+                self._write(index, docs)
+        except DatabaseError as e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to add %d documents to the database index: %s",
+                           len(docs), e, exc_info=True)
+
+    def _write(self, index, docs):
+        ngram_fields, term_fields, stored_fields = self._split_fields(index)
+        document_field = index.get_content_field()
+        self._delete([doc[ID] for doc in docs])
+
+        documents = [
+            SearchDocument(doc_id=doc[ID], django_ct=doc[DJANGO_CT],
+                           django_id=str(doc[DJANGO_ID]),
+                           stored=json.dumps(
+                               {name: doc.get(name) for name in stored_fields},
+                               cls=DjangoJSONEncoder))
+            for doc in docs
+        ]
+        if db_connections[self.using].features.can_return_ids_from_bulk_insert:
+            SearchDocument.objects.using(self.using).bulk_create(documents)
+        else:
+            # The pks are needed for the terms and the text.
+            for document in documents:
+                document.save(using=self.using)
+
+        terms = []
+        text_rows = []
+        words_by_org = {}
+        for document, doc in zip(documents, docs):
+            for name, exact in term_fields:
+                values = doc.get(name)
+                if not isinstance(values, (list, tuple, set)):
+                    values = [values]
+                terms.extend(SearchTerm(document_id=document.pk, field=name,
+                                        value=_term_value(value, exact))
+                             for value in values if value is not None)
+            content = _text(doc.get(document_field))
+            text_rows.append((document.pk, content,
+                              ' '.join(_text(doc.get(name)) for name in ngram_fields)))
+            org_id = _org_id_of_value(doc.get(SPELLING_ORG_FIELD))
+            words_by_org.setdefault(org_id, set()).update(content.split())
+
+        SearchTerm.objects.using(self.using).bulk_create(terms,
+                                                         batch_size=_QUERY_CHUNK_SIZE)
+        with db_connections[self.using].cursor() as cursor:
+            self.dialect.write_text(cursor, text_rows)
+        if self.include_spelling:
+            for org_id, words in sorted(words_by_org.items()):
+                spelling.add_words(words, org_id=org_id, using=self.using)
+
+    def _delete(self, doc_ids):
+        """Deletes the documents with the identifiers passed along with their terms and
+        text. Raw deletes as the rows have no dependents to be collected by the ORM.
+        """
+        pks = []
+        for chunk in _chunks(doc_ids):
+            pks.extend(SearchDocument.objects.using(self.using).filter(doc_id__in=chunk)
+                       .values_list('id', flat=True))
+        if not pks:
+            return
+        with db_connections[self.using].cursor() as cursor:
+            self.dialect.delete_text(cursor, pks)
+            for chunk in _chunks(pks):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute('DELETE FROM "Search_searchterm" WHERE document_id IN (%s)'
+                               % (placeholders,), chunk)
+                cursor.execute('DELETE FROM "Search_searchdocument" WHERE id IN (%s)' %
+                               (placeholders,), chunk)
+
+    def remove(self, obj_or_string, commit=True):
+        doc_id = get_identifier(obj_or_string)
+        try:
+            with transaction.atomic(using=self.using):
+                self._delete([doc_id])
+        except DatabaseError as e:
+            if not self.silently_fail:
+                raise
+            self.log.error("Failed to remove document '%s' from the database index: %s",
+                           doc_id, e, exc_info=True)
+
+    def clear(self, models=None, commit=True):
+        with transaction.atomic(using=self.using):
+            if models is None:
+                with db_connections[self.using].cursor() as cursor:
+                    self.dialect.clear_text(cursor)
+                    cursor.execute('DELETE FROM "Search_searchterm"')
+                    cursor.execute('DELETE FROM "Search_searchdocument"')
+                spelling.clear_words(using=self.using)
+                return
+            doc_ids = SearchDocument.objects.using(self.using) \
+                .filter(django_ct__in=[get_model_ct(model) for model in models]) \
+                .values_list('doc_id', flat=True)
+            self._delete(list(doc_ids))
+
+    @log_query
+    def search(self, query_string, **kwargs):
+        # query_string is the SearchNode built by DatabaseSearchQuery.build_query().
+        for option in ('date_facets', 'query_facets', 'narrow_queries', 'highlight',
+                       'within', 'dwithin', 'distance_point'):
+            if kwargs.get(option):
+                raise SearchBackendError("'%s' is not supported by the database search "
+                                         "backend." % (option,))
+        sort_by = [field for field in kwargs.get('sort_by') or []
+                   if field.lstrip('-') != 'score']
+        if sort_by:
+            raise SearchBackendError("Sorting on fields is not supported by the database "
+                                     "search backend.")
+
+        compiler = _QueryCompiler(self)
+        where, params = compiler.compile(query_string)
+        conditions = [where] if where is not None else []
+        unified_index = connections[self.connection_alias].get_unified_index()
+        models = kwargs.get('models') or unified_index.get_indexed_models()
+        model_cts = sorted(get_model_ct(model) for model in models)
+        conditions.append('d.django_ct IN (%s)' % (', '.join(['%s'] * len(model_cts)),))
+        params = params + model_cts
+        where_sql = ' AND '.join('(%s)' % (condition,) for condition in conditions)
+
+        start_offset = kwargs.get('start_offset') or 0
+        end_offset = kwargs.get('end_offset')
+        with db_connections[self.using].cursor() as cursor:
+            hits, rows = None, []
+            if end_offset is not None:
+                limit = end_offset - start_offset
+                if limit > 0:
+                    rows = self._fetch_page(cursor, compiler, where_sql, params, limit,
+                                            start_offset)
+                # A page which is not full holds the last of the matches. Saves the
+                # count, which costs as much as the page for selective queries.
+                if len(rows) < limit and (rows or not start_offset):
+                    hits = start_offset + len(rows)
+
+            if hits is None:
+                cursor.execute('SELECT COUNT(*) FROM "Search_searchdocument" d WHERE %s' %
+                               (where_sql,), params)
+                hits = cursor.fetchone()[0]
+            if end_offset is None and hits > start_offset:
+                rows = self._fetch_page(cursor, compiler, where_sql, params,
+                                        hits - start_offset, start_offset)
+
+            facets = {}
+            if kwargs.get('facets'):
+                facets = {
+                    'fields': self._facet_counts(cursor, where_sql, params,
+                                                 kwargs['facets']),
+                    'dates': {},
+                    'queries': {},
+                }
+
+        results = self._process_results(rows, kwargs.get('result_class'))
+        hits -= len(rows) - len(results)
+
+        spelling_suggestion = None
+        if self.include_spelling:
+            # Not computed unless asked for. See DatabaseSearchQuery.
+            spelling_suggestion = SPELLING_SUGGESTION_HAS_NOT_RUN
+            if kwargs.get('spelling_query'):
+                spelling_suggestion = self.suggest(kwargs['spelling_query'],
+                                                   _filtered_org_id(query_string))
+        return {
+            'results': results,
+            'hits': hits,
+            'facets': facets,
+            'spelling_suggestion': spelling_suggestion,
+        }
+
+    def _facet_counts(self, cursor, where_sql, params, facets):
+        """Returns {field name: [(value, count), ...]} of the documents matching the
+        conditions. Like the terms facets of Elasticsearch, the 'size' (default 10) most
+        common values, most common first.
+        """
+        fields = connections[self.connection_alias].get_unified_index().all_searchfields()
+        for name in facets:
+            field = fields.get(name)
+            if field is None or not field.indexed or field.document or \
+                    field.field_type in NGRAM_FIELD_TYPES:
+                raise SearchBackendError("Faceting on '%s' is not supported by the "
+                                         "database search backend." % (name,))
+
+        # The values of all the fields are counted in one pass over the documents
+        # matching, read from the (document, field, value) index. CROSS JOIN keeps
+        # SQLite from scanning all the terms of the fields instead.
+        names = sorted(facets)
+        cursor.execute(
+            'SELECT t.field, t.value, COUNT(*) FROM "Search_searchdocument" d '
+            'CROSS JOIN "Search_searchterm" t WHERE t.document_id = d.id '
+            'AND t.field IN (%s) AND %s GROUP BY t.field, t.value' %
+            (', '.join(['%s'] * len(names)), where_sql), names + params)
+        counts = {name: [] for name in names}
+        for name, value, count in cursor.fetchall():
+            counts[name].append((value, count))
+
+        for name, values in counts.items():
+            field = fields[name]
+            values.sort(key=lambda item: (-item[1], item[0]))
+            del values[facets[name].get('size', 10):]
+            # The values of multi valued fields are stored one by one.
+            if not field.is_multivalued:
+                values[:] = [(field.convert(value), count) for value, count in values]
+        return counts
+
+    def suggest(self, text, org_id=None):
+        """Returns the spelling suggestion for the text, from the words of the Org (of
+        all the Orgs when None). None when spelling is off.
+        """
+        if not self.include_spelling:
+            return None
+        return spelling.suggest(text, org_id=org_id, using=self.using)
+
+    def _fetch_page(self, cursor, compiler, where_sql, params, limit, offset):
+        score, score_params, join, join_params, order = '0', [], '', [], 'd.id'
+        if compiler.rank_expressions:
+            score, score_params, join, join_params, order = \
+                self.dialect.rank(compiler.rank_expressions)
+        cursor.execute(
+            'SELECT d.django_ct, d.django_id, d.stored, %s AS score '
+            'FROM "Search_searchdocument" d %s WHERE %s '
+            'ORDER BY %s LIMIT %%s OFFSET %%s' %
+            (score, join, where_sql, order),
+            score_params + join_params + params + [limit, offset])
+        return cursor.fetchall()
+
+    def _process_results(self, rows, result_class=None):
+        if result_class is None:
+            result_class = SearchResult
+        unified_index = connections[self.connection_alias].get_unified_index()
+        indexed_models = unified_index.get_indexed_models()
+
+        results = []
+        for django_ct, django_id, stored, score in rows:
+            app_label, model_name = django_ct.split('.')
+            model = haystack_get_model(app_label, model_name)
+            if model is None or model not in indexed_models:
+                continue
+            index = unified_index.get_index(model)
+            additional_fields = {}
+            for name, value in json.loads(stored).items():
+                field = index.fields.get(name)
+                additional_fields[name] = field.convert(value) if field is not None \
+                    else value
+            results.append(result_class(app_label, model_name, django_id, score,
+                                        **additional_fields))
+        return results
+
+    def more_like_this(self, model_instance, additional_query_string=None,
+                       result_class=None, **kwargs):
+        raise SearchBackendError("More Like This is not supported by the database search "
+                                 "backend.")
+
+
+class DatabaseSearchQuery(BaseSearchQuery):
+
+    def __str__(self):
+        return str(self.query_filter)
+
+    def build_query(self):
+        # The backend compiles the filters into SQL itself.
+        return self.query_filter
+
+    def build_query_fragment(self, field, filter_type, value):
+        return self.query_filter._repr_query_fragment_callback(field, filter_type, value)
+
+    def _text_of(self, node):
+        """Returns the text of the full text filters of the node."""
+        document_field = connections[self._using].get_unified_index().document_field
+        bits = []
+        for child in node.children:
+            if isinstance(child, SearchNode):
+                bits.append(self._text_of(child))
+                continue
+            expression, value = child
+            field, _ = node.split_expression(expression)
+            if field in ('content', document_field):
+                bits.append(value.query_string if hasattr(value, 'input_type_name')
+                            else str(value))
+        return ' '.join(bit for bit in bits if bit)
+
+    def build_params(self, spelling_query=None):
+        # Suggestions cost extra queries. They are not computed along with the results
+        # but by get_spelling_suggestion(), only when asked for.
+        kwargs = super(DatabaseSearchQuery, self).build_params()
+        kwargs.pop('spelling_query', None)
+        return kwargs
+
+    def get_spelling_suggestion(self, preferred_query=None):
+        # For the text of the query when no other text is passed. Running the search is
+        # not needed for it.
+        if self._spelling_suggestion is SPELLING_SUGGESTION_HAS_NOT_RUN:
+            text = preferred_query or self.spelling_query or \
+                self._text_of(self.query_filter)
+            self._spelling_suggestion = self.backend.suggest(
+                text, _filtered_org_id(self.query_filter))
+        return self._spelling_suggestion
+
+
+class DatabaseSearchEngine(BaseEngine):
+    backend = DatabaseSearchBackend
+    query = DatabaseSearchQuery
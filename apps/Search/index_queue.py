@@ -0,0 +1,207 @@
+"""Queue of objects whose search index entries have to be updated.
+
+With the QueuedSignalProcessor, a save or delete of an indexed object only inserts an
+IndexQueueEntry row in the same transaction. The 'run_index_worker' command drains the
+queue in batches:
+
+    1. The oldest rows are locked (skipping the rows locked by other workers).
+    2. All the other rows queued for the same objects are taken along, so that many
+       saves of an object result in a single update.
+    3. The objects still present in the index queryset are sent to the search engine in
+       one bulk update per model, the others are removed in one bulk delete. The update
+       runs with the request context of the latest row of each object bound (see
+       apps/Core/context.py), hence one update per model and request context.
+    4. The rows are deleted when the transaction commits. If the search engine fails,
+       the transaction is rolled back and the rows are picked up again later.
+    5. signals.index_updated is sent for the objects, Eg: to invalidate the cached
+       search results of their Orgs.
+"""
+
+import json
+
+from django.apps import apps
+from django.db import connections, transaction
+from django.utils import timezone
+
+from haystack import connections as haystack_connections
+from haystack.exceptions import NotHandled
+
+from apps.Core import context as request_context
+from .models import IndexQueueEntry
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of queue rows processed per transaction by default.
+DEFAULT_BATCH_SIZE = 500
+
+
+def is_queue_enabled():
+    """Returns True when the configured signal processor queues the index updates. Code
+    updating the index of objects changed in bulk should queue them in that case.
+    """
+    from .signals import QueuedSignalProcessor
+
+    return isinstance(apps.get_app_config('haystack').signal_processor,
+                      QueuedSignalProcessor)
+
+
+def enqueue(model, pks):
+    """Queues the objects of the model with the pks passed. One INSERT per call.
+
+    Arguments:
+        model {Model} -- Model class of the objects.
+        pks {iterable} -- pks of the objects which were saved or deleted.
+    """
+    label = model._meta.label_lower
+    now = timezone.now()
+    captured = json.dumps(request_context.capture())
+    IndexQueueEntry.objects.bulk_create(
+        [IndexQueueEntry(model=label, object_id=pk, queued_at=now,
+                         request_context=captured) for pk in pks])
+
+
+def queue_stats():
+    """Returns the number of queued rows and how old the oldest of them is.
+
+    Returns:
+        dict -- {'depth': int, 'oldest': datetime or None, 'lag_seconds': float}
+    """
+    oldest = IndexQueueEntry.objects.order_by('id').values_list('queued_at',
+                                                                flat=True).first()
+    lag = (timezone.now() - oldest).total_seconds() if oldest is not None else 0.0
+    return {
+        'depth': IndexQueueEntry.objects.count(),
+        'oldest': oldest,
+        'lag_seconds': max(lag, 0.0),
+    }
+
+
+def _remove_many(backend, identifiers):
+    """Removes the documents from the index with as few calls as the backend allows."""
+    conn = getattr(backend, 'conn', None)
+    index_name = getattr(backend, 'index_name', None)
+    if conn is None or index_name is None:
+        for identifier in identifiers:
+            backend.remove(identifier, commit=False)
+        return
+
+    # Elasticsearch: one bulk request. Documents which were never indexed are fine.
+    from elasticsearch.helpers import bulk
+
+    actions = [{'_op_type': 'delete', '_index': index_name, '_type': 'modelresult',
+                '_id': identifier} for identifier in identifiers]
+    _, errors = bulk(conn, actions, raise_on_error=False)
+    errors = [error for error in errors
+              if error.get('delete', {}).get('status') != 404]
+    if errors:
+        raise RuntimeError("Failed to remove %d documents. First error: %s" %
+                           (len(errors), errors[0]))
+
+
+def _commit(backend):
+    """Makes the changes sent with commit=False visible to searches."""
+    conn = getattr(backend, 'conn', None)
+    index_name = getattr(backend, 'index_name', None)
+    if conn is not None and index_name is not None:
+        conn.indices.refresh(index=index_name)
+
+
+def _update_index(model, pks):
+    """Brings the index entries of the objects up to date on all the connections.
+
+    Returns:
+        tuple -- (number of objects updated, number of objects removed)
+    """
+    from .signals import index_updated
+
+    updated_count = removed_count = 0
+    present_pks, missing = set(), set()
+    for using in haystack_connections.connections_info:
+        try:
+            index = haystack_connections[using].get_unified_index().get_index(model)
+        except NotHandled:
+            continue
+        backend = haystack_connections[using].get_backend()
+        # Failures should roll back the batch instead of being logged and dropped.
+        backend.silently_fail = False
+
+        present = list(index.index_queryset(using=using).filter(pk__in=pks))
+        missing = set(pks) - {obj.pk for obj in present}
+        if present:
+            backend.update(index, present, commit=False)
+        if missing:
+            _remove_many(backend, ["%s.%s" % (model._meta.label_lower, pk)
+                                   for pk in sorted(missing)])
+        _commit(backend)
+        updated_count, removed_count = len(present), len(missing)
+        present_pks.update(obj.pk for obj in present)
+
+    if present_pks or missing:
+        index_updated.send(sender=model, pks=sorted(present_pks),
+                           removed_pks=sorted(missing))
+    return updated_count, removed_count
+
+
+def process_batch(batch_size=DEFAULT_BATCH_SIZE):
+    """Processes the oldest batch of queued objects. See the module docstring.
+
+    Keyword Arguments:
+        batch_size {int} -- Max number of queue rows picked up.
+
+    Returns:
+        dict -- {'rows': queue rows processed, 'updated': .., 'removed': ..}. rows is 0
+                when the queue is empty (or all of it is being processed by others).
+    """
+    result = {'rows': 0, 'updated': 0, 'removed': 0}
+    using = IndexQueueEntry.objects.db
+    skip_locked = connections[using].features.has_select_for_update_skip_locked
+
+    def locked(queryset):
+        if skip_locked:
+            return queryset.select_for_update(skip_locked=True)
+        return queryset
+
+    with transaction.atomic(using=using):
+        batch = list(locked(IndexQueueEntry.objects.order_by('id'))
+                     .values_list('id', 'model', 'object_id')[:batch_size])
+        if not batch:
+            return result
+
+        pks_by_label = {}
+        for _, label, object_id in batch:
+            pks_by_label.setdefault(label, set()).add(object_id)
+
+        row_ids = {row_id for row_id, _, _ in batch}
+        for label, pks in pks_by_label.items():
+            # Rows queued for the same objects after the batch are covered as well. The
+            # objects are read below, after these rows were committed.
+            captured_by_pk = {}
+            for row_id, object_id, captured in locked(IndexQueueEntry.objects.filter(
+                    model=label, object_id__in=pks).order_by('id')).values_list(
+                        'id', 'object_id', 'request_context'):
+                row_ids.add(row_id)
+                captured_by_pk[object_id] = captured
+
+            try:
+                model = apps.get_model(label)
+            except LookupError:
+                logger.warning("Dropping queued objects of unknown model %s" % (label,))
+                continue
+            pks_by_captured = {}
+            for pk, captured in captured_by_pk.items():
+                pks_by_captured.setdefault(captured, set()).add(pk)
+            for captured, captured_pks in pks_by_captured.items():
+                with request_context.bind_captured(json.loads(captured)):
+                    updated_count, removed_count = _update_index(model, captured_pks)
+                result['updated'] += updated_count
+                result['removed'] += removed_count
+
+        row_ids = sorted(row_ids)
+        for i in range(0, len(row_ids), DEFAULT_BATCH_SIZE):
+            IndexQueueEntry.objects.filter(id__in=row_ids[i:i + DEFAULT_BATCH_SIZE]).delete()
+        result['rows'] = len(row_ids)
+
+    logger.debug("Processed %(rows)d queued rows. updated:%(updated)d "
+                 "removed:%(removed)d" % result)
+    return result
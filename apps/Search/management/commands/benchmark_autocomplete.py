@@ -0,0 +1,102 @@
+"""Management command comparing the latency of the autocomplete engines.
+
+Typed prefixes (1 to 4 characters of one or two words) are sampled from the device
+names of an existing Org and every engine is asked for the suggestions of each of them,
+the way the search box asks on every keystroke. Reports the p50 / p99 / max latency per
+engine and, for the local engine, the time taken to build the index of the Org.
+
+The search index engine needs the search backend (Elasticsearch) to be reachable and
+the Org to be indexed.
+
+Usage:
+    python manage.py benchmark_autocomplete --org 1
+    python manage.py benchmark_autocomplete --org 1 --queries 5000 --engine local
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.Organization.models import Org
+from apps.Resource.models import Resource
+from apps.Search.autocomplete import (LocalPrefixAutocompleteEngine,
+                                      SearchIndexAutocompleteEngine, split_words)
+
+ENGINES = {
+    'index': SearchIndexAutocompleteEngine,
+    'local': LocalPrefixAutocompleteEngine,
+}
+
+
+def sample_queries(names, count, seed=0):
+    """Returns count prefixes typed while searching for the names passed."""
+    rng = random.Random(seed)
+    words_of_names = [words for words in map(split_words, names) if words]
+    queries = []
+    while words_of_names and len(queries) < count:
+        words = rng.choice(words_of_names)
+        first = rng.randrange(len(words))
+        query = words[first][:rng.randint(1, 4)]
+        if first + 1 < len(words) and rng.random() < 0.3:
+            query += ' ' + words[first + 1][:rng.randint(1, 4)]
+        queries.append(query)
+    return queries
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the p50 / p99 latency of the autocomplete engines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', type=int, required=True,
+                            help="id of the Org whose device names are queried.")
+        parser.add_argument('--queries', type=int, default=1000,
+                            help="Number of suggestions asked per engine.")
+        parser.add_argument('--engine', choices=['all'] + sorted(ENGINES), default='all',
+                            help="Engine benchmarked.")
+
+    def handle(self, *args, **options):
+        org = Org.objects.filter(pk=options['org']).first()
+        if org is None:
+            raise CommandError("Org with id %d does not exist." % (options['org'],))
+        names = list(Resource.objects.filter(org=org).values_list('name', flat=True)
+                     .distinct())
+        if not names:
+            raise CommandError("%s has no resources." % (org.get_name(),))
+        queries = sample_queries(names, options['queries'])
+
+        self.stdout.write("%s: %d distinct names, %d queries per engine" %
+                          (org.get_name(), len(names), len(queries)))
+        self.stdout.write("%-6s %12s %10s %10s %10s" %
+                          ('engine', 'first(ms)', 'p50(ms)', 'p99(ms)', 'max(ms)'))
+
+        engine_names = sorted(ENGINES) if options['engine'] == 'all' else \
+            [options['engine']]
+        for engine_name in engine_names:
+            # A new instance so that the local engine starts without the index of the Org.
+            engine = ENGINES[engine_name]()
+            try:
+                self.run_engine(engine_name, engine, org.pk, queries)
+            except Exception as e:
+                self.stderr.write("%-6s failed: %s" % (engine_name, e))
+
+    def run_engine(self, engine_name, engine, org_id, queries):
+        # The first query includes building the index of the local engine.
+        start = time.perf_counter()
+        engine.suggest(org_id, queries[0])
+        first = time.perf_counter() - start
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            engine.suggest(org_id, query)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        self.stdout.write("%-6s %12.3f %10.3f %10.3f %10.3f" % (
+            engine_name, first * 1000, percentile(timings, 0.5) * 1000,
+            percentile(timings, 0.99) * 1000, timings[-1] * 1000))
@@ -0,0 +1,103 @@
+"""Management command comparing the latency of the search backends on the same data.
+
+Searches for words and autocompletes prefixes sampled from the device names of an
+existing Org, restricted to the Org like ResourceSearchView and the autocomplete view
+do, against every haystack connection passed. Reports the p50 / p99 / max latency of
+each.
+
+To compare Elasticsearch with the database backend, configure both as connections,
+Eg:
+    HAYSTACK_CONNECTIONS = {
+        'default': {... Elasticsearch ...},
+        'db': {'ENGINE': 'apps.Search.backends.DatabaseSearchEngine',
+               'INCLUDE_SPELLING': True},
+    }
+and index the Resources into the second one with 'python manage.py update_index -u db'.
+
+Usage:
+    python manage.py benchmark_search --org 1
+    python manage.py benchmark_search --org 1 --using default db --queries 2000
+"""
+
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from haystack import connections
+from haystack.query import SearchQuerySet
+
+from apps.Organization.models import Org
+from apps.Resource.models import Resource
+from apps.Search.autocomplete import MAX_SUGGESTIONS, split_words
+from .benchmark_autocomplete import percentile, sample_queries
+
+# Number of results of a search page (ResourceSearchView).
+PAGE_SIZE = 20
+
+
+def sample_words(names, count, seed=0):
+    """Returns count words of the names, as searched for in the search box."""
+    rng = random.Random(seed)
+    words = sorted({word for name in names for word in split_words(name)})
+    return [rng.choice(words) for _ in range(count)] if words else []
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the p50 / p99 latency of searches on the haystack connections."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--org', type=int, required=True,
+                            help="id of the Org whose device names are searched for.")
+        parser.add_argument('--queries', type=int, default=1000,
+                            help="Number of searches and autocompletes per connection.")
+        parser.add_argument('--using', nargs='+',
+                            help="Aliases of the haystack connections. All by default.")
+
+    def handle(self, *args, **options):
+        org = Org.objects.filter(pk=options['org']).first()
+        if org is None:
+            raise CommandError("Org with id %d does not exist." % (options['org'],))
+        aliases = options['using'] or sorted(connections.connections_info)
+        unknown = [alias for alias in aliases
+                   if alias not in connections.connections_info]
+        if unknown:
+            raise CommandError("Unknown haystack connections: %s" % (', '.join(unknown),))
+
+        names = list(Resource.objects.filter(org=org).values_list('name', flat=True)
+                     .distinct())
+        if not names:
+            raise CommandError("%s has no resources." % (org.get_name(),))
+        words = sample_words(names, options['queries'])
+        prefixes = sample_queries(names, options['queries'])
+
+        self.stdout.write("%s: %d distinct names, %d queries per connection" %
+                          (org.get_name(), len(names), options['queries']))
+        self.stdout.write("%-12s %-13s %10s %10s %10s" %
+                          ('connection', 'query', 'p50(ms)', 'p99(ms)', 'max(ms)'))
+        for alias in aliases:
+            sqs = SearchQuerySet(using=alias).filter(org_id=org.pk)
+            try:
+                self.run_queries(alias, 'search', words, lambda word: (
+                    list(sqs.auto_query(word)[:PAGE_SIZE])))
+                self.run_queries(alias, 'autocomplete', prefixes, lambda prefix: (
+                    sqs.autocomplete(device_name_auto=prefix)
+                    .values_list('name', flat=True)[:MAX_SUGGESTIONS]))
+            except Exception as e:
+                self.stderr.write("%-12s failed: %s" % (alias, e))
+
+    def run_queries(self, alias, label, queries, run):
+        # Warm up the connection and the caches of the backend.
+        for query in queries[:10]:
+            run(query)
+
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+
+        self.stdout.write("%-12s %-13s %10.3f %10.3f %10.3f" % (
+            alias, label, percentile(timings, 0.5) * 1000,
+            percentile(timings, 0.99) * 1000, timings[-1] * 1000))
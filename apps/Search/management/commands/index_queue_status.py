@@ -0,0 +1,36 @@
+"""Management command printing the depth and lag of the search index queue as JSON.
+Fails (exit status 1) when the limits passed are exceeded, so that it can be used as a
+monitoring check.
+
+Usage:
+    python manage.py index_queue_status
+    python manage.py index_queue_status --max-lag 300 --max-depth 10000
+"""
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.Search.index_queue import queue_stats
+
+
+class Command(BaseCommand):
+    help = "Prints the depth and lag of the search index queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-lag', type=float,
+                            help="Fail when the oldest queued row is older (seconds).")
+        parser.add_argument('--max-depth', type=int,
+                            help="Fail when more rows are queued.")
+
+    def handle(self, *args, **options):
+        stats = queue_stats()
+        self.stdout.write(json.dumps(stats, cls=DjangoJSONEncoder))
+
+        if options['max_lag'] is not None and stats['lag_seconds'] > options['max_lag']:
+            raise CommandError("Search index is %.0f s behind. Limit: %.0f s" %
+                               (stats['lag_seconds'], options['max_lag']))
+        if options['max_depth'] is not None and stats['depth'] > options['max_depth']:
+            raise CommandError("%d rows in the search index queue. Limit: %d" %
+                               (stats['depth'], options['max_depth']))
@@ -0,0 +1,147 @@
+"""Management command bringing the search index up to date incrementally. See
+apps/Search/reindex.py
+
+Indexes the objects changed since the last completed run, split into chunks per Org (or
+by pk range) and indexed by a pool of worker processes. An interrupted run (SIGTERM /
+Ctrl+C / failure) is resumed by the next one. With --verify, the pks of the objects of
+every Org in the DB and in the index are compared, and with --fix the differences are
+repaired (Eg: objects deleted while the index was not being updated).
+
+Usage:
+    python manage.py reindex
+    python manage.py reindex --workers 4 --verify --fix
+    python manage.py reindex --full --split range --chunk-size 10000
+    python manage.py reindex --verify --org 1 2    # Exits non-zero on differences.
+"""
+
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from haystack import connections
+
+from apps.Organization.models import Org
+from apps.Search import reindex
+
+
+class Command(BaseCommand):
+    help = "Indexes the objects changed since the last run and verifies the index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--using', nargs='+',
+                            help="Aliases of the haystack connections. All by default.")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of worker processes indexing the chunks.")
+        parser.add_argument('--split', choices=[reindex.SPLIT_ORG, reindex.SPLIT_RANGE],
+                            default=reindex.SPLIT_ORG,
+                            help="Split the work into chunks of an Org or by pk range.")
+        parser.add_argument('--chunk-size', type=int, default=reindex.DEFAULT_CHUNK_SIZE,
+                            help="Max number of objects per chunk.")
+        parser.add_argument('--batch-size', type=int, default=reindex.DEFAULT_BATCH_SIZE,
+                            help="Number of objects sent to the search engine at once.")
+        parser.add_argument('--full', action='store_true',
+                            help="Index all the objects instead of the changed ones.")
+        parser.add_argument('--verify', action='store_true',
+                            help="Compare the pks in the index with the DB per Org.")
+        parser.add_argument('--fix', action='store_true',
+                            help="With --verify, index the missing objects and remove "
+                                 "the entries of the deleted ones.")
+        parser.add_argument('--org', type=int, nargs='+',
+                            help="ids of the Orgs verified. All by default.")
+        parser.add_argument('--no-index', action='store_true',
+                            help="Only verify. Do not index the changed objects.")
+
+    def handle(self, *args, **options):
+        for name in ('workers', 'chunk_size', 'batch_size'):
+            if options[name] <= 0:
+                raise CommandError("--%s should be a positive number." %
+                                   (name.replace('_', '-'),))
+        aliases = options['using'] or sorted(connections.connections_info)
+        unknown = [alias for alias in aliases
+                   if alias not in connections.connections_info]
+        if unknown:
+            raise CommandError("Unknown haystack connections: %s" % (', '.join(unknown),))
+
+        # Stop like on Ctrl+C. The chunks done are kept and the rest resumed later.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        failed = differences = 0
+        for alias in aliases:
+            for model, index in reindex.get_indexed_models(alias):
+                if not options['no_index']:
+                    failed += self.index_changes(alias, model, index, options)
+                if options['verify']:
+                    differences += self.verify(alias, model, index, options)
+
+        if failed:
+            raise CommandError("%d chunks failed. Run the command again to resume." %
+                               (failed,))
+        if differences and not options['fix']:
+            raise CommandError("%d objects differ between the index and the DB." %
+                               (differences,))
+
+    def index_changes(self, alias, model, index, options):
+        """Runs (or resumes) the reindex of the model. Returns the number of failed
+        chunks.
+        """
+        label = model._meta.label_lower
+        checkpoint, resumed = reindex.start_run(
+            model, index, alias, split=options['split'], chunk_size=options['chunk_size'],
+            full=options['full'])
+        chunk_ids = reindex.pending_chunk_ids(checkpoint)
+        since = checkpoint.run_since
+        self.stdout.write("%s on '%s': %s %d chunks%s" % (
+            label, alias, "Resuming" if resumed else "Indexing", len(chunk_ids),
+            " changed since %s" % (since,) if since else ""))
+
+        workers = reindex.get_max_workers(alias, options['workers'])
+        if workers < options['workers']:
+            self.stdout.write("'%s' allows a single writer. Using 1 worker." % (alias,))
+
+        start = time.monotonic()
+        indexed = failed = done = 0
+        for chunk_id, result in reindex.run_chunks(chunk_ids, workers,
+                                                   options['batch_size']):
+            done += 1
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write("Chunk %d failed: %s" % (chunk_id, result))
+                continue
+            indexed += result
+            if options['verbosity'] > 1:
+                self.stdout.write("  %d/%d chunks, %d objects" %
+                                  (done, len(chunk_ids), indexed))
+
+        completed = reindex.finish_run(checkpoint)
+        self.stdout.write("%s on '%s': Indexed %d objects in %.1f s.%s" % (
+            label, alias, indexed, time.monotonic() - start,
+            "" if completed else " %d chunks pending." % (failed,)))
+        return failed
+
+    def verify(self, alias, model, index, options):
+        """Compares the index with the DB per Org. Returns the number of objects
+        differing.
+        """
+        label = model._meta.label_lower
+        if not reindex.has_org(model):
+            org_ids = [None]
+        elif options['org']:
+            org_ids = options['org']
+        else:
+            org_ids = list(Org.objects.order_by('pk').values_list('pk', flat=True))
+
+        differences = 0
+        for org_id in org_ids:
+            missing, extra = reindex.verify(alias, model, index, org_id)
+            if not missing and not extra:
+                continue
+            differences += len(missing) + len(extra)
+            self.stdout.write("%s on '%s' Org %s: %d missing, %d extra%s" % (
+                label, alias, org_id if org_id is not None else '-', len(missing),
+                len(extra), " (fixed)" if options['fix'] else ""))
+            if options['fix']:
+                reindex.fix(alias, model, index, missing, extra, options['batch_size'])
+        self.stdout.write("%s on '%s': Verified %d Orgs. %d objects differ." %
+                          (label, alias, len(org_ids), differences))
+        return differences
@@ -0,0 +1,76 @@
+"""Management command which applies the search index updates queued by the
+QueuedSignalProcessor. See apps/Search/index_queue.py
+
+Runs until stopped (SIGTERM / Ctrl+C), waiting for the current batch to finish. When
+the search engine fails, the batch is retried with an increasing delay.
+
+Usage:
+    python manage.py run_index_worker
+    python manage.py run_index_worker --once    # Drain the queue and exit. Eg: cron.
+"""
+
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from apps.Search import index_queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Max delay between retries when the search engine keeps failing.
+MAX_RETRY_DELAY = 60
+
+
+class Command(BaseCommand):
+    help = "Applies the queued search index updates in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=index_queue.DEFAULT_BATCH_SIZE,
+                            help="Number of queued rows processed per transaction.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty.")
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError("--batch-size should be a positive number.")
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+
+        retry_delay = 0
+        total = 0
+        try:
+            while not self.stopping:
+                close_old_connections()
+                try:
+                    result = index_queue.process_batch(options['batch_size'])
+                except Exception:
+                    if options['once']:
+                        raise
+                    retry_delay = min(max(retry_delay * 2, 1), MAX_RETRY_DELAY)
+                    logger.exception("Failed to update the search index. Retrying in "
+                                     "%d s" % (retry_delay,))
+                    time.sleep(retry_delay)
+                    continue
+                retry_delay = 0
+
+                if result['rows']:
+                    total += result['rows']
+                    logger.info("Index updated. rows:%(rows)d updated:%(updated)d "
+                                "removed:%(removed)d" % result)
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("Processed %d queued rows." % (total,))
+
+    def stop(self, signum, frame):
+        # The current batch is completed before exiting.
+        self.stopping = True
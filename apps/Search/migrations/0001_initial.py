@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexQueueEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.PositiveIntegerField()),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'index queue entry',
+                'verbose_name_plural': 'index queue entries',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='indexqueueentry',
+            index=models.Index(fields=['model', 'object_id'], name='search_queue_obj_idx'),
+        ),
+    ]
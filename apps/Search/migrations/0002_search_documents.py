@@ -0,0 +1,107 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.utils
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def create_full_text_index(apps, schema_editor):
+    """Creates the full text index used by apps.Search.backends.DatabaseSearchBackend."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                'CREATE VIRTUAL TABLE "Search_fts" USING fts5(content, autocomplete, '
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')")
+        except django.db.utils.OperationalError as e:
+            # Only needed by the database search backend.
+            logger.warning("SQLite lacks FTS5, the database search backend cannot be "
+                           "used: %s", e)
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE "Search_searchdocument" ADD COLUMN content_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX search_doc_vector_idx ON "Search_searchdocument" '
+            'USING GIN (content_vector)')
+
+
+def drop_full_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS "Search_fts"')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS search_doc_vector_idx')
+        schema_editor.execute(
+            'ALTER TABLE "Search_searchdocument" DROP COLUMN IF EXISTS content_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.CharField(max_length=255, unique=True)),
+                ('django_ct', models.CharField(max_length=100)),
+                ('django_id', models.CharField(max_length=100)),
+                ('stored', models.TextField()),
+            ],
+            options={
+                'verbose_name': 'search document',
+                'verbose_name_plural': 'search documents',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchWord',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('word', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchWordTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('word', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='Search.SearchWord')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=100)),
+                ('value', models.CharField(max_length=255)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, db_index=False, related_name='terms', to='Search.SearchDocument')),
+            ],
+            options={
+                'verbose_name': 'search term',
+                'verbose_name_plural': 'search terms',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchdocument',
+            index=models.Index(fields=['django_ct'], name='search_doc_ct_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchwordtrigram',
+            index=models.Index(fields=['trigram'], name='search_trigram_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['field', 'value'], name='search_term_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['document', 'field', 'value'], name='search_term_document_idx'),
+        ),
+        migrations.RunPython(create_full_text_index, drop_full_text_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Search', '0002_search_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrgIndexGeneration',
+            fields=[
+                ('org_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('generation', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'org index generation',
+                'verbose_name_plural': 'org index generations',
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Search', '0003_org_index_generation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReindexCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('using', models.CharField(max_length=100)),
+                ('indexed_until', models.DateTimeField(blank=True, null=True)),
+                ('run_since', models.DateTimeField(blank=True, null=True)),
+                ('run_started_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'reindex checkpoint',
+                'verbose_name_plural': 'reindex checkpoints',
+                'unique_together': {('model', 'using')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ReindexChunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('org_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('first_pk', models.PositiveIntegerField()),
+                ('last_pk', models.PositiveIntegerField()),
+                ('done', models.BooleanField(default=False)),
+                ('checkpoint', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='Search.ReindexCheckpoint')),
+            ],
+            options={
+                'verbose_name': 'reindex chunk',
+                'verbose_name_plural': 'reindex chunks',
+                'ordering': ['id'],
+            },
+        ),
+    ]
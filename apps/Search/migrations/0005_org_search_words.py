@@ -0,0 +1,132 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:16
+"""Splits the vocabulary of the spelling suggestions of the database search backend per
+Org. The words are added again to the vocabulary of the Org of each indexed document,
+read from the full text index. Nothing is done when the vocabulary is empty (spelling
+suggestions off, or another search backend).
+"""
+
+from django.db import migrations, models
+
+from apps.Search import spelling
+from apps.Search.backends import SPELLING_ORG_FIELD
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Number of documents / words processed per batch. Keeps the memory bounded.
+BATCH_SIZE = 500
+
+
+def _clear_vocabulary(apps, schema_editor):
+    # Raw deletes. The ORM would load every word to collect its trigrams.
+    for model_name in ('SearchWordTrigram', 'SearchWord'):
+        model = apps.get_model('Search', model_name)
+        schema_editor.execute('DELETE FROM %s' %
+                              (schema_editor.quote_name(model._meta.db_table),))
+
+
+def _document_words(connection, pks):
+    """Returns {document id: words} of the text of the documents."""
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('SELECT rowid, content FROM "Search_fts" WHERE rowid IN (%s)' %
+                           (placeholders,), pks)
+            return {pk: spelling.split_words(content or '')
+                    for pk, content in cursor.fetchall()}
+        # The words of the text have weight D. See backends._PostgresDialect.
+        cursor.execute("SELECT id, tsvector_to_array(ts_filter(content_vector, '{d}')) "
+                       'FROM "Search_searchdocument" WHERE id IN (%s)' % (placeholders,),
+                       pks)
+        return {pk: words or [] for pk, words in cursor.fetchall()}
+
+
+def split_vocabulary_per_org(apps, schema_editor):
+    SearchDocumentModel = apps.get_model('Search', 'SearchDocument')
+    SearchTermModel = apps.get_model('Search', 'SearchTerm')
+    SearchWordModel = apps.get_model('Search', 'SearchWord')
+    SearchWordTrigramModel = apps.get_model('Search', 'SearchWordTrigram')
+    connection = schema_editor.connection
+    alias = connection.alias
+    if not SearchWordModel.objects.using(alias).exists():
+        return
+    _clear_vocabulary(apps, schema_editor)
+
+    words_by_org = {}
+    last_id = 0
+    while True:
+        pks = list(SearchDocumentModel.objects.using(alias).filter(id__gt=last_id)
+                   .order_by('id').values_list('id', flat=True)[:BATCH_SIZE])
+        if not pks:
+            break
+        last_id = pks[-1]
+        org_ids = dict(SearchTermModel.objects.using(alias)
+                       .filter(document_id__in=pks, field=SPELLING_ORG_FIELD)
+                       .values_list('document_id', 'value'))
+        for pk, words in _document_words(connection, pks).items():
+            org_id = org_ids.get(pk, '')
+            org_id = int(org_id) if org_id.isdigit() else spelling.NO_ORG
+            words_by_org.setdefault(org_id, set()).update(
+                word for word in words if spelling.is_vocabulary_word(word))
+
+    word_count = 0
+    for org_id, words in sorted(words_by_org.items()):
+        words = sorted(words)
+        for i in range(0, len(words), BATCH_SIZE):
+            chunk = words[i:i + BATCH_SIZE]
+            SearchWordModel.objects.using(alias).bulk_create(
+                [SearchWordModel(org_id=org_id, word=word) for word in chunk])
+            word_ids = SearchWordModel.objects.using(alias) \
+                .filter(org_id=org_id, word__in=chunk).values_list('word', 'id')
+            SearchWordTrigramModel.objects.using(alias).bulk_create(
+                [SearchWordTrigramModel(word_id=word_id, org_id=org_id, trigram=trigram)
+                 for word, word_id in word_ids
+                 for trigram in sorted(spelling.trigrams(word))],
+                batch_size=BATCH_SIZE)
+        word_count += len(words)
+    logger.info("Split the search vocabulary into %d words of %d Orgs." %
+                (word_count, len(words_by_org)))
+
+
+def clear_vocabulary(apps, schema_editor):
+    # The words of several Orgs cannot be kept once unique again. 'update_index' adds
+    # them back.
+    _clear_vocabulary(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Search', '0004_reindex_checkpoints'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='searchwordtrigram',
+            name='search_trigram_idx',
+        ),
+        migrations.AddField(
+            model_name='searchword',
+            name='org_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='searchwordtrigram',
+            name='org_id',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='searchword',
+            name='word',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchword',
+            unique_together={('org_id', 'word')},
+        ),
+        migrations.AddIndex(
+            model_name='searchwordtrigram',
+            index=models.Index(fields=['org_id', 'trigram'], name='search_trigram_org_idx'),
+        ),
+        migrations.RunPython(split_vocabulary_per_org, clear_vocabulary),
+    ]
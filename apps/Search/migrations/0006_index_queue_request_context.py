@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Search', '0005_org_search_words'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexqueueentry',
+            name='request_context',
+            field=models.TextField(default='{}'),
+        ),
+    ]
@@ -0,0 +1,215 @@
+from django.db import models
+from django.utils import timezone
+
+
+class IndexQueueEntry(models.Model):
+    """
+    An object whose search index entry is out of date. Written by the
+    QueuedSignalProcessor (see signals.py) when an indexed object is saved or deleted and
+    removed by the 'run_index_worker' command once the index has been updated.
+
+    Rows are only ever inserted by the web requests, so queueing costs one small INSERT
+    and never waits for the search engine. Repeated saves of an object add repeated rows
+    which are coalesced by the worker into a single index update.
+    """
+
+    # Model of the object stored as '<app_label>.<model_name>'. Same as HistoryEntry.
+    model = models.CharField(max_length=100)
+
+    # pk of the object. Not a FK as deleted objects have to be removed from the index.
+    object_id = models.PositiveIntegerField()
+
+    # Used to measure how far behind the index is.
+    queued_at = models.DateTimeField(default=timezone.now)
+
+    # JSON object of the request context the object was queued in (see
+    # apps.Core.context.capture). Bound by the worker while updating the index.
+    request_context = models.TextField(default='{}')
+
+    class Meta:
+        verbose_name = "index queue entry"
+        verbose_name_plural = "index queue entries"
+        # Oldest first. The pk increases with time and is used for ordering.
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['model', 'object_id'], name='search_queue_obj_idx'),
+        ]
+
+    def __str__(self):
+        return "%s:%s queued @ %s" % (self.model, self.object_id, self.queued_at)
+
+
+class SearchDocument(models.Model):
+    """
+    A document of the database search backend (see backends.py). One per indexed object.
+
+    Only the stored fields returned with the results are kept here. The text searched
+    lives in a full text index maintained by the backend next to this table (an FTS5
+    table on SQLite, a tsvector column on Postgres) and the values filtered on in
+    SearchTerm.
+    """
+
+    # Same identifier as the other haystack backends: '<app_label>.<model_name>.<pk>'
+    doc_id = models.CharField(max_length=255, unique=True)
+    django_ct = models.CharField(max_length=100)
+    django_id = models.CharField(max_length=100)
+
+    # JSON object of the stored fields.
+    stored = models.TextField()
+
+    class Meta:
+        verbose_name = "search document"
+        verbose_name_plural = "search documents"
+        indexes = [
+            models.Index(fields=['django_ct'], name='search_doc_ct_idx'),
+        ]
+
+    def __str__(self):
+        return self.doc_id
+
+
+class SearchTerm(models.Model):
+    """
+    Value of an indexed (non full text) field of a SearchDocument. Filters like
+    'org_id=3' are answered from this table. Multi valued fields have a row per value.
+    """
+
+    # Deleted by the backend before the document. Avoids the ORM collecting the rows.
+    # Indexed by search_term_document_idx below.
+    document = models.ForeignKey(SearchDocument, on_delete=models.DO_NOTHING,
+                                 related_name='terms', db_index=False)
+    field = models.CharField(max_length=100)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        verbose_name = "search term"
+        verbose_name_plural = "search terms"
+        indexes = [
+            models.Index(fields=['field', 'value'], name='search_term_value_idx'),
+            # Covers the filters probed per document matched by the full text index.
+            models.Index(fields=['document', 'field', 'value'],
+                         name='search_term_document_idx'),
+        ]
+
+    def __str__(self):
+        return "%s=%s" % (self.field, self.value)
+
+
+class SearchWord(models.Model):
+    """
+    A word of the indexed documents of an Org. The vocabulary the spelling suggestions
+    of the database search backend are picked from (see spelling.py).
+    """
+
+    # Org of the documents the word is in. 0 for the documents of no Org.
+    org_id = models.PositiveIntegerField(default=0)
+    word = models.CharField(max_length=100)
+
+    class Meta:
+        unique_together = [('org_id', 'word')]
+
+    def __str__(self):
+        return self.word
+
+
+class SearchWordTrigram(models.Model):
+    """
+    Trigrams of a SearchWord. Misspelt words are matched to the words of the Org sharing
+    most of their trigrams.
+    """
+
+    word = models.ForeignKey(SearchWord, on_delete=models.CASCADE,
+                             related_name='trigrams')
+    # Same as the org_id of the word. Lets the index below match the trigrams of an Org.
+    org_id = models.PositiveIntegerField(default=0)
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['org_id', 'trigram'], name='search_trigram_org_idx'),
+        ]
+
+    def __str__(self):
+        return "%s:%s" % (self.trigram, self.word_id)
+
+
+class OrgIndexGeneration(models.Model):
+    """
+    Number of times the search index entries of an Org have changed. It is part of the
+    keys of the cached search results of the Org (see result_cache.py), hence bumping it
+    invalidates them. Kept in the DB, rather than the cache, as the index worker which
+    updates the index does not share a cache with the web workers.
+    """
+
+    # id of the Org. Not a FK, like the other models of this app, so that the migrations
+    # of this app do not depend on those of the Organization app.
+    org_id = models.PositiveIntegerField(primary_key=True)
+    generation = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "org index generation"
+        verbose_name_plural = "org index generations"
+
+    def __str__(self):
+        return "%s:%d" % (self.org_id, self.generation)
+
+
+
+class ReindexCheckpoint(models.Model):
+    """
+    Progress of the incremental 'reindex' command for a model on a haystack connection
+    (see reindex.py). A run indexes the objects changed since the previous completed
+    run. Its work is split into ReindexChunks, so that an interrupted run resumes with
+    the chunks which were not done.
+    """
+
+    # Model of the objects stored as '<app_label>.<model_name>'. Same as IndexQueueEntry.
+    model = models.CharField(max_length=100)
+    # Alias of the haystack connection.
+    using = models.CharField(max_length=100)
+
+    # The objects changed before this were indexed by the last completed run. Null till
+    # the first run completes.
+    indexed_until = models.DateTimeField(null=True, blank=True)
+
+    # Objects changed since run_since (all the objects when null) are indexed by the run
+    # in progress, which started at run_started_at. Null when no run is in progress.
+    run_since = models.DateTimeField(null=True, blank=True)
+    run_started_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "reindex checkpoint"
+        verbose_name_plural = "reindex checkpoints"
+        unique_together = [('model', 'using')]
+
+    def __str__(self):
+        return "%s@%s indexed until %s" % (self.model, self.using, self.indexed_until)
+
+
+class ReindexChunk(models.Model):
+    """
+    The objects of a run of the 'reindex' command with pks in [first_pk, last_pk], of
+    an Org when org_id is set. Indexed by a single worker in one go.
+    """
+
+    checkpoint = models.ForeignKey(ReindexCheckpoint, on_delete=models.CASCADE,
+                                   related_name='chunks')
+    # id of the Org when the run is split by Org. Not a FK, see OrgIndexGeneration.
+    org_id = models.PositiveIntegerField(null=True, blank=True)
+    first_pk = models.PositiveIntegerField()
+    last_pk = models.PositiveIntegerField()
+    done = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "reindex chunk"
+        verbose_name_plural = "reindex chunks"
+        ordering = ['id']
+
+    def __str__(self):
+        return "%s:%s-%s%s" % (self.org_id, self.first_pk, self.last_pk,
+                               " done" if self.done else "")
+
+
+# Connect the receivers invalidating the local autocomplete indexes and the cached search
+# results on Resource changes.
+from . import autocomplete, result_cache  # noqa: E402,F401
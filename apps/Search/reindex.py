@@ -0,0 +1,374 @@
+"""Incremental, resumable and parallel reindexing of the indexed models.
+
+A replacement for 'rebuild_index', whose cost grows with the number of objects, for
+bringing the search index up to date, Eg: on every start of the app. Used by the
+'reindex' command.
+
+A run indexes the objects of a model changed since the previous completed run, using the
+field returned by get_updated_field() of its SearchIndex (Resource.modified_at). Models
+without one are indexed in full on every run. A run:
+
+    1. Plans the work: the pks of the objects changed are split into ReindexChunks of
+       at most 'chunk_size' objects, per Org or by pk range only.
+    2. Indexes the chunks, in a pool of worker processes when asked to. A chunk is
+       marked done once its objects were sent to the search engine.
+    3. Once all the chunks are done, moves the checkpoint (ReindexCheckpoint) to the
+       time the run started.
+
+An interrupted run is resumed by the next one with the chunks which were not done. As
+the timestamps are set by the app servers before their transactions commit, the next
+run starts SEARCH_REINDEX_OVERLAP seconds before the checkpoint. Indexing an object
+twice is harmless.
+
+The timestamps do not tell about deleted objects. verify() compares the pks of the
+objects of each Org in the DB with those in the index, and fix() indexes the missing
+objects and removes the ones deleted.
+
+NOTE: Changes to the fields of a SearchIndex still need 'rebuild_index' (or
+'clear_index' followed by 'reindex --full').
+"""
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+import multiprocessing
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from haystack import connections as haystack_connections
+from haystack.query import SearchQuerySet
+from haystack.utils import get_model_ct
+
+from .backends import DatabaseSearchBackend
+from .index_queue import _commit, _remove_many
+from .models import ReindexCheckpoint, ReindexChunk, SearchDocument
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Max number of objects of a ReindexChunk.
+DEFAULT_CHUNK_SIZE = 5000
+
+# Number of objects sent to the search engine per request.
+DEFAULT_BATCH_SIZE = 500
+
+SPLIT_ORG = 'org'
+SPLIT_RANGE = 'range'
+
+# Number of index entries read per query when the pks are read using searches.
+_PAGE_SIZE = 1000
+
+
+def get_reindex_overlap():
+    return timedelta(seconds=getattr(settings, 'SEARCH_REINDEX_OVERLAP', 300))
+
+
+def has_org(model):
+    """Returns True when the objects of the model belong to an Org ('org' FK)."""
+    return any(field.attname == 'org_id' for field in model._meta.concrete_fields)
+
+
+def get_indexed_models(using):
+    """Returns [(model, index), ...] of the models indexed on the haystack connection."""
+    unified_index = haystack_connections[using].get_unified_index()
+    return [(model, unified_index.get_index(model))
+            for model in sorted(unified_index.get_indexed_models(),
+                                key=lambda model: model._meta.label_lower)]
+
+
+def _get_backend(using):
+    backend = haystack_connections[using].get_backend()
+    # Failures should leave the chunk pending instead of being logged and dropped.
+    backend.silently_fail = False
+    return backend
+
+
+def get_max_workers(using, workers):
+    """Returns the number of worker processes to be used for the haystack connection.
+    SQLite allows a single writer, hence the database backend on it gets one.
+    """
+    backend = haystack_connections[using].get_backend()
+    if isinstance(backend, DatabaseSearchBackend) and \
+            connections[backend.using].vendor == 'sqlite':
+        return 1
+    return workers
+
+
+def _get_index(checkpoint):
+    for model, index in get_indexed_models(checkpoint.using):
+        if model._meta.label_lower == checkpoint.model:
+            return model, index
+    raise LookupError("%s is not indexed on the connection '%s'." %
+                      (checkpoint.model, checkpoint.using))
+
+
+def _changed_objects(model, index, using, since):
+    """Returns the queryset of the objects to be indexed changed since 'since'."""
+    queryset = index.index_queryset(using=using)
+    updated_field = index.get_updated_field()
+    if since is not None and updated_field:
+        queryset = queryset.filter(**{'%s__gte' % (updated_field,): since})
+    return queryset
+
+
+def start_run(model, index, using, split=SPLIT_ORG, chunk_size=DEFAULT_CHUNK_SIZE,
+              full=False):
+    """Returns the checkpoint of the run of the model to be done, along with whether it
+    resumes an interrupted run. Plans a new run when there is none in progress.
+
+    Arguments:
+        model {Model} -- Indexed model.
+        index {SearchIndex} -- Its index.
+        using {str} -- Alias of the haystack connection.
+
+    Keyword Arguments:
+        split {str} -- SPLIT_ORG: chunks of a single Org. SPLIT_RANGE: by pk only.
+        chunk_size {int} -- Max number of objects per chunk.
+        full {bool} -- Index all the objects. Drops the run in progress, if any.
+
+    Returns:
+        tuple -- (ReindexCheckpoint, resumed)
+    """
+    label = model._meta.label_lower
+    with transaction.atomic():
+        checkpoint, _ = ReindexCheckpoint.objects.select_for_update() \
+            .get_or_create(model=label, using=using)
+        if checkpoint.run_started_at is not None and not full:
+            return checkpoint, True
+
+        checkpoint.run_started_at = timezone.now()
+        checkpoint.run_since = None
+        if not full and checkpoint.indexed_until is not None:
+            checkpoint.run_since = checkpoint.indexed_until - get_reindex_overlap()
+        checkpoint.save()
+        checkpoint.chunks.all().delete()
+
+        by_org = split == SPLIT_ORG and has_org(model)
+        fields = ('org_id', 'pk') if by_org else ('pk',)
+        rows = _changed_objects(model, index, using, checkpoint.run_since) \
+            .order_by(*fields).values_list(*fields)
+
+        chunks, chunk, count = [], None, 0
+        for row in rows.iterator():
+            org_id, pk = row if by_org else (None, row[0])
+            if chunk is None or chunk.org_id != org_id or count == chunk_size:
+                chunk = ReindexChunk(checkpoint=checkpoint, org_id=org_id, first_pk=pk)
+                chunks.append(chunk)
+                count = 0
+            chunk.last_pk = pk
+            count += 1
+        ReindexChunk.objects.bulk_create(chunks, batch_size=DEFAULT_BATCH_SIZE)
+
+    logger.info("Planned the reindex of %s on '%s'. Since:%s Chunks:%d" %
+                (label, using, checkpoint.run_since, len(chunks)))
+    return checkpoint, False
+
+
+def pending_chunk_ids(checkpoint):
+    return list(checkpoint.chunks.filter(done=False).values_list('pk', flat=True))
+
+
+def reindex_chunk(chunk_id, batch_size=DEFAULT_BATCH_SIZE):
+    """Indexes the objects of the chunk and marks it done. Runs in the worker processes.
+
+    Returns:
+        int -- Number of objects indexed.
+    """
+    from .signals import index_updated
+
+    chunk = ReindexChunk.objects.select_related('checkpoint').get(pk=chunk_id)
+    if chunk.done:
+        return 0
+    checkpoint = chunk.checkpoint
+    model, index = _get_index(checkpoint)
+    backend = _get_backend(checkpoint.using)
+
+    queryset = _changed_objects(model, index, checkpoint.using, checkpoint.run_since) \
+        .filter(pk__gte=chunk.first_pk, pk__lte=chunk.last_pk).order_by('pk')
+    if chunk.org_id is not None:
+        queryset = queryset.filter(org_id=chunk.org_id)
+
+    pks = []
+    last_pk = None
+    while True:
+        batch_queryset = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        batch = list(batch_queryset[:batch_size])
+        if not batch:
+            break
+        backend.update(index, batch, commit=False)
+        pks.extend(obj.pk for obj in batch)
+        last_pk = batch[-1].pk
+    _commit(backend)
+
+    ReindexChunk.objects.filter(pk=chunk_id).update(done=True)
+    if pks:
+        index_updated.send(sender=model, pks=pks, removed_pks=[])
+    logger.debug("Reindexed chunk %s. Objects:%d" % (chunk, len(pks)))
+    return len(pks)
+
+
+def _init_worker():
+    # The search engine connections of the parent process can not be shared. The DB
+    # connections were closed by the parent before starting the workers.
+    for alias in haystack_connections.connections_info:
+        haystack_connections.reload(alias)
+
+
+def run_chunks(chunk_ids, workers=1, batch_size=DEFAULT_BATCH_SIZE):
+    """Indexes the chunks, in a pool of 'workers' processes when more than 1.
+
+    Yields:
+        tuple -- (chunk id, number of objects indexed or the exception raised), as the
+                 chunks complete.
+    """
+    if workers <= 1:
+        for chunk_id in chunk_ids:
+            try:
+                yield chunk_id, reindex_chunk(chunk_id, batch_size)
+            except Exception as e:
+                logger.exception("Failed to reindex chunk %d" % (chunk_id,))
+                yield chunk_id, e
+        return
+
+    # Forked, as the workers need the settings and the apps of this process. The
+    # connections are opened again by the workers.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('fork'),
+                             initializer=_init_worker) as executor:
+        futures = {executor.submit(reindex_chunk, chunk_id, batch_size): chunk_id
+                   for chunk_id in chunk_ids}
+        try:
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    logger.error("Failed to reindex chunk %d: %s" % (futures[future], e))
+                    yield futures[future], e
+        except BaseException:
+            # Eg: KeyboardInterrupt. The chunks which were not started stay pending.
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+def finish_run(checkpoint):
+    """Moves the checkpoint to the start of the run when all its chunks are done.
+
+    Returns:
+        bool -- False when some chunks are still pending.
+    """
+    with transaction.atomic():
+        checkpoint = ReindexCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+        if checkpoint.run_started_at is None:
+            return True
+        if checkpoint.chunks.filter(done=False).exists():
+            return False
+        checkpoint.indexed_until = checkpoint.run_started_at
+        checkpoint.run_since = checkpoint.run_started_at = None
+        checkpoint.save()
+        checkpoint.chunks.all().delete()
+    return True
+
+
+def iter_indexed_pks(using, model, org_id=None):
+    """Yields the pks of the objects of the model in the index.
+
+    Arguments:
+        using {str} -- Alias of the haystack connection.
+        model {Model} -- Indexed model.
+
+    Keyword Arguments:
+        org_id {int} -- Only those of the Org when set, using the 'org_id' field of the
+                        index. (default: {None})
+    """
+    model_ct = get_model_ct(model)
+    backend = _get_backend(using)
+
+    if isinstance(backend, DatabaseSearchBackend):
+        documents = SearchDocument.objects.using(backend.using).filter(django_ct=model_ct)
+        if org_id is not None:
+            documents = documents.filter(terms__field='org_id',
+                                         terms__value=str(org_id))
+        for django_id in documents.values_list('django_id', flat=True).iterator():
+            yield int(django_id)
+        return
+
+    conn = getattr(backend, 'conn', None)
+    index_name = getattr(backend, 'index_name', None)
+    if conn is not None and index_name is not None:
+        # Elasticsearch: scrolled through, as searches can not page past 10000 hits.
+        from elasticsearch.helpers import scan
+
+        if not backend.setup_complete:
+            backend.setup()
+        conditions = [{'term': {'django_ct': model_ct}}]
+        if org_id is not None:
+            conditions.append({'term': {'org_id': org_id}})
+        query = {'query': {'bool': {'filter': conditions}}, '_source': False}
+        for hit in scan(conn, query=query, index=index_name, doc_type='modelresult'):
+            yield int(hit['_id'].rsplit('.', 1)[1])
+        return
+
+    sqs = SearchQuerySet(using=using).models(model)
+    if org_id is not None:
+        sqs = sqs.filter(org_id=org_id)
+    start = 0
+    while True:
+        page = list(sqs[start:start + _PAGE_SIZE])
+        for result in page:
+            yield int(result.pk)
+        if len(page) < _PAGE_SIZE:
+            break
+        start += _PAGE_SIZE
+
+
+def verify(using, model, index, org_id=None):
+    """Compares the pks of the objects in the index with those in the DB.
+
+    Arguments:
+        using {str} -- Alias of the haystack connection.
+        model {Model} -- Indexed model.
+        index {SearchIndex} -- Its index.
+
+    Keyword Arguments:
+        org_id {int} -- Only compares those of the Org when set. (default: {None})
+
+    Returns:
+        tuple -- (missing, extra) sets of pks. Objects not in the index and index
+                 entries of objects which are not in the DB (or the Org) any more.
+    """
+    # The index is read first. Objects added in between are reported missing and
+    # indexed by fix(), instead of having their new entries removed.
+    indexed = set(iter_indexed_pks(using, model, org_id))
+    queryset = index.index_queryset(using=using)
+    if org_id is not None:
+        queryset = queryset.filter(org_id=org_id)
+    present = set(queryset.values_list('pk', flat=True).iterator())
+    return present - indexed, indexed - present
+
+
+def fix(using, model, index, missing, extra, batch_size=DEFAULT_BATCH_SIZE):
+    """Indexes the missing objects and removes the extra entries found by verify()."""
+    from .signals import index_updated
+
+    backend = _get_backend(using)
+    missing, extra = sorted(missing), sorted(extra)
+    queryset = index.index_queryset(using=using)
+    for i in range(0, len(missing), batch_size):
+        backend.update(index, list(queryset.filter(pk__in=missing[i:i + batch_size])),
+                       commit=False)
+    for i in range(0, len(extra), batch_size):
+        chunk = extra[i:i + batch_size]
+        # Objects moved to another Org are indexed again rather than removed.
+        moved = list(queryset.filter(pk__in=chunk))
+        if moved:
+            backend.update(index, moved, commit=False)
+        moved_pks = {obj.pk for obj in moved}
+        removed = ["%s.%s" % (model._meta.label_lower, pk) for pk in chunk
+                   if pk not in moved_pks]
+        if removed:
+            _remove_many(backend, removed)
+    _commit(backend)
+    if missing or extra:
+        index_updated.send(sender=model, pks=missing, removed_pks=extra)
@@ -0,0 +1,194 @@
+"""Cache of the pages of search results of the Orgs.
+
+A page of results of ResourceSearchView is cached against the Org, the query of the
+SearchQuerySet searched (as sent to the search engine, hence including the Org and the
+filters applied on it), its facets and ordering, the text entered and the page, along
+with the number of hits, the facet counts and the spelling suggestion. Repeated searches
+within an Org are answered without querying the search engine. A search which is not
+cached costs a single query, as the hit count and the facet counts are returned along
+with the page (Elasticsearch also returns the spelling suggestion along with it).
+
+Spelling suggestions are only asked for when the query has at most
+SEARCH_SPELLING_SUGGESTION_MAX_HITS hits.
+
+The keys include the index generation of the Org (OrgIndexGeneration), bumped whenever
+the index entries of the Resources of the Org change:
+    - On save / delete of a Resource, when the index is updated as part of the save
+      (RealtimeSignalProcessor).
+    - When the index worker or update_search_index() has updated them (see
+      signals.index_updated). The Orgs of the Resources removed by the worker are not
+      known any more, hence the generations of all the Orgs are bumped for them.
+'rebuild_index' / 'update_index' do not bump the generations. Cached pages expire after
+SEARCH_RESULT_CACHE_TIMEOUT seconds in any case. Set it to 0 to disable the cache.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.Organization.models import Org
+from apps.Resource.models import Resource
+from .index_queue import is_queue_enabled
+from .models import OrgIndexGeneration
+from .signals import index_updated
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Keeps the 'IN' lists within the parameter limits of all the supported DBs.
+_QUERY_CHUNK_SIZE = 500
+
+
+def get_result_cache_timeout():
+    return getattr(settings, 'SEARCH_RESULT_CACHE_TIMEOUT', 300)
+
+
+def get_spelling_suggestion_max_hits():
+    return getattr(settings, 'SEARCH_SPELLING_SUGGESTION_MAX_HITS', 5)
+
+
+def get_query_signature(searchqueryset):
+    """Returns the text identifying the results of the SearchQuerySet: its class (none()
+    returns an EmptySearchQuerySet, whose query is the one of all()), the query sent to
+    the search engine, the narrowing queries, the facets, the ordering and the models.
+    """
+    query = searchqueryset.query
+    facets = sorted((name, sorted(options.items()))
+                    for name, options in query.facets.items())
+    return '%s\n%s\n%r\n%r\n%r\n%r' % (
+        type(searchqueryset).__name__, query, sorted(query.narrow_queries), facets,
+        query.order_by, sorted(model._meta.label for model in query.models))
+
+
+def get_generation(org_id):
+    """Returns the index generation of the Org."""
+    generation = OrgIndexGeneration.objects.filter(org_id=org_id) \
+        .values_list('generation', flat=True).first()
+    return generation or 0
+
+
+def bump_generations(org_ids=None):
+    """Invalidates the cached search results of the Orgs passed.
+
+    Keyword Arguments:
+        org_ids {iterable} -- ids of the Orgs. All the Orgs when None. (default: {None})
+    """
+    if org_ids is None:
+        OrgIndexGeneration.objects.update(generation=F('generation') + 1)
+        org_ids = Org.objects.exclude(
+            pk__in=OrgIndexGeneration.objects.values('org_id')).values_list('pk',
+                                                                            flat=True)
+    else:
+        org_ids = {org_id for org_id in org_ids if org_id is not None}
+        if not org_ids:
+            return
+        updated = OrgIndexGeneration.objects.filter(org_id__in=org_ids) \
+            .update(generation=F('generation') + 1)
+        if updated == len(org_ids):
+            return
+
+    # The Orgs without a row are at generation 0. Any other value will do for them.
+    # ignore_conflicts: the rows bumped above and rows added by others in between.
+    OrgIndexGeneration.objects.bulk_create(
+        [OrgIndexGeneration(org_id=org_id, generation=1) for org_id in org_ids],
+        batch_size=_QUERY_CHUNK_SIZE, ignore_conflicts=True)
+
+
+class CachedSearchResults:
+    """The results of a SearchQuerySet as seen by the Paginator, with the page requested
+    answered from the cache. The key is built from the searchqueryset itself (see
+    get_query_signature()), not from what the caller says it searched.
+
+    Arguments:
+        searchqueryset {SearchQuerySet} -- Search restricted to the Org.
+        org_id {int} -- id of the Org searched. Its index generation invalidates the
+                        cached pages.
+        query {str} -- Text entered by the user, which the spelling suggestion is for.
+        page_number {int} -- Page requested (1 based).
+        page_size {int} -- Results per page.
+    """
+
+    def __init__(self, searchqueryset, org_id, query, page_number, page_size):
+        # The suggestion is computed for the text entered, not the query sent to the
+        # search engine (which includes the Org filter).
+        self.searchqueryset = searchqueryset.set_spelling_query(query)
+        self.query = query
+        self.start = (page_number - 1) * page_size
+        self.end = self.start + page_size
+        digest = hashlib.md5(('%s\n%s\n%d\n%d' % (
+            get_query_signature(self.searchqueryset), query, page_number, page_size))
+            .encode('utf-8')).hexdigest()
+        self.key = 'search:results:%d:%d:%s' % (org_id, get_generation(org_id), digest)
+        self._entry = None
+
+    def _get_entry(self):
+        if self._entry is None:
+            timeout = get_result_cache_timeout()
+            entry = cache.get(self.key) if timeout else None
+            if entry is None:
+                entry = self._search()
+                if timeout:
+                    cache.set(self.key, entry, timeout)
+            self._entry = entry
+        return self._entry
+
+    def _search(self):
+        # The hit count is returned along with the page. A single query.
+        results = list(self.searchqueryset[self.start:self.end])
+        hits = self.searchqueryset.count()
+        facets = self.searchqueryset.facet_counts().get('fields', {})
+        spelling_suggestion = None
+        if self.query.strip() and hits <= get_spelling_suggestion_max_hits():
+            spelling_suggestion = self.searchqueryset.spelling_suggestion(self.query)
+        logger.debug("Searched '%s'. Hits:%d" % (self.query, hits))
+        return {'hits': hits, 'results': results, 'facets': facets,
+                'spelling_suggestion': spelling_suggestion}
+
+    def count(self):
+        return self._get_entry()['hits']
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        # The Paginator asks for [start:end], or [start:hits] for the last page.
+        if isinstance(index, slice) and (index.start or 0) == self.start and \
+                index.step is None and index.stop is not None and index.stop <= self.end:
+            return self._get_entry()['results'][:index.stop - self.start]
+        return self.searchqueryset[index]
+
+    def facet_counts(self):
+        """Returns {field name: [(value, count), ...]} of the fields faceted on."""
+        return self._get_entry()['facets']
+
+    def spelling_suggestion(self):
+        """Returns the spelling suggestion for the query. None when the query has more
+        than SEARCH_SPELLING_SUGGESTION_MAX_HITS hits.
+        """
+        return self._get_entry()['spelling_suggestion']
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+def invalidate_saved_resource(sender, instance, **kwargs):
+    # Queued index updates are applied later by the worker, which sends index_updated.
+    if not is_queue_enabled():
+        bump_generations([instance.org_id])
+
+
+@receiver(index_updated, sender=Resource)
+def invalidate_reindexed_resources(sender, pks, removed_pks, **kwargs):
+    if removed_pks:
+        bump_generations()
+        return
+
+    pks = list(pks)
+    org_ids = set()
+    for i in range(0, len(pks), _QUERY_CHUNK_SIZE):
+        org_ids.update(Resource.objects.filter(pk__in=pks[i:i + _QUERY_CHUNK_SIZE])
+                       .values_list('org_id', flat=True).distinct())
+    bump_generations(org_ids)
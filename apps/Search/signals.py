@@ -0,0 +1,54 @@
+"""Haystack signal processor which queues the index updates instead of making them.
+
+Enable it using
+    HAYSTACK_SIGNAL_PROCESSOR = 'apps.Search.signals.QueuedSignalProcessor'
+and run 'python manage.py run_index_worker' to apply the queued updates.
+
+Unlike the RealtimeSignalProcessor, a save never waits on the search engine and a slow
+or unavailable search engine does not affect the requests. Searches see the change once
+the worker has processed it (see index_queue.queue_stats() for the lag).
+"""
+
+from django.db import models
+from django.dispatch import Signal
+
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+
+from .index_queue import enqueue
+
+# Sent after the search index entries of objects were updated outside of the signal
+# processor: by the index worker (see index_queue.py) and by code reindexing objects
+# changed in bulk. sender is the model class, pks the pks of the objects which were
+# updated and removed_pks the pks of the objects which were removed from the index.
+index_updated = Signal(providing_args=['pks', 'removed_pks'])
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def is_indexed(self, sender):
+        for using in self.connections.connections_info:
+            try:
+                self.connections[using].get_unified_index().get_index(sender)
+                return True
+            except NotHandled:
+                pass
+        return False
+
+    def handle_save(self, sender, instance, **kwargs):
+        # Saves of all the models are received. Only queue the ones being indexed.
+        if self.is_indexed(sender):
+            enqueue(sender, [instance.pk])
+
+    def handle_delete(self, sender, instance, **kwargs):
+        # The worker removes the objects which no longer exist.
+        if self.is_indexed(sender):
+            enqueue(sender, [instance.pk])
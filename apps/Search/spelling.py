@@ -0,0 +1,171 @@
+"""Spelling suggestions of the database search backend.
+
+Every word of the indexed text is added once per Org to the SearchWord vocabulary along
+with its trigrams (the word padded with '$' on both sides, split into every run of 3
+characters). A word of a query which is not in the vocabulary of the Org searched is
+replaced by the word of the Org sharing the largest fraction of its trigrams, when that
+fraction is above MIN_SIMILARITY. Eg: 'lenova' -> 'lenovo', 'touchscren' ->
+'touchscreen'. The words of the other Orgs are never suggested, as their documents are
+never found.
+
+Words are never removed from the vocabulary when documents are removed. The backend
+clears it along with the documents on 'clear_index' / 'rebuild_index'.
+"""
+
+import re
+
+from django.db import connections
+from django.db.models import Count
+
+from .models import SearchWord, SearchWordTrigram
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Words shorter than this are not corrected and not added to the vocabulary.
+MIN_WORD_LENGTH = 3
+MAX_WORD_LENGTH = SearchWord._meta.get_field('word').max_length
+
+# Number of words sharing most trigrams compared with a misspelt word.
+CANDIDATE_COUNT = 20
+
+# Fraction of the trigrams of the two words (Jaccard) which should be common.
+MIN_SIMILARITY = 0.3
+
+# org_id of the words of the documents of no Org.
+NO_ORG = 0
+
+# Keeps the 'IN' lists within the parameter limits of all the supported DBs.
+_QUERY_CHUNK_SIZE = 500
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def split_words(text):
+    """Returns the casefolded words of the text."""
+    return _WORD_RE.findall(text.casefold())
+
+
+def trigrams(word):
+    """Returns the set of trigrams of the word."""
+    padded = '$%s$' % (word,)
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def is_vocabulary_word(word):
+    return MIN_WORD_LENGTH <= len(word) <= MAX_WORD_LENGTH and not word.isdigit()
+
+
+def _chunks(values, size=_QUERY_CHUNK_SIZE):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _words_of(org_id, using):
+    """Returns the SearchWords of the Org, of all the Orgs when org_id is None."""
+    words = SearchWord.objects.using(using)
+    return words if org_id is None else words.filter(org_id=org_id)
+
+
+def _word_ids(words, org_id, using):
+    """Returns word -> id of the words passed which are in the vocabulary of the Org.
+    See _words_of().
+    """
+    word_ids = {}
+    for chunk in _chunks(words):
+        word_ids.update(_words_of(org_id, using).filter(word__in=chunk)
+                        .values_list('word', 'id'))
+    return word_ids
+
+
+def add_words(words, org_id=NO_ORG, using='default'):
+    """Adds the words which are not yet in the vocabulary of the Org along with their
+    trigrams.
+
+    Arguments:
+        words {iterable} -- Casefolded words (see split_words()).
+
+    Keyword Arguments:
+        org_id {int} -- id of the Org of the documents the words are in.
+        using {str} -- Alias of the database.
+    """
+    words = {word for word in words if is_vocabulary_word(word)}
+    if not words:
+        return
+    new_words = words - set(_word_ids(words, org_id, using))
+    if not new_words:
+        return
+
+    # ignore_conflicts: another process may have added some of them in between.
+    SearchWord.objects.using(using).bulk_create(
+        [SearchWord(org_id=org_id, word=word) for word in sorted(new_words)],
+        ignore_conflicts=True)
+    word_ids = _word_ids(new_words, org_id, using)
+    SearchWordTrigram.objects.using(using).bulk_create(
+        [SearchWordTrigram(word_id=word_ids[word], org_id=org_id, trigram=trigram)
+         for word in sorted(word_ids) for trigram in sorted(trigrams(word))],
+        batch_size=_QUERY_CHUNK_SIZE)
+    logger.debug("Added %d words to the search vocabulary of the Org %d" %
+                 (len(word_ids), org_id))
+
+
+def clear_words(using='default'):
+    """Removes all the words of the vocabulary."""
+    # Raw deletes. The ORM would load every row to send post_delete for it.
+    with connections[using].cursor() as cursor:
+        for model in (SearchWordTrigram, SearchWord):
+            cursor.execute('DELETE FROM %s' %
+                           (connections[using].ops.quote_name(model._meta.db_table),))
+
+
+def _closest_word(word, org_id, using):
+    word_trigrams = trigrams(word)
+    candidates = SearchWordTrigram.objects.using(using).filter(trigram__in=word_trigrams)
+    if org_id is not None:
+        candidates = candidates.filter(org_id=org_id)
+    # distinct: a word of several Orgs when searching all of them.
+    candidates = candidates.values('word__word') \
+        .annotate(shared=Count('trigram', distinct=True)) \
+        .order_by('-shared', 'word__word')[:CANDIDATE_COUNT]
+
+    best, best_similarity = None, MIN_SIMILARITY
+    for candidate in candidates:
+        candidate_word = candidate['word__word']
+        shared = candidate['shared']
+        union = len(word_trigrams) + len(trigrams(candidate_word)) - shared
+        similarity = shared / union
+        if similarity > best_similarity:
+            best, best_similarity = candidate_word, similarity
+    return best
+
+
+def suggest(text, org_id=None, using='default'):
+    """Returns the text with its misspelt words replaced by the closest words of the
+    vocabulary of the Org. The text itself is returned when no word needed correction.
+
+    Arguments:
+        text {str} -- Text of the query.
+
+    Keyword Arguments:
+        org_id {int} -- id of the Org searched. All the Orgs when None. (default: {None})
+        using {str} -- Alias of the database.
+
+    Returns:
+        str -- Suggested query. None when the text has no words.
+    """
+    words = split_words(text or '')
+    if not words:
+        return None
+    known = set(_word_ids(words, org_id, using))
+
+    corrected = []
+    changed = False
+    for word in words:
+        if word not in known and is_vocabulary_word(word):
+            closest = _closest_word(word, org_id, using)
+            if closest is not None:
+                word = closest
+                changed = True
+        corrected.append(word)
+    return ' '.join(corrected) if changed else text
@@ -0,0 +1,14 @@
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from .index_queue import queue_stats
+
+
+@staff_member_required
+def index_queue_status(request):
+    """Depth and lag of the search index queue. Used for monitoring."""
+    the_data = json.dumps(queue_stats(), cls=DjangoJSONEncoder)
+    return HttpResponse(the_data, content_type='application/json')
@@ -60,6 +60,7 @@ def home(request):
     resNeedActionQset = resources_in_org.filter(current_user__id=request.user.id).filter(status=Resource.RES_ASSIGNED)
     for res in resNeedActionQset:
         needActEntryDict = {}
+        needActEntryDict['id'] = res.pk
         needActEntryDict['name'] = res.name
         needActEntryDict['ack_url'] = request.build_absolute_uri(res.get_acknowledge_url())
         needActEntryDict['deny_url'] = request.build_absolute_uri(res.get_deny_url())
@@ -74,6 +75,7 @@ def home(request):
                                              status=Resource.RES_DISPUTE)
     for res in resDisputeQset:
         disputeEntryDict = {}
+        disputeEntryDict['id'] = res.pk
         disputeEntryDict['name'] = res.get_name()
         disputeEntryDict['ack_url'] = request.build_absolute_uri(res.get_acknowledge_url())
         disputeEntryDict['detail_url'] = request.build_absolute_uri(res.get_absolute_url())
@@ -45,6 +45,8 @@ INSTALLED_APPS = [
     'haystack', # to power our search
     'apps.Resource',
     'apps.ChangeHistory',
+    'apps.Search',
+    'apps.Mail',
     # Apps required for mail
     'naomi',  # Helps seeing the mail in browser
     'django_inlinecss',  # Used to inline the css.
@@ -238,6 +240,7 @@ LOGGING = {
 # OUR_EMAIL_BACKEND = "console"
 # OUR_EMAIL_BACKEND = "smtp"
 # OUR_EMAIL_BACKEND = "naomi"
+# OUR_EMAIL_BACKEND = "sink"
 OUR_EMAIL_BACKEND = os.getenv('OUR_EMAIL_BACKEND', default="naomi")
 
 if OUR_EMAIL_BACKEND == "console":
@@ -257,30 +260,116 @@ elif OUR_EMAIL_BACKEND == "smtp":
     EMAIL_HOST_PASSWORD =  os.getenv('EMAIL_HOST_PASSWORD')
     EMAIL_PORT = os.getenv('EMAIL_PORT')
     EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS')
+elif OUR_EMAIL_BACKEND == "sink":
+    # Local SMTP server discarding the mails, for load tests. Started with
+    # 'python manage.py run_smtp_sink'. See apps/Mail/smtp_sink.py
+    print("EMAIL_BACKEND = SMTP sink")
+    EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+    EMAIL_HOST = os.getenv('SMTP_SINK_HOST', default='127.0.0.1')
+    EMAIL_PORT = int(os.getenv('SMTP_SINK_PORT', default='8025'))
 else:
     print("EMAIL_BACKEND = None")
 
 # Email address mentioned in 'From' when mails are sent.
 EMAIL_FROM_ADDRESS = 'no-reply<no-reply@trackzilla.in'
 
+# The mails are queued in the outbox by the requests and sent by
+# 'python manage.py run_mail_worker' (see apps/Mail/outbox.py). A mail failing for a
+# temporary reason is retried after MAIL_OUTBOX_RETRY_DELAY seconds, doubled on every
+# attempt up to MAIL_OUTBOX_MAX_RETRY_DELAY, and given up on (kept as dead-lettered)
+# after MAIL_OUTBOX_MAX_ATTEMPTS attempts.
+MAIL_OUTBOX_MAX_ATTEMPTS = 8
+MAIL_OUTBOX_RETRY_DELAY = 60
+MAIL_OUTBOX_MAX_RETRY_DELAY = 3600
+# The mails of a batch are claimed by the worker sending them for
+# MAIL_OUTBOX_CLAIM_TIMEOUT seconds, so that other workers skip them. Keep it well above
+# the time taken to send a batch: a mail whose claim expired may be sent again by another
+# worker.
+MAIL_OUTBOX_CLAIM_TIMEOUT = 600
+
+# The assignments and disputes of devices are mailed to each recipient in a digest, sent
+# MAIL_DIGEST_WINDOW seconds after his first notification (0 to mail them right away).
+# The kinds listed in MAIL_DIGEST_IMMEDIATE_KINDS ('assigned', 'dispute') are mailed
+# right away, along with the pending ones. Both can be overridden per Org in the admin
+# (Mail > Org notification settings). See apps/Mail/digest.py
+MAIL_DIGEST_WINDOW = 300
+MAIL_DIGEST_IMMEDIATE_KINDS = []
+
+# The mail templates are rendered from their versions compiled by
+# 'python manage.py compile_mail_templates' (CSS inlined, plain text variants generated)
+# stored here. Templates not compiled are compiled by each process on first use. See
+# apps/Mail/compiled.py
+MAIL_COMPILED_TEMPLATES_ROOT = os.path.join(BASE_DIR, 'compiled_templates')
+
 ######################################################################################
 # Configure Search
-# Using Haystack plugin with ElasticSearch 2.x backend
-
-HAYSTACK_CONNECTIONS = {
-    'default': {
-        'ENGINE': 'haystack.backends.elasticsearch2_backend.Elasticsearch2SearchEngine',
-        'URL': 'http://elasticsearch:9200/',
-        'INDEX_NAME': 'haystack',
-        'INCLUDE_SPELLING': True,
-        'TIMEOUT' : 60,
-    },
-}
+# Using Haystack plugin with ElasticSearch 2.x backend. Set the env SEARCH_BACKEND to
+# 'database' to index in the database instead (SQLite FTS5 / Postgres tsvector, see
+# apps/Search/backends.py), for deployments without an Elasticsearch service.
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', default='elasticsearch')
+
+if SEARCH_BACKEND == 'database':
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'apps.Search.backends.DatabaseSearchEngine',
+            'INCLUDE_SPELLING': True,
+        },
+    }
+else:
+    HAYSTACK_CONNECTIONS = {
+        'default': {
+            'ENGINE': 'haystack.backends.elasticsearch2_backend.Elasticsearch2SearchEngine',
+            'URL': 'http://elasticsearch:9200/',
+            'INDEX_NAME': 'haystack',
+            'INCLUDE_SPELLING': True,
+            'TIMEOUT' : 60,
+        },
+    }
 
-# Add the RealtimeSignalsProcessor so that the index is updated everytime new data is added.
-# This should be ok for our application because the frequency with which new resources are
-# added or updated would be quite low.
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# Saves and deletes of indexed objects only queue them in the DB. The index is updated in
+# batches by 'python manage.py run_index_worker' (the 'index_worker' service) so that
+# requests never wait on Elasticsearch. Use 'haystack.signals.RealtimeSignalProcessor'
+# to update the index as part of every save instead.
+HAYSTACK_SIGNAL_PROCESSOR = 'apps.Search.signals.QueuedSignalProcessor'
+# Engine answering the autocomplete suggestions of the search box (see
+# apps/Search/autocomplete.py). 'apps.Search.autocomplete.LocalPrefixAutocompleteEngine'
+# answers them from the memory of the web worker instead of Elasticsearch. It holds up to
+# SEARCH_AUTOCOMPLETE_LOCAL_MAX_ENTRIES words per worker and only sees changes made by
+# other processes after SEARCH_AUTOCOMPLETE_LOCAL_MAX_AGE seconds, unless CACHES is a
+# shared cache.
+SEARCH_AUTOCOMPLETE_ENGINE = 'apps.Search.autocomplete.SearchIndexAutocompleteEngine'
+SEARCH_AUTOCOMPLETE_LOCAL_MAX_ENTRIES = 500000
+SEARCH_AUTOCOMPLETE_LOCAL_MAX_AGE = 300
+# Pages of search results are cached per Org in CACHES for up to
+# SEARCH_RESULT_CACHE_TIMEOUT seconds (0 disables it) and invalidated when the index of
+# the Org changes (see apps/Search/result_cache.py). Spelling suggestions ("Maybe try")
+# are only asked for when a search has at most SEARCH_SPELLING_SUGGESTION_MAX_HITS hits.
+SEARCH_RESULT_CACHE_TIMEOUT = 300
+SEARCH_SPELLING_SUGGESTION_MAX_HITS = 5
+# The 'reindex' command (see apps/Search/reindex.py) indexes the Resources modified since
+# its last run. It starts SEARCH_REINDEX_OVERLAP seconds earlier, to cover the clock skew
+# of the app servers and the transactions committed after the run started.
+SEARCH_REINDEX_OVERLAP = 300
+######################################################################################
+# Change History
+# Backend used by the ChangeHistoryMixin to store the history entries. The table backend
+# appends one row per change into its own table instead of rewriting the JSON list
+# stored in the 'history' column of every tracked object.
+# Use 'apps.ChangeHistory.backends.FieldHistoryBackend' to store it in the column.
+# After changing it, run 'python manage.py move_history' to move the existing history
+# into the new backend. It is not shown otherwise.
+CHANGE_HISTORY_BACKEND = 'apps.ChangeHistory.backends.TableHistoryBackend'
+# Codec and compression used to store the values of HistoryFields. Existing values are
+# decoded based on the header they were stored with. After changing these, run
+# 'python manage.py rewrite_history' to convert the existing rows.
+# Codecs: 'json', 'orjson' and 'msgpack' (when installed).
+# Compression: 'none', 'zlib' and 'zstd' (when zstandard is installed).
+CHANGE_HISTORY_CODEC = 'json'
+CHANGE_HISTORY_COMPRESSION = 'none'
+# Number of history entries recorded for an object after which the 'snapshot_history'
+# command takes a new snapshot of it. Bounds the number of entries replayed while
+# reconstructing the state of an object at a point in time. Run the command from cron.
+CHANGE_HISTORY_SNAPSHOT_EVERY = 50
 ######################################################################################
 # Setting required by the django.contrib.sites package.
 SITE_ID = 1
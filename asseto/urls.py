@@ -19,6 +19,8 @@ from apps.Users import views as user_views
 from django.contrib.auth import views as auth_views
 # import haystack
 from apps.Resource.views import ResourceSearchView, autocomplete
+from apps.Search.views import index_queue_status
+from apps.Mail.views import mail_outbox_status
 
 urlpatterns = [
     path('', include('apps.Users.urls')),
@@ -31,6 +33,8 @@ urlpatterns = [
     path('resource/', include('apps.Resource.urls')),
     path('search/', ResourceSearchView.as_view(), name='haystack_search'),
     path('search/autocomplete/', autocomplete, name='autocomplete'),
+    path('search/index-queue.json', index_queue_status, name='index-queue-status'),
+    path('mail/outbox.json', mail_outbox_status, name='mail-outbox-status'),
     # path('search/', include('haystack.urls')), #TODO: Remove once the above search view is stable
     path('', include('apps.Organization.urls')),
     path('select2/', include('django_select2.urls')),
@@ -11,23 +11,32 @@ then
     echo "PostgreSQL started"
 fi
 
-echo "Waiting for elasticsearch..."
-# Note: Using the service name "elasticsearch" and port "9200" defined in docker-compose 
-# file. Ideally the depends-on in compose file should take care of this, but if we donot
-# wait here, the haystack plugin seems to be connecting to elastic search and throws 
-# errors like below.
-# Starting new HTTP connection (15): elasticsearch:9200
-# ConnectionRefusedError: [Errno 111] Connection refused
-
-while ! nc -z elasticsearch 9200; do
-  sleep 0.1
-done
-echo "Elasticsearch started."
+# Not needed when the search index is kept in the database (SEARCH_BACKEND=database).
+if [ "$SEARCH_BACKEND" != "database" ]
+then
+    echo "Waiting for elasticsearch..."
+    # Note: Using the service name "elasticsearch" and port "9200" defined in docker-compose 
+    # file. Ideally the depends-on in compose file should take care of this, but if we donot
+    # wait here, the haystack plugin seems to be connecting to elastic search and throws 
+    # errors like below.
+    # Starting new HTTP connection (15): elasticsearch:9200
+    # ConnectionRefusedError: [Errno 111] Connection refused
+
+    while ! nc -z elasticsearch 9200; do
+      sleep 0.1
+    done
+    echo "Elasticsearch started."
+fi
 
 # Collect static files
 echo "Collect static files"
 python manage.py collectstatic --noinput
 
+# Inline the CSS of the mail templates once instead of for every mail. Uses the static
+# files collected above.
+echo "Compile mail templates"
+python manage.py compile_mail_templates
+
 # Make database migrations
 echo "Making database migrations"
 python manage.py makemigrations
@@ -36,9 +45,11 @@ python manage.py makemigrations
 echo "Apply database migrations"
 python manage.py migrate
 
-# Rebuilding Haystack search index. Remove entries which are not in DB
-echo "Rebuilding Haystack search index"
-python manage.py rebuild_index --noinput
+# Index the changes made since the last start and remove the entries of the objects
+# which are not in the DB any more. An interrupted run is resumed. Changes to the fields
+# of search_indexes.py need 'python manage.py rebuild_index' instead.
+echo "Updating Haystack search index"
+python manage.py reindex --workers ${REINDEX_WORKERS:-4} --verify --fix
 
 # Start server
 echo "Starting server"
@@ -56,4 +56,11 @@ then
     echo "EMAIL_PORT=587" >> .env
     echo "EMAIL_HOST_USER=your_account@gmail.com" >> .env
     echo "EMAIL_HOST_PASSWORD=your account’s password" >> .env
-fi
\ No newline at end of file
+fi
+
+# Uncomment the search backend required. "database" keeps the search index in the DB
+# above and does not need the elasticsearch service.
+SEARCH_BACKEND="elasticsearch"
+# SEARCH_BACKEND="database"
+
+echo "SEARCH_BACKEND=$SEARCH_BACKEND" >> .env